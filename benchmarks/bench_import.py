@@ -0,0 +1,57 @@
+'''
+Measures the time to import the myfitbit modules used by read-only
+workflows, in fresh interpreters, against a budget.
+
+    python benchmarks/bench_import.py [--repeat N]
+
+Prints the best time of N runs for every module, minus the start
+up time of a bare interpreter, and exits with status 1 if a module
+is over its budget.
+'''
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# milliseconds
+BUDGET = {
+    'myfitbit': 40,
+    'myfitbit.export': 60,
+    'myfitbit.report': 60,
+}
+
+
+def run(code, repeat):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    best = None
+    for i in range(repeat):
+        t = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', code], env=env)
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    base = run('pass', args.repeat)
+    print('{:<20} {:8.1f}ms'.format('python', base * 1000))
+    over = []
+    for module, budget in sorted(BUDGET.items()):
+        t = (run('import ' + module, args.repeat) - base) * 1000
+        status = 'ok' if t <= budget else 'OVER BUDGET'
+        print('{:<20} {:8.1f}ms  budget {:4d}ms  {}'.format(module, t, budget, status))
+        if t > budget:
+            over.append(module)
+    if over:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+'''
+Compares the intraday bucketing of myfitbit.intraday with the
+per-sample loop the loaders used before.
+
+    python benchmarks/bench_intraday.py [--repeat N]
+
+Uses the example heartrate data, repeated N times.
+'''
+import argparse
+import glob
+import json
+import os
+import time
+
+from myfitbit import intraday
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), '..', 'notebooks', 'example_data')
+
+
+def legacy(datasets):
+    def compress(data):
+        minutes = [None] * 24 * 60
+        for o in data:
+            h, m, s = map(int, o['time'].split(':'))
+            i = h * 60 + m
+            minutes[i] = o['value']
+        return minutes
+    return [compress(data) for data in datasets]
+
+
+def python(datasets):
+    np = intraday.np
+    intraday.np = None
+    try:
+        return intraday.bucket(datasets)
+    finally:
+        intraday.np = np
+
+
+def timeit(fn, *args):
+    best = None
+    for i in range(3):
+        t = time.perf_counter()
+        result = fn(*args)
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(EXAMPLE, 'heartrate_intraday', '*', '*.json')))
+    datasets = [json.load(open(f)) for f in files] * args.repeat
+    print('{} days, {} samples'.format(len(datasets), sum(map(len, datasets))))
+
+    base, expected = timeit(legacy, datasets)
+    print('{:<28} {:8.3f}s'.format('legacy compress()', base))
+    cases = [('bucket, python', python)]
+    if intraday.np is not None:
+        cases += [
+            ('bucket, numpy', intraday.bucket),
+            ('bucket_days (arrays)', intraday.bucket_days),
+        ]
+    for name, fn in cases:
+        t, result = timeit(fn, datasets)
+        if isinstance(result, list):
+            assert result == expected
+        print('{:<28} {:8.3f}s  {:5.1f}x'.format(name, t, base / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+'''
+Benchmarks of the loaders, the store and the report on synthetic
+multi-year histories (see myfitbit.synthetic).
+
+    python benchmarks/bench_suite.py [--years 3] [--users 2] [--repeat 3]
+
+The data is generated once into --data and reused by later runs.
+Every case records the best time of --repeat runs and the peak
+memory allocated by Python (tracemalloc) during one more run.
+
+Results are saved as benchmarks/results/<version>-<time>.json and
+compared with the previous result for the same data; cases more
+than --threshold slower are reported, and make the run exit with
+status 1.
+'''
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import myfitbit
+from myfitbit import synthetic
+from myfitbit.export import FitbitExport, BUFFER_DAYS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS = os.path.join(HERE, 'results')
+
+
+def measure(fn, repeat):
+    '''
+    Returns (best time in seconds, peak memory in bytes) of `fn()`.
+    '''
+    best = None
+    for i in range(repeat):
+        t = time.perf_counter()
+        fn()
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def cases(root, user_id):
+    '''
+    [(name, fn), ...] of the benchmarks on the export of `user_id`.
+    '''
+    from myfitbit import report
+    ex = FitbitExport(root, user_id=user_id)
+    scratch = tempfile.mkdtemp()
+    day = ex.read(next(ex.stored_days('heartrate_intraday'))[1])
+
+    def write():
+        out = FitbitExport(scratch, user_id=user_id)
+        for i in range(100):
+            out.write(out.filename('bench', '{}.json'.format(i)), day)
+
+    def sleep_index():
+        ex.sleep_index()
+        # built from the month files every time
+        os.remove(ex.filename('sleep_index.json'))
+
+    def rollups():
+        from myfitbit.rollup import Rollups
+        Rollups(ex).update()
+        shutil.rmtree(ex.filename('rollups'))
+
+    def make_report():
+        data = report.build_data(ex, os.path.join(scratch, 'cache'),
+            os.path.join(scratch, 'detail'))
+        report.make_report(data)
+        shutil.rmtree(os.path.join(scratch, 'cache'))
+
+    return [
+        ('day_filenames', lambda: list(ex.day_filenames('heartrate_intraday'))),
+        ('stored_days', lambda: list(ex.stored_days('heartrate_intraday'))),
+        ('get_heartrate_intraday', ex.get_heartrate_intraday),
+        ('get_heartrate_intraday parallel',
+            lambda: ex.get_heartrate_intraday(processes=os.cpu_count())),
+        ('get_steps_intraday', ex.get_steps_intraday),
+        ('get_activities', ex.get_activities),
+        ('get_sleep', ex.get_sleep),
+        ('sleep_index', sleep_index),
+        ('rollups', rollups),
+        ('write x100', write),
+        ('report', make_report),
+    ], scratch
+
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+            cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous(dataset):
+    '''
+    The latest saved result for `dataset`, or None.
+    '''
+    for filename in sorted(glob.glob(os.path.join(RESULTS, '*.json')),
+            key=os.path.getmtime, reverse=True):
+        result = json.load(open(filename))
+        if result['dataset'] == dataset:
+            return filename, result
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--years', type=float, default=3)
+    parser.add_argument('--users', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data', default=os.path.join(tempfile.gettempdir(), 'myfitbit-bench'),
+        help='directory of the synthetic export, reused between runs')
+    parser.add_argument('--threshold', type=float, default=1.25,
+        help='report cases slower than this factor of the previous result')
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    end = date.today() - timedelta(days=BUFFER_DAYS + 1)
+    start = end - timedelta(days=int(args.years * 365) - 1)
+    dataset = '{}y-{}u-seed{}'.format(args.years, args.users, args.seed)
+    root = os.path.join(args.data, dataset)
+    user_ids = ['SYN{:03d}'.format(i) for i in range(args.users)]
+    marker = os.path.join(root, 'generated-{}'.format(end.isoformat()))
+    if not os.path.isfile(marker):
+        shutil.rmtree(root, ignore_errors=True)
+        t = time.perf_counter()
+        count = synthetic.generate(root, user_ids, start, end, args.seed)
+        print('Generated {} files in {:.1f}s'.format(count, time.perf_counter() - t))
+        open(marker, 'w').close()
+
+    results = {}
+    # the first user; the others make the tree as large as a household's
+    benchmarks, scratch = cases(root, user_ids[0])
+    try:
+        for name, fn in benchmarks:
+            t, peak = measure(fn, args.repeat)
+            results[name] = {'seconds': t, 'peak_bytes': peak}
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    last = previous(dataset)
+    slower = []
+    print('{:<32} {:>10} {:>10} {:>10}'.format('case', 'time', 'peak MB', 'vs last'))
+    for name, r in results.items():
+        change = ''
+        if last and name in last[1]['results']:
+            ratio = r['seconds'] / last[1]['results'][name]['seconds']
+            change = '{:.2f}x'.format(ratio)
+            if ratio > args.threshold:
+                slower.append(name)
+                change += ' SLOWER'
+        print('{:<32} {:>9.3f}s {:>10.1f} {:>10}'.format(
+            name, r['seconds'], r['peak_bytes'] / 1e6, change))
+    if last:
+        print('compared with {}'.format(os.path.basename(last[0])))
+
+    if not args.no_save:
+        os.makedirs(RESULTS, exist_ok=True)
+        version = git_version() or myfitbit.__version__
+        filename = os.path.join(RESULTS, '{}-{}.json'.format(
+            version, time.strftime('%Y%m%dT%H%M%S')))
+        with open(filename, 'w') as f:
+            json.dump({
+                'version': version,
+                'time': time.time(),
+                'dataset': dataset,
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+        print('Saved {}'.format(filename))
+    if slower:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
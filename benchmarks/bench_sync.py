@@ -0,0 +1,64 @@
+'''
+End-to-end sync throughput against the mock API (myfitbit.mockapi),
+with latency and injected failures, for several numbers of workers.
+
+    python benchmarks/bench_sync.py [--days 60] [--workers 1 4 8]
+        [--latency 0.05] [--error-rate 0.02] [--truncate-rate 0.02]
+
+Every run syncs the intraday heart rate, steps and distance of the
+last --days days into an empty export.
+'''
+import argparse
+import logging
+import shutil
+import tempfile
+import time
+from datetime import date, timedelta
+
+from myfitbit import Fitbit
+from myfitbit.export import FitbitExport, BUFFER_DAYS, INTRADAY_STREAMS
+from myfitbit.mockapi import MockFitbit
+
+
+def sync(api, days, workers):
+    '''
+    Returns (seconds, requests) of one sync of `days` days.
+    '''
+    root = tempfile.mkdtemp()
+    try:
+        client = Fitbit('BENCH{}'.format(workers), base_url=api.url, retries=10,
+            pool_size=max(10, workers))
+        export = FitbitExport(root, client, workers=workers, queue=True)
+        last = date.today() - timedelta(days=BUFFER_DAYS + 1)
+        for name in INTRADAY_STREAMS:
+            export.queue.planned[name] = (last - timedelta(days=days)).isoformat()
+        before = sum(api.stats.values())
+        t = time.perf_counter()
+        export.sync_days(INTRADAY_STREAMS)
+        return time.perf_counter() - t, sum(api.stats.values()) - before
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.02)
+    parser.add_argument('--truncate-rate', type=float, default=0.02)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    with MockFitbit(latency=args.latency, error_rate=args.error_rate,
+            truncate_rate=args.truncate_rate) as api:
+        print('{:>8} {:>10} {:>10} {:>10}'.format('workers', 'time', 'requests', 'days/s'))
+        for workers in args.workers:
+            t, requests = sync(api, args.days, workers)
+            print('{:>8} {:>9.2f}s {:>10} {:>10.1f}'.format(
+                workers, t, requests, 3 * args.days / t))
+        print('responses: {}'.format(dict(api.stats)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,16 @@
 from ._version import __version__, version
 
-import base64
 import re
 import os
 import json
 import logging
+import random
+import threading
 import time
 import urllib.parse
-import webbrowser
 
-import requests
-import http.server
+# requests, http.server and webbrowser are imported where they are
+# used, so reading an export does not load the networking stack
 
 __all__ = ['Fitbit', 'FitbitAuth']
 
@@ -21,6 +21,7 @@ class RedirectServer(object):
     PORT = 8189
     URL = 'http://localhost:{}/auth_code'.format(PORT)
     def __init__(self):
+        import http.server
         self.result = None
         class HTTPHandler(http.server.BaseHTTPRequestHandler):
             def do_GET(handler):
@@ -39,6 +40,7 @@ class RedirectServer(object):
         self.handler_class = HTTPHandler
 
     def get_result(self):
+        import http.server
         httpd = http.server.HTTPServer(('127.0.0.1', self.PORT), self.handler_class)
         httpd.timeout = 5
         for i in range(5):
@@ -49,13 +51,27 @@ class RedirectServer(object):
 
 
 class FitbitAuth(object):
+    '''
+    OAuth2 authorization of one Fitbit account.
+
+    The access token is cached in `token_file`; use one file
+    per account to export several accounts. Tokens are renewed
+    with their refresh token shortly before they expire, so the
+    browser is only needed the first time.
+    '''
     ACCESS_TOKEN_FILE = '.myfitbit_access_token'
-    def __init__(self, client_id, client_secret):
+    TOKEN_URL = 'https://api.fitbit.com/oauth2/token'
+    # refresh tokens this many seconds before they expire
+    REFRESH_MARGIN = 10 * 60
+
+    def __init__(self, client_id, client_secret, token_file=None):
         self.client_id = client_id
         self.client_secret = client_secret
+        self.token_file = token_file or self.ACCESS_TOKEN_FILE
         self.access_token = None
 
     def get_auth_code(self):
+        import webbrowser
         log.info('Getting new auth code')
         url = 'https://www.fitbit.com/oauth2/authorize?' + \
             '&'.join('{}={}'.format(k, v) for k, v in {
@@ -71,116 +87,350 @@ class FitbitAuth(object):
         result = redirect.get_result()
         return result['code'][0]
 
-    def get_access_token(self):
-        log.info('Getting new access token')
-        auth_code = self.get_auth_code()
+    def token_request(self, data):
+        '''
+        POSTs `data` to the token endpoint and returns the new
+        token, with the time it was issued as 'time'.
+        '''
+        import base64
+        import requests
+        now = int(time.time())
         auth_string = base64.b64encode(
             self.client_id.encode('ascii') + b':' + self.client_secret.encode('ascii')).decode('ascii')
-        r = requests.post('https://api.fitbit.com/oauth2/token',
+        r = requests.post(self.TOKEN_URL,
                 headers={
                     'Authorization': 'Basic ' + auth_string,
                 },
-                data={
-                    'clientId': self.client_id,
-                    'code': auth_code,
-                    'grant_type': 'authorization_code',
-                    'redirect_uri': RedirectServer.URL,
-                },
+                data=dict(data, clientId=self.client_id),
                 timeout=30
         )
         r.raise_for_status()
-        return json.loads(r.text)
+        access_token = json.loads(r.text)
+        access_token['time'] = now
+        return access_token
 
-    def ensure_access_token(self):
+    def get_access_token(self):
+        log.info('Getting new access token')
+        auth_code = self.get_auth_code()
+        return self.token_request({
+            'code': auth_code,
+            'grant_type': 'authorization_code',
+            'redirect_uri': RedirectServer.URL,
+        })
+
+    def refresh_access_token(self):
+        '''
+        Renews the access token with its refresh token, without the
+        browser. Refresh tokens can only be used once, so the new
+        token is saved right away.
+        '''
+        log.info('Refreshing access token')
+        self.access_token = self.token_request({
+            'grant_type': 'refresh_token',
+            'refresh_token': self.access_token['refresh_token'],
+        })
+        self.save_access_token()
+
+    def save_access_token(self):
+        from .codec import write_atomic
+        write_atomic(os.path.abspath(self.token_file), json.dumps(
+            self.access_token, sort_keys=True, indent=2).encode('utf-8'))
+
+    def expires_soon(self, margin=None):
+        '''
+        True if the access token expires within `margin`
+        seconds (REFRESH_MARGIN by default).
+        '''
+        if margin is None:
+            margin = self.REFRESH_MARGIN
+        return time.time() + margin > self.access_token['time'] + self.access_token['expires_in']
+
+    @property
+    def user_id(self):
+        return self.access_token and self.access_token.get('user_id')
+
+    def load_access_token(self):
+        '''
+        Loads the cached access token, refreshing it if it is about
+        to expire, without asking the browser for a new one.
+        Returns False if there is no valid token. The token file
+        is only dropped when the refresh token is rejected; other
+        refresh errors are raised once the access token has expired.
+        '''
+        import requests
         if self.access_token:
+            return True
+        if not os.path.isfile(self.token_file):
+            return False
+        self.access_token = json.load(open(self.token_file))
+        if not self.expires_soon():
+            return True
+        if self.access_token.get('refresh_token'):
+            try:
+                self.refresh_access_token()
+                return True
+            except requests.RequestException as e:
+                if not invalid_grant(e):
+                    # keep the refresh token for the next attempt
+                    if not self.expires_soon(0):
+                        log.info('Cannot refresh access token yet: %s', e)
+                        return True
+                    raise
+                log.info('Refresh token rejected: %s', e)
+        elif not self.expires_soon(0):
+            return True
+        log.info('Cached access token is expired')
+        self.access_token = None
+        os.unlink(self.token_file)
+        return False
+
+    def ensure_access_token(self):
+        if self.load_access_token():
             return
-        now = int(time.time())
-        if os.path.isfile(self.ACCESS_TOKEN_FILE):
-            access_token = json.load(open(self.ACCESS_TOKEN_FILE))
-            if now > access_token['time'] + access_token['expires_in']:
-                log.info('Cached access token is expired')
-                os.unlink(self.ACCESS_TOKEN_FILE)
-            else:
-                self.access_token = access_token
-                return
         self.access_token = self.get_access_token()
-        self.access_token['time'] = now
-        with open(self.ACCESS_TOKEN_FILE, 'w') as f:
-            json.dump(self.access_token, f, sort_keys=True, indent=2)
+        self.save_access_token()
+
+
+def invalid_grant(e):
+    '''
+    True if the requests exception `e` is the token endpoint
+    rejecting the grant (a used or revoked refresh token), as
+    opposed to a failure worth retrying.
+    '''
+    r = getattr(e, 'response', None)
+    if r is None or r.status_code not in (400, 401):
+        return False
+    try:
+        errors = json.loads(r.text).get('errors', [])
+    except ValueError:
+        return False
+    return any(o.get('errorType') == 'invalid_grant' for o in errors)
+
+
+def parse_rate_limit(headers):
+    '''
+    Returns the Fitbit rate limit headers as a dict:
+    {
+        "limit": int,       # requests allowed per window
+        "remaining": int,   # requests left in this window
+        "reset": int,       # seconds until the window resets
+        "time": float,      # when the headers were received
+    }
+    or None if the headers are not present.
+    '''
+    try:
+        return {
+            'limit': int(headers['Fitbit-Rate-Limit-Limit']),
+            'remaining': int(headers['Fitbit-Rate-Limit-Remaining']),
+            'reset': int(headers['Fitbit-Rate-Limit-Reset']),
+            'time': time.time(),
+        }
+    except (KeyError, ValueError):
+        return None
 
 
 class Fitbit(object):
-    def __init__(self, access_token):
-        self.access_token = access_token
+    '''
+    Fitbit web API client.
+
+    Requests go to `base_url` (the Fitbit API by default, see
+    mockapi for a local stand-in) and time out after `timeout`
+    seconds. Failed connections, timeouts, truncated bodies and
+    5xx responses are retried up to `retries` times, with jittered
+    exponential backoff. The session keeps up to
+    `pool_size` connections alive, for concurrent use from threads.
+
+    With a FitbitAuth `auth`, the access token is refreshed when it
+    is about to expire or is rejected.
+
+    The profile is only downloaded when it is first used. With
+    `profile_file` it is cached there, and downloaded again once
+    the cache is older than PROFILE_MAX_AGE. `user_id` comes from
+    the token or the cached profile when possible, so creating a
+    client sends no request.
+    '''
+    BASE_URL = 'https://api.fitbit.com'
+    RETRY_STATUS = (500, 502, 503, 504)
+    RETRY_BACKOFF = 1
+    PROFILE_MAX_AGE = 24 * 60 * 60
+
+    def __init__(self, access_token, timeout=30, retries=3, pool_size=10,
+                 auth=None, profile_file=None, base_url=None):
+        import requests
+        self.base_url = base_url or self.BASE_URL
+        self.timeout = timeout
+        self.retries = retries
+        self.auth = auth
+        self.profile_file = profile_file
+        self.lock = threading.Lock()
         self.session = requests.Session()
-        self.session.timeout = 30
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.set_access_token(access_token)
+        self.rate_limit = None
+        self._profile = None
+        self._user_id = auth and auth.user_id
+        if self._user_id is None:
+            cached = self.load_profile()
+            self._user_id = cached and cached['encodedId']
+
+    def set_access_token(self, access_token):
+        self.access_token = access_token
         self.session.headers['Authorization'] = 'Bearer ' + access_token
-        self.profile = self.get_profile()
+
+    def renew_access_token(self, rejected=None):
+        '''
+        Refreshes the access token through `auth` if it is about
+        to expire, or if it is `rejected` and no other thread has
+        refreshed it since.
+        '''
+        with self.lock:
+            if self.auth.access_token['access_token'] == rejected or self.auth.expires_soon():
+                self.auth.refresh_access_token()
+            self.set_access_token(self.auth.access_token['access_token'])
+
+    def load_profile(self, max_age=None):
+        '''
+        The cached profile, or None if there is none or it is
+        older than `max_age` seconds or unreadable.
+        '''
+        if not self.profile_file or not os.path.isfile(self.profile_file):
+            return None
+        if max_age is not None and time.time() - os.path.getmtime(self.profile_file) > max_age:
+            return None
+        try:
+            return json.load(open(self.profile_file))
+        except ValueError as e:
+            log.warning('Ignoring cached profile %s: %s', self.profile_file, e)
+            return None
+
+    @property
+    def profile(self):
+        if self._profile is None:
+            profile = self.load_profile(self.PROFILE_MAX_AGE)
+            if profile is None or (self._user_id and profile['encodedId'] != self._user_id):
+                import requests
+                try:
+                    profile = self.get_profile()
+                except requests.RequestException as e:
+                    # an outdated profile is better than none
+                    profile = self.load_profile()
+                    if profile is None or profile['encodedId'] != self._user_id:
+                        raise
+                    log.info('Using cached profile: %s', e)
+                else:
+                    if self.profile_file:
+                        from .codec import write_atomic
+                        write_atomic(os.path.abspath(self.profile_file), json.dumps(
+                            profile, sort_keys=True, indent=2).encode('utf-8'))
+            self._profile = profile
+            self._user_id = profile['encodedId']
+        return self._profile
 
     @property
     def user_id(self):
-        return self.profile['encodedId']
+        return self._user_id or self.profile['encodedId']
+
+    def get(self, url):
+        '''
+        GET `url` and return the decoded json body.
+
+        The rate limit headers of the response are kept in
+        `self.rate_limit`, as returned by `parse_rate_limit`.
+        '''
+        import requests
+        if self.auth is not None and self.auth.expires_soon():
+            self.renew_access_token()
+        attempt = 0
+        renewed = False
+        while 1:
+            access_token = self.access_token
+            try:
+                r = self.session.get(url, timeout=self.timeout)
+                self.rate_limit = parse_rate_limit(r.headers) or self.rate_limit
+                r.raise_for_status()
+                return json.loads(r.text)
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                if isinstance(e, requests.HTTPError) and e.response.status_code == 401 \
+                        and self.auth is not None and not renewed:
+                    log.info('Access token rejected: %s', e)
+                    self.renew_access_token(rejected=access_token)
+                    renewed = True
+                    continue
+                retry = not isinstance(e, requests.HTTPError) or \
+                    e.response.status_code in self.RETRY_STATUS
+                if not retry or attempt >= self.retries:
+                    raise
+                delay = random.uniform(0, self.RETRY_BACKOFF * 2 ** attempt)
+                attempt += 1
+                log.info('Retrying %s in %.1fs: %s', url, delay, e)
+                time.sleep(delay)
 
     def get_profile(self):
-        r = self.session.get('https://api.fitbit.com/1/user/-/profile.json')
-        r.raise_for_status()
-        return json.loads(r.text)['user']
+        return self.get(self.base_url + '/1/user/-/profile.json')['user']
 
     def get_sleep_range(self, date_start, date_end):
-        r = self.session.get('https://api.fitbit.com/1.2/user/{}/sleep/date/{}/{}.json'
-            .format(self.user_id, str(date_start), str(date_end)))
-        r.raise_for_status()
-        return json.loads(r.text)['sleep']
+        return self.get(self.base_url + '/1.2/user/{}/sleep/date/{}/{}.json'
+            .format(self.user_id, str(date_start), str(date_end)))['sleep']
 
-    def get_heartrate_intraday(self, date):
-        r = self.session.get('https://api.fitbit.com/1/user/-/activities/heart/date/{}/{}/1min.json'
-            .format(str(date), str(date)))
-        r.raise_for_status()
-        return json.loads(r.text)['activities-heart-intraday']['dataset']
+    def intraday_url(self, resource, date, start_time=None, end_time=None, resolution='1min'):
+        '''
+        URL of a day of intraday `resource`, or only of the minutes
+        from `start_time` to `end_time` ('HH:MM') if given, at detail
+        level `resolution` ('1sec' for heart rate only, '1min',
+        '5min' or '15min').
+        '''
+        if start_time is None:
+            return self.base_url + '/1/user/-/activities/{}/date/{}/{}/{}.json'.format(
+                resource, str(date), str(date), resolution)
+        return self.base_url + '/1/user/-/activities/{}/date/{}/1d/{}/time/{}/{}.json'.format(
+            resource, str(date), resolution, start_time, end_time or '23:59')
+
+    def get_heartrate_intraday(self, date, start_time=None, end_time=None, resolution='1min'):
+        return self.get(self.intraday_url('heart', date, start_time, end_time, resolution)
+            )['activities-heart-intraday']['dataset']
 
     def get_activities(self, date):
-        r = self.session.get('https://api.fitbit.com/1/user/-/activities/date/{}.json'
+        return self.get(self.base_url + '/1/user/-/activities/date/{}.json'
             .format(str(date)))
-        r.raise_for_status()
-        return json.loads(r.text)
    
-    def get_steps_intraday(self, date):
-        r = self.session.get('https://api.fitbit.com/1/user/-/activities/steps/date/{}/{}/1min.json'
-            .format( str(date), str(date) ))
-        r.raise_for_status()
-        return json.loads(r.text)['activities-steps-intraday']['dataset']
+    def get_steps_intraday(self, date, start_time=None, end_time=None, resolution='1min'):
+        return self.get(self.intraday_url('steps', date, start_time, end_time, resolution)
+            )['activities-steps-intraday']['dataset']
 
-    def get_distance_intraday(self, date):
-        r = self.session.get('https://api.fitbit.com/1/user/-/activities/distance/date/{}/{}/1min.json'
-            .format( str(date), str(date) ))
-        r.raise_for_status()
-        return json.loads(r.text)['activities-distance-intraday']['dataset']
+    def get_distance_intraday(self, date, start_time=None, end_time=None, resolution='1min'):
+        return self.get(self.intraday_url('distance', date, start_time, end_time, resolution)
+            )['activities-distance-intraday']['dataset']
 
     def get_weight_range(self, date_start, date_end):
-        r = self.session.get('https://api.fitbit.com/1/user/{}/body/log/weight/date/{}/{}.json'
-            .format(self.user_id, str(date_start), str(date_end)))
-        r.raise_for_status()
-        return json.loads(r.text)['weight']
+        return self.get(self.base_url + '/1/user/{}/body/log/weight/date/{}/{}.json'
+            .format(self.user_id, str(date_start), str(date_end)))['weight']
     
-    # currently *not in use functions*
+    def get_activities_range(self, resource, date_start, date_end):
+        '''
+        Gets the daily values of activity time series `resource`
+        (steps, calories, floors, minutesSedentary, ...):
+        [{"dateTime": "2018-01-01", "value": "1234"}, ...]
+        '''
+        return self.get(self.base_url + '/1/user/-/activities/{}/date/{}/{}.json'
+            .format(resource, str(date_start), str(date_end)))['activities-' + resource]
+
     def get_heartrate_range(self, date_start, date_end):
         """
         Gets daily heartrate summaries (resting, zones, calories)
-        This is the same information as synced through activities,
-        hence not currently in use.
+        This is the same information as synced through activities.
         """
-        r = self.session.get('https://api.fitbit.com/1/user/-/activities/heart/date/{}/{}.json'
-            .format(str(date_start), str(date_end)))
-        r.raise_for_status()
-        return json.loads(r.text)['activities-heart']
-        
+        return self.get(self.base_url + '/1/user/-/activities/heart/date/{}/{}.json'
+            .format(str(date_start), str(date_end)))['activities-heart']
+
+    # currently *not in use functions*
     def get_sleep(self, date):
         """
         Get single date of sleep data
         Currently not in use, gives same info as ranged, just
         one day per file instead of one month per file
         """
-        r = self.session.get('https://api.fitbit.com/1.2/user/{}/sleep/date/{}.json'
-            .format(self.user_id, str(date)))
-        r.raise_for_status()
-        return json.loads(r.text)['sleep']
+        return self.get(self.base_url + '/1.2/user/{}/sleep/date/{}.json'
+            .format(self.user_id, str(date)))['sleep']
@@ -8,11 +8,37 @@ import requests
 from requests.exceptions import HTTPError
 
 from . import Fitbit, FitbitAuth
+from .codec import CODECS
 from .export import FitbitExport
+from .scheduler import Scheduler, RateLimitExceeded
 
 logging.basicConfig(level=logging.DEBUG)
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=1,
+        help='number of concurrent downloads')
+    parser.add_argument('--wait', action='store_true',
+        help='wait for the rate limit to reset instead of exiting')
+    parser.add_argument('--daily-summaries', action='store_true',
+        help='sync daily summaries with range requests instead of '
+             'downloading the activities of every day')
+    parser.add_argument('--recent', action='store_true',
+        help='also sync the intraday data of the last days, '
+             'downloading only the minutes added since the last sync')
+    parser.add_argument('--codec', default='json', choices=CODECS,
+        help='encoding of new files in the export')
+    parser.add_argument('--sqlite', metavar='FILE',
+        help='also update the SQLite database FILE after syncing')
+    parser.add_argument('--heartrate-resolution', default='1min', choices=('1min', '1sec'),
+        help='detail level of new heart rate days; 1sec days are stored '
+             'as compact delta-encoded series')
+    parser.add_argument('--rollups', action='store_true',
+        help='also update the daily, weekly and monthly rollups (needs numpy)')
+    parser.add_argument('--columnar', action='store_true',
+        help='store intraday data in the columnar format (needs numpy)')
+    args = parser.parse_args()
+
     config = configparser.ConfigParser()
     config.read('myfitbit.ini')
 
@@ -23,7 +49,9 @@ def main():
     fa.ensure_access_token()
 
     try:
-        f = Fitbit(access_token=fa.access_token['access_token'])
+        f = Fitbit(access_token=fa.access_token['access_token'],
+            pool_size=max(10, args.workers), auth=fa,
+            profile_file=fa.token_file + '.profile')
         print(json.dumps(f.profile, indent=2))
     except requests.exceptions.HTTPError as e:
         print(e.response.status_code)
@@ -32,22 +60,24 @@ def main():
             return
         raise
 
-    export = FitbitExport('.', f)
+    export = FitbitExport('.', Scheduler(f, wait=args.wait),
+        workers=args.workers, queue=True, columnar=args.columnar, manifest=True,
+        codec=args.codec, resolutions={'heartrate_intraday': args.heartrate_resolution})
     try:
-        # Montly summaries per file
-        export.sync_weight()
-        export.sync_sleep()
-        # Daily summaries per file
-        export.sync_activities()
-        # Daily (intraday) data per file
-        export.sync_heartrate_intraday()
-        export.sync_steps_intraday()
-        export.sync_distance_intraday()
-
+        export.sync_all(recent=args.recent, daily_summaries=args.daily_summaries)
+    except RateLimitExceeded as e:
+        print(e)
     except HTTPError as e:
         status_code = e.response.status_code
         #    if status_code == '429':
         print( "HTTP error status code: {0}".format(status_code) )
+
+    if args.sqlite:
+        from .database import update
+        update(export, args.sqlite)
+    if args.rollups:
+        from .rollup import update
+        update(export)
         
 if __name__ == '__main__':
     main()
@@ -0,0 +1,76 @@
+'''
+asyncio interface to the Fitbit web API.
+'''
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from . import Fitbit
+
+
+class AsyncFitbit(object):
+    '''
+    asyncio counterpart of Fitbit: every `get_*` method of the
+    Fitbit client is available as a coroutine with the same
+    arguments, e.g.
+
+        async with await AsyncFitbit.connect(token) as f:
+            days = await asyncio.gather(*(
+                f.get_heartrate_intraday(d) for d in dates))
+
+    The requests run on the keep-alive connection pool of a single
+    Fitbit session, at most `concurrency` at a time; further calls
+    wait for a free slot. Timeouts and retries are those of `client`.
+    '''
+    def __init__(self, client, concurrency=8):
+        self.client = client
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    @classmethod
+    async def connect(cls, access_token, concurrency=8, **kwargs):
+        '''
+        Creates the Fitbit client (which may read its cached
+        profile) without blocking the event loop. `kwargs` go
+        to Fitbit.
+        '''
+        loop = asyncio.get_running_loop()
+        client = await loop.run_in_executor(None, functools.partial(
+            Fitbit, access_token, pool_size=concurrency, **kwargs))
+        return cls(client, concurrency)
+
+    @property
+    def user_id(self):
+        return self.client.user_id
+
+    @property
+    def profile(self):
+        return self.client.profile
+
+    def __getattr__(self, name):
+        fn = getattr(self.client, name)
+        if not (name.startswith('get_') and callable(fn)):
+            return fn
+
+        @functools.wraps(fn)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, functools.partial(fn, *args, **kwargs))
+        return call
+
+    async def close(self):
+        '''
+        Waits for the running requests, without blocking the
+        event loop, and closes the session.
+        '''
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, functools.partial(
+            self.executor.shutdown, wait=True))
+        self.client.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -0,0 +1,321 @@
+'''
+Encodings of the files in the local store.
+
+    json        indented json, as the API objects are usually shown
+    compact     json without whitespace
+    gzip        compact json, gzip compressed
+    lzma        compact json, xz compressed
+    records     length-prefixed binary records, see encode_records
+
+Files keep their .json names whatever the codec; readers detect the
+codec from the first bytes of the file, so a store may mix codecs.
+
+Intraday days at 1 second resolution are always written as
+delta-encoded integer series, see encode_series. They are not
+re-encoded with the other codecs.
+'''
+import array
+import gzip
+import io
+import itertools
+import json
+import logging
+import lzma
+import os
+import struct
+import sys
+import zlib
+
+log = logging.getLogger(__name__)
+
+CODECS = ('json', 'compact', 'gzip', 'lzma', 'records')
+
+GZIP_MAGIC = b'\x1f\x8b'
+LZMA_MAGIC = b'\xfd7zXZ\x00'
+RECORDS_MAGIC = b'MFBR'
+SERIES_MAGIC = b'MFBS'
+
+# kinds of records files
+RECORDS_OBJECT = 0
+RECORDS_LIST = 1
+
+# samples, first second, first value, typecodes of the time and value deltas
+SERIES_HEADER = struct.Struct('<IiiBB')
+
+
+def compact(data):
+    return json.dumps(data, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+
+def encode_records(data):
+    '''
+    RECORDS_MAGIC, one byte RECORDS_LIST or RECORDS_OBJECT, then
+    every item of a list (or the single object) as a little-endian
+    uint32 length followed by that many bytes of compact json.
+    '''
+    if isinstance(data, list):
+        kind, items = RECORDS_LIST, data
+    else:
+        kind, items = RECORDS_OBJECT, [data]
+    parts = [RECORDS_MAGIC, bytes((kind,))]
+    for item in items:
+        b = compact(item)
+        parts.append(struct.pack('<I', len(b)))
+        parts.append(b)
+    return b''.join(parts)
+
+
+def decode_records(b):
+    kind = b[len(RECORDS_MAGIC)]
+    i = len(RECORDS_MAGIC) + 1
+    items = []
+    while i < len(b):
+        n, = struct.unpack_from('<I', b, i)
+        i += 4
+        items.append(json.loads(b[i:i + n].decode('utf-8')))
+        i += n
+    if kind == RECORDS_OBJECT:
+        return items[0]
+    return items
+
+
+def delta_typecode(deltas):
+    '''
+    The smallest signed array typecode that holds `deltas`.
+    '''
+    low = min(deltas, default=0)
+    high = max(deltas, default=0)
+    for typecode, bits in (('b', 8), ('h', 16), ('i', 32)):
+        if -2 ** (bits - 1) <= low and high < 2 ** (bits - 1):
+            return typecode
+    raise ValueError('Delta too large for a series: {}'.format(max(-low, high)))
+
+
+def to_bytes(typecode, items):
+    a = array.array(typecode, items)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a.tobytes()
+
+
+def from_bytes(typecode, b):
+    a = array.array(typecode)
+    a.frombytes(b)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+
+def encode_series(dataset):
+    '''
+    An intraday dataset [{"time": "HH:MM:SS", "value": int}, ...],
+    sorted by time, as SERIES_MAGIC, SERIES_HEADER and the zlib
+    compressed differences between consecutive seconds and values,
+    in the smallest integer type that holds them. Runs of samples
+    one second apart with a steady value compress to almost nothing.
+    '''
+    seconds = []
+    values = []
+    for o in dataset:
+        h, m, sec = o['time'].split(':')
+        seconds.append(int(h) * 3600 + int(m) * 60 + int(sec))
+        if not isinstance(o['value'], int) or isinstance(o['value'], bool):
+            raise ValueError('Series values must be integers: {!r}'.format(o['value']))
+        values.append(o['value'])
+    dt = [b - a for a, b in zip(seconds, seconds[1:])]
+    dv = [b - a for a, b in zip(values, values[1:])]
+    t_code = delta_typecode(dt)
+    v_code = delta_typecode(dv)
+    header = SERIES_HEADER.pack(len(values), seconds[0] if seconds else 0,
+        values[0] if values else 0, ord(t_code), ord(v_code))
+    return SERIES_MAGIC + header + zlib.compress(to_bytes(t_code, dt) + to_bytes(v_code, dv))
+
+
+def series_parts(b):
+    '''
+    (samples, first second, first value, time deltas, value deltas)
+    of an encoded series, the deltas as (typecode, bytes).
+    '''
+    n, t0, v0, t_code, v_code = SERIES_HEADER.unpack_from(b, len(SERIES_MAGIC))
+    body = zlib.decompress(b[len(SERIES_MAGIC) + SERIES_HEADER.size:])
+    t_code, v_code = chr(t_code), chr(v_code)
+    split = max(n - 1, 0) * array.array(t_code).itemsize
+    return n, t0, v0, (t_code, body[:split]), (v_code, body[split:])
+
+
+def decode_series_lists(b):
+    '''
+    (seconds, values) lists of an encoded series.
+    '''
+    n, t0, v0, dt, dv = series_parts(b)
+    if not n:
+        return [], []
+    seconds = itertools.accumulate(itertools.chain([t0], from_bytes(*dt)))
+    values = itertools.accumulate(itertools.chain([v0], from_bytes(*dv)))
+    return list(seconds), list(values)
+
+
+def decode_series(b):
+    seconds, values = decode_series_lists(b)
+    return [{'time': '{:02d}:{:02d}:{:02d}'.format(t // 3600, t // 60 % 60, t % 60), 'value': v}
+        for t, v in zip(seconds, values)]
+
+
+def decode_series_arrays(b):
+    '''
+    (seconds, values) numpy arrays of an encoded series, without
+    building the samples as objects.
+    '''
+    import numpy as np
+    n, t0, v0, dt, dv = series_parts(b)
+    arrays = []
+    for first, (typecode, data) in ((t0, dt), (v0, dv)):
+        a = np.empty(n, dtype=np.int64)
+        if n:
+            a[0] = first
+            a[1:] = np.frombuffer(data, dtype='<' + typecode)
+            np.cumsum(a, out=a)
+        arrays.append(a)
+    return tuple(arrays)
+
+
+def encode(data, codec='json'):
+    '''
+    Encodes `data` with `codec`, returns bytes.
+    '''
+    if codec == 'json':
+        return json.dumps(data, indent=2, sort_keys=True).encode('utf-8')
+    if codec == 'compact':
+        return compact(data)
+    if codec == 'gzip':
+        # mtime=0 keeps the output, and so its hash, deterministic
+        # (gzip.compress only takes mtime from Python 3.8)
+        f = io.BytesIO()
+        with gzip.GzipFile(fileobj=f, mode='wb', mtime=0) as g:
+            g.write(compact(data))
+        return f.getvalue()
+    if codec == 'lzma':
+        return lzma.compress(compact(data))
+    if codec == 'records':
+        return encode_records(data)
+    if codec == 'series':
+        return encode_series(data)
+    raise ValueError('Unknown codec: {}'.format(codec))
+
+
+def detect(b):
+    '''
+    Name of the codec of the encoded bytes `b`. Plain json
+    files are reported as 'json', indented or not.
+    '''
+    if b.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if b.startswith(LZMA_MAGIC):
+        return 'lzma'
+    if b.startswith(RECORDS_MAGIC):
+        return 'records'
+    if b.startswith(SERIES_MAGIC):
+        return 'series'
+    return 'json'
+
+
+def decode(b):
+    '''
+    Decodes bytes written by `encode` with any codec.
+    '''
+    codec = detect(b)
+    if codec == 'gzip':
+        b = gzip.decompress(b)
+    elif codec == 'lzma':
+        b = lzma.decompress(b)
+    elif codec == 'records':
+        return decode_records(b)
+    elif codec == 'series':
+        return decode_series(b)
+    return json.loads(b.decode('utf-8'))
+
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        return decode(f.read())
+
+
+def write_atomic(filename, b):
+    '''
+    Writes bytes `b` to `filename` through a temporary file in the
+    same directory, so readers never see a partially written file.
+    The file keeps its mode, new files get the mode of open().
+    '''
+    dirname = os.path.dirname(filename)
+    os.makedirs(dirname, exist_ok=True)
+    try:
+        mode = os.stat(filename).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = None
+    prefix = os.path.join(dirname, '.' + os.path.basename(filename))
+    while True:
+        tmp_filename = '{}.{}.tmp'.format(prefix, os.urandom(6).hex())
+        try:
+            # created like open() does, so the umask applies
+            fd = os.open(tmp_filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+            break
+        except FileExistsError:
+            continue
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b)
+            f.flush()
+            os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(tmp_filename, mode)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
+
+
+def reencode(root, codec):
+    '''
+    Re-encodes every store file under `root` with `codec`.
+    Returns the number of files rewritten.
+    '''
+    from .manifest import parse_filename
+    count = 0
+    for dirname, dirs, files in os.walk(root):
+        for basename in files:
+            if parse_filename(basename) is None:
+                continue
+            filename = os.path.join(dirname, basename)
+            with open(filename, 'rb') as f:
+                b = f.read()
+            if detect(b) == 'series':
+                continue
+            encoded = encode(decode(b), codec)
+            if encoded == b:
+                continue
+            write_atomic(filename, encoded)
+            count += 1
+    return count
+
+
+def main():
+    import argparse
+    from .export import FitbitExport
+    from .manifest import Manifest
+    parser = argparse.ArgumentParser(description='Re-encode the files of the local store')
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--codec', required=True, choices=CODECS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    export = FitbitExport('.', user_id=args.user)
+    count = reencode(export.filename(), args.codec)
+    log.info('Re-encoded %d files as %s', count, args.codec)
+    manifest_filename = export.filename('manifest.json')
+    if count and os.path.isfile(manifest_filename):
+        # sizes and hashes have changed
+        Manifest(manifest_filename).rebuild(export.filename())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+'''
+Binary columnar store for intraday data.
+
+Every stream keeps one file per year holding a fixed-width
+(days in year x 1440) array, one value per minute, plus a bitmap
+with one bit per day of the year that is set once the day has
+been synced:
+
+    "name"/"year"/"name.year.bin"
+    "name"/"year"/"name.year.days"
+
+Minutes without a sample hold the stream's missing value
+(see STREAMS).
+Files are memory-mapped on read, so loaders return views into
+the file instead of parsing json.
+
+Requires numpy.
+'''
+import os
+import logging
+from datetime import date, timedelta
+
+import numpy as np
+
+from . import intraday
+
+log = logging.getLogger(__name__)
+
+MINUTES = 24 * 60
+
+# dtype and missing value of every intraday stream
+STREAMS = {
+    'heartrate_intraday':   (np.dtype('<i2'), -1),
+    'steps_intraday':       (np.dtype('<i4'), -1),
+    'distance_intraday':    (np.dtype('<f8'), np.nan),
+}
+
+
+def days_in_year(year):
+    return (date(year + 1, 1, 1) - date(year, 1, 1)).days
+
+
+class ColumnarStore(object):
+    '''
+    Columnar intraday data of one user, rooted at the user directory.
+    '''
+    def __init__(self, root):
+        self.root = root
+        # open (days, values) memmaps by (name, year)
+        self.years = {}
+
+    def filenames(self, name, year):
+        base = os.path.join(self.root, name, '{:04d}'.format(year),
+            '{}.{:04d}'.format(name, year))
+        return base + '.bin', base + '.days'
+
+    def open(self, name, year, writable=False):
+        '''
+        Returns (days, values) memmaps of stream `name` for `year`.
+        `days` is the packed presence bitmap, `values` the
+        (days in year x MINUTES) array.
+
+        Read-only opens return None for years that do not exist,
+        writable opens create them.
+        '''
+        key = (name, year)
+        if key in self.years:
+            days, values = self.years[key]
+            if values.mode == 'r+' or not writable:
+                return days, values
+        dtype, missing = STREAMS[name]
+        shape = (days_in_year(year), MINUTES)
+        bin_filename, days_filename = self.filenames(name, year)
+        if not os.path.isfile(bin_filename):
+            if not writable:
+                return None
+            os.makedirs(os.path.dirname(bin_filename), exist_ok=True)
+            values = np.memmap(bin_filename, dtype=dtype, mode='w+', shape=shape)
+            values[:] = missing
+            values.flush()
+            with open(days_filename, 'wb') as f:
+                f.write(bytes((shape[0] + 7) // 8))
+        mode = 'r+' if writable else 'r'
+        days = np.memmap(days_filename, dtype=np.uint8, mode=mode)
+        values = np.memmap(bin_filename, dtype=dtype, mode=mode, shape=shape)
+        self.years[key] = days, values
+        return days, values
+
+    def close(self):
+        for days, values in self.years.values():
+            if days.mode == 'r+':
+                days.flush()
+                values.flush()
+        self.years.clear()
+
+    def has_day(self, name, d):
+        year = self.open(name, d.year)
+        if year is None:
+            return False
+        i = d.timetuple().tm_yday - 1
+        return bool(year[0][i // 8] & (0x80 >> (i % 8)))
+
+    def write_day(self, name, d, dataset):
+        '''
+        Stores a day's dataset as returned by the Fitbit API,
+        and marks the day as present.
+        '''
+        dtype, missing = STREAMS[name]
+        days, values = self.open(name, d.year, writable=True)
+        i = d.timetuple().tm_yday - 1
+        row = values[i]
+        row[:] = missing
+        if dataset:
+            value, present = intraday.bucket_days([dataset])
+            row[present[0]] = value[0][present[0]]
+        days[i // 8] |= 0x80 >> (i % 8)
+
+    def read(self, name, start=None, end=None):
+        '''
+        Returns the data of stream `name` between `start` and `end`
+        (inclusive) as a list of (first_date, present, values),
+        one per year, where `present` is a bool array of days
+        and `values` a (days x MINUTES) view into the year file.
+        '''
+        dirname = os.path.join(self.root, name)
+        if not os.path.isdir(dirname):
+            return []
+        result = []
+        for year in sorted(int(y) for y in os.listdir(dirname) if y.isdigit()):
+            if start and year < start.year or end and year > end.year:
+                continue
+            opened = self.open(name, year)
+            if opened is None:
+                continue
+            days, values = opened
+            present = np.unpackbits(days)[:len(values)].astype(bool)
+            a = 0
+            b = len(values)
+            if start and start.year == year:
+                a = start.timetuple().tm_yday - 1
+            if end and end.year == year:
+                b = end.timetuple().tm_yday
+            result.append((
+                date(year, 1, 1) + timedelta(days=a),
+                present[a:b],
+                values[a:b],
+            ))
+        return result
+
+    def iter_days(self, name, start=None, end=None):
+        '''
+        Yields (date, minutes) for every present day with data,
+        where `minutes` is a view of that day's row.
+        '''
+        dtype, missing = STREAMS[name]
+        for first, present, values in self.read(name, start, end):
+            for i in np.flatnonzero(present):
+                row = values[i]
+                if np.isnan(missing):
+                    empty = np.isnan(row).all()
+                else:
+                    empty = (row == missing).all()
+                if not empty:
+                    yield first + timedelta(days=int(i)), row
+
+
+def to_minutes(name, row):
+    '''
+    Converts a row of minutes to the list format of
+    FitbitExport.get_*_intraday, with None for missing minutes.
+    '''
+    dtype, missing = STREAMS[name]
+    mask = np.isnan(row) if np.isnan(missing) else row == missing
+    minutes = row.astype(object)
+    minutes[mask] = None
+    return minutes.tolist()
+
+
+def migrate(export, names=None, remove=False):
+    '''
+    Copies the json day files of `export` into its columnar store.
+    With `remove`, the json files are deleted once copied.
+    '''
+    store = ColumnarStore(export.filename())
+    for name in names or sorted(STREAMS):
+        count = 0
+        for d, filename in export.day_filenames(name):
+            if not os.path.isfile(filename):
+                continue
+            store.write_day(name, d, export.read(filename))
+            count += 1
+            if remove:
+                os.remove(filename)
+        log.info('Migrated %d days of %s', count, name)
+    store.close()
+
+
+def main():
+    import argparse
+    from .export import FitbitExport
+    parser = argparse.ArgumentParser(
+        description='Convert json intraday files to the columnar store')
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--remove', action='store_true',
+        help='delete the json files once converted')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    migrate(FitbitExport('.', user_id=args.user), remove=args.remove)
+
+
+if __name__ == '__main__':
+    main()
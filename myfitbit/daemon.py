@@ -0,0 +1,400 @@
+'''
+Long-running sync daemon with a local query API.
+
+    python -m myfitbit.daemon [--roster roster.ini] [--interval 3600] [--port 8191]
+
+The daemon keeps a warm client (session, access token, profile) and
+export of every account, and syncs them every `interval` seconds,
+or as soon as a rate limit that ran out resets. Recent days of every
+stream are kept in a size-bounded LRU cache; files written by a sync
+drop their days from it.
+
+The query API listens on localhost and answers json:
+
+    GET /status
+        time of the last and next sync, the cache statistics
+    GET /users
+        ["123ABC", ...]
+    GET /<user id>/<stream>?start=YYYY-MM-DD&end=YYYY-MM-DD
+        the days of `stream` (see STREAMS) in the format of the
+        FitbitExport readers; for sleep and weight the records
+
+Without a roster the account of myfitbit.ini is served, as
+`python -m myfitbit` syncs it.
+'''
+import configparser
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict, namedtuple
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .export import FitbitExport, INTRADAY_STREAMS, date_range, parse_date
+from .manifest import parse_filename
+
+log = logging.getLogger(__name__)
+
+# streams served by the query API
+STREAMS = INTRADAY_STREAMS + ('activities', 'daily', 'sleep', 'weight')
+
+# streams answered with records instead of days
+RECORD_STREAMS = ('sleep', 'weight')
+
+# longest date range of one query
+MAX_QUERY_DAYS = 3 * 366
+
+# an account served by the daemon: `export` syncs it, `reader`
+# reads its files for the queries
+Account = namedtuple('Account', 'name user_id export reader')
+
+
+class LRUCache(object):
+    '''
+    Thread-safe LRU cache of at most `size` entries.
+
+    `version` changes whenever entries are invalidated, so a value
+    read from disk while a sync replaced the file is not cached.
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        '''
+        Returns (True, value), or (False, None) for missing keys.
+        '''
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value, version=None):
+        '''
+        Caches `value`, unless entries were invalidated since
+        `version` was read.
+        '''
+        with self.lock:
+            if version is not None and version != self.version:
+                return
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, match):
+        '''
+        Removes the entries whose key `match(key)` is true.
+        '''
+        with self.lock:
+            self.version += 1
+            for key in [k for k in self.entries if match(k)]:
+                del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'size': self.size,
+                'hits': self.hits, 'misses': self.misses}
+
+
+class CachedExport(FitbitExport):
+    '''
+    FitbitExport that drops the days of every file it writes from
+    `cache`, whose keys are (user id, stream, 'YYYY-MM-DD').
+    '''
+    def __init__(self, root, client, cache, **kwargs):
+        super(CachedExport, self).__init__(root, client, **kwargs)
+        self.cache = cache
+
+    def invalidate(self, name, key):
+        # a day, a month or (daily summaries) a year
+        user_id = self.client.user_id
+        self.cache.invalidate(lambda k: k[0] == user_id and k[1] == name
+            and k[2].startswith(key))
+
+    def write(self, filename, data):
+        b = super(CachedExport, self).write(filename, data)
+        parsed = parse_filename(os.path.basename(filename))
+        if parsed is not None:
+            self.invalidate(*parsed[:2])
+        elif os.path.basename(filename).startswith('daily.'):
+            self.invalidate('daily', os.path.basename(filename).split('.')[1])
+        return b
+
+    def save(self, job, data):
+        super(CachedExport, self).save(job, data)
+        self.invalidate(job.name, job.key)
+
+
+def load_days(reader, name, start, end):
+    '''
+    {date: value} of stream `name` from `start` to `end`, read from
+    the files of `reader`; days without data are None.
+    '''
+    values = dict.fromkeys(date_range(start, end))
+    if name in INTRADAY_STREAMS:
+        items = reader.iter_intraday(name, start, end)
+    elif name == 'activities':
+        items = reader.iter_activities(start, end)
+    elif name == 'daily':
+        items = reader.iter_daily(start, end)
+    else:
+        items = []
+        for filename in reader.stored_months(name, start, end):
+            for r in reader.read(filename) or []:
+                d = parse_date(r.get('dateOfSleep') or r['date'])
+                if start <= d <= end:
+                    values[d] = (values[d] or []) + [r]
+    for item in items:
+        values[parse_date(item['date'])] = item
+    return values
+
+
+class Daemon(object):
+    '''
+    Syncs and serves `accounts`, see the module docstring.
+
+    `cache_days` bounds the number of (account, stream, day) entries
+    cached. After every sync the last `warm_days` days of every
+    stream are loaded into the cache. `sync_options` are the keyword
+    arguments of FitbitExport.sync_all.
+    '''
+    def __init__(self, accounts, cache, interval=3600, warm_days=14, sync_options=None):
+        self.accounts = OrderedDict((a.user_id, a) for a in accounts)
+        self.cache = cache
+        self.interval = interval
+        self.warm_days = warm_days
+        self.sync_options = sync_options or {}
+        self.last_sync = None
+        self.next_sync = time.time()
+        self.stopped = threading.Event()
+        self.httpd = None
+        self.threads = []
+
+    def sync(self):
+        '''
+        Syncs every account once. Returns the time of the next sync:
+        after `interval`, or when the first exhausted rate limit
+        resets.
+        '''
+        from requests.exceptions import RequestException
+        from .scheduler import RateLimitExceeded
+        next_sync = time.time() + self.interval
+        for account in self.accounts.values():
+            try:
+                account.export.sync_all(**self.sync_options)
+            except RateLimitExceeded as e:
+                log.info('%s: %s', account.name, e)
+                next_sync = min(next_sync, e.reset)
+            except RequestException as e:
+                log.warning('%s: sync failed: %s', account.name, e)
+            self.warm(account.user_id)
+        self.last_sync = time.time()
+        return next_sync
+
+    def warm(self, user_id):
+        end = date.today()
+        start = end - timedelta(days=self.warm_days - 1)
+        for name in STREAMS:
+            self.query(user_id, name, start, end)
+
+    def run_syncs(self):
+        while not self.stopped.is_set():
+            if time.time() >= self.next_sync:
+                try:
+                    self.next_sync = self.sync()
+                except Exception:
+                    log.exception('Sync failed')
+                    self.next_sync = time.time() + self.interval
+                log.info('Next sync in %.0fs', self.next_sync - time.time())
+            self.stopped.wait(max(1, self.next_sync - time.time()))
+
+    def query(self, user_id, name, start, end):
+        '''
+        The days of stream `name` of account `user_id` from `start`
+        to `end` with data, or for sleep and weight the records.
+        Days not in the cache are read from disk and cached.
+        '''
+        reader = self.accounts[user_id].reader
+        result = []
+        missing = []
+        for d in date_range(start, end):
+            found, value = self.cache.get((user_id, name, d.isoformat()))
+            if not found:
+                missing.append(d)
+            result.append((d, value))
+        if missing:
+            version = self.cache.version
+            loaded = {}
+            # read the missing days a contiguous range at a time
+            first = last = missing[0]
+            for d in missing[1:] + [None]:
+                if d is not None and d == last + timedelta(days=1):
+                    last = d
+                    continue
+                values = load_days(reader, name, first, last)
+                for day, value in values.items():
+                    self.cache.put((user_id, name, day.isoformat()), value, version)
+                loaded.update(values)
+                first = last = d
+            result = [(d, loaded[d] if d in loaded else value) for d, value in result]
+        if name in RECORD_STREAMS:
+            return [r for d, value in result for r in value or []]
+        return [value for d, value in result if value is not None]
+
+    def status(self):
+        return {
+            'users': list(self.accounts),
+            'last_sync': self.last_sync,
+            'next_sync': self.next_sync,
+            'cache': self.cache.stats(),
+        }
+
+    def handler_class(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                log.debug(format, *args)
+
+            def send(self, status, body):
+                body = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urllib.parse.urlparse(self.path)
+                parts = [p for p in url.path.split('/') if p]
+                if parts == ['status']:
+                    return self.send(200, daemon.status())
+                if parts == ['users']:
+                    return self.send(200, list(daemon.accounts))
+                if len(parts) != 2 or parts[0] not in daemon.accounts or parts[1] not in STREAMS:
+                    return self.send(404, {'error': 'Not found: {}'.format(url.path)})
+                params = urllib.parse.parse_qs(url.query)
+                try:
+                    end = parse_date(params['end'][0]) if 'end' in params else date.today()
+                    start = parse_date(params['start'][0]) if 'start' in params else end
+                except ValueError as e:
+                    return self.send(400, {'error': 'Bad date: {}'.format(e)})
+                if not start <= end < start + timedelta(days=MAX_QUERY_DAYS):
+                    return self.send(400, {'error': 'Bad date range, at most {} days'.format(
+                        MAX_QUERY_DAYS)})
+                self.send(200, daemon.query(parts[0], parts[1], start, end))
+
+        return Handler
+
+    def start(self, host='127.0.0.1', port=8191, sync=True):
+        '''
+        Starts the query API on `host`:`port` (0 picks a free port)
+        and, with `sync`, the sync thread.
+        '''
+        self.httpd = ThreadingHTTPServer((host, port), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.threads = [threading.Thread(target=self.httpd.serve_forever, daemon=True)]
+        if sync:
+            self.threads.append(threading.Thread(target=self.run_syncs, daemon=True))
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def stop(self):
+        self.stopped.set()
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+
+def make_account(name, auth, cache, root='.', workers=1, codec='json', resolutions=None):
+    '''
+    Account of the FitbitAuth `auth`, which must have a valid token.
+    '''
+    from . import Fitbit
+    from .scheduler import Scheduler
+    client = Fitbit(auth.access_token['access_token'], pool_size=max(10, workers),
+        auth=auth, profile_file=auth.token_file + '.profile')
+    export = CachedExport(root, Scheduler(client), cache, workers=workers, queue=True,
+        manifest=True, codec=codec, resolutions=resolutions)
+    # queries read the files, not the manifest the sync is changing
+    reader = FitbitExport(root, user_id=client.user_id, resolutions=resolutions)
+    return Account(name, client.user_id, export, reader)
+
+
+def main():
+    import argparse
+    from . import FitbitAuth
+    from .codec import CODECS
+    parser = argparse.ArgumentParser(description='Sync on a schedule and serve a local query API')
+    parser.add_argument('--roster', help='sync and serve the accounts of this roster')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8191)
+    parser.add_argument('--interval', type=int, default=3600,
+        help='seconds between syncs')
+    parser.add_argument('--cache-days', type=int, default=5000,
+        help='number of days (of one stream of one account) cached')
+    parser.add_argument('--warm-days', type=int, default=14,
+        help='days of every stream loaded into the cache after a sync')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--daily-summaries', action='store_true')
+    parser.add_argument('--codec', default='json', choices=CODECS)
+    parser.add_argument('--heartrate-resolution', default='1min', choices=('1min', '1sec'))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,
+        format='%(asctime)s %(threadName)s %(name)s: %(message)s')
+
+    config = configparser.ConfigParser()
+    config.read('myfitbit.ini')
+    client_auth = (config['fitbit_auth']['client_id'], config['fitbit_auth']['client_secret'])
+
+    cache = LRUCache(args.cache_days)
+    options = {'workers': args.workers, 'codec': args.codec,
+        'resolutions': {'heartrate_intraday': args.heartrate_resolution}}
+    accounts = []
+    if args.roster:
+        from .roster import load_roster
+        for user in load_roster(args.roster):
+            fa = FitbitAuth(*client_auth, token_file=user.token_file)
+            if not fa.load_access_token():
+                log.warning('%s: no valid access token, run python -m myfitbit.roster '
+                    '--authorize %s', user.name, user.name)
+                continue
+            accounts.append(make_account(user.name, fa, cache, **options))
+    else:
+        fa = FitbitAuth(*client_auth)
+        fa.ensure_access_token()
+        accounts.append(make_account('default', fa, cache, **options))
+
+    daemon = Daemon(accounts, cache, interval=args.interval, warm_days=args.warm_days,
+        sync_options={'recent': True, 'daily_summaries': args.daily_summaries})
+    daemon.start(args.host, args.port)
+    log.info('Serving %s on %s', ', '.join(daemon.accounts), daemon.url)
+    try:
+        while 1:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    daemon.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+'''
+SQLite copy of the local store, for ad hoc queries.
+
+Every stream of one or more users is loaded into one database:
+
+    heartrate_intraday, steps_intraday, distance_intraday
+        (user, date, minute, value), one row per minute with data
+    daily
+        (user, date, name, value, stream), the numeric daily summaries
+        of the activities files (stream 'activities') and of the
+        sync_daily files (stream 'daily')
+    sleep
+        (user, log_id, date_of_sleep, start_time, end_time, ...)
+    sleep_stages
+        (user, log_id, time, level, seconds), the levels.data series
+    weight
+        (user, log_id, date, time, weight, bmi, fat)
+
+The database is updated incrementally: the `sources` table keeps the
+signature of every file loaded, and `update` only reloads the files
+that changed since (and removes the rows of deleted files).
+'''
+import logging
+import os
+import sqlite3
+from datetime import date
+
+from .export import INTRADAY_STREAMS, read_intraday
+from .manifest import parse_filename
+
+log = logging.getLogger(__name__)
+
+# number of source files loaded per transaction
+BATCH_FILES = 100
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sources (
+    user TEXT, stream TEXT, key TEXT, signature TEXT,
+    PRIMARY KEY (user, stream, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS daily (
+    user TEXT, date TEXT, name TEXT, value NUMERIC, stream TEXT,
+    PRIMARY KEY (user, date, name, stream)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sleep (
+    user TEXT, log_id INTEGER, month TEXT, date_of_sleep TEXT,
+    start_time TEXT, end_time TEXT, type TEXT, is_main_sleep INTEGER,
+    minutes_asleep INTEGER, minutes_awake INTEGER, time_in_bed INTEGER,
+    efficiency INTEGER,
+    PRIMARY KEY (user, log_id)
+);
+CREATE INDEX IF NOT EXISTS sleep_date ON sleep (user, date_of_sleep);
+CREATE INDEX IF NOT EXISTS sleep_start ON sleep (user, start_time);
+CREATE TABLE IF NOT EXISTS sleep_stages (
+    user TEXT, log_id INTEGER, time TEXT, level TEXT, seconds INTEGER,
+    PRIMARY KEY (user, log_id, time)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS weight (
+    user TEXT, log_id INTEGER, month TEXT, date TEXT, time TEXT,
+    weight REAL, bmi REAL, fat REAL,
+    PRIMARY KEY (user, log_id)
+);
+CREATE INDEX IF NOT EXISTS weight_date ON weight (user, date);
+''' + ''.join('''
+CREATE TABLE IF NOT EXISTS {0} (
+    user TEXT, date TEXT, minute INTEGER, value NUMERIC,
+    PRIMARY KEY (user, date, minute)
+) WITHOUT ROWID;
+'''.format(name) for name in INTRADAY_STREAMS)
+
+
+def minute_rows(user, d, dataset):
+    for o in dataset:
+        h, m, s = o['time'].split(':')
+        yield user, d, int(h) * 60 + int(m), o['value']
+
+
+def daily_rows(user, d, values, stream):
+    for name, value in values.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield user, d, name, value, stream
+
+
+class Database(object):
+    '''
+    SQLite database in `filename`, see the module docstring.
+    `conn` is the sqlite3 connection, for queries.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename, timeout=60)
+        # WAL lets readers query while a sync is loading
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.migrate()
+        self.conn.executescript(SCHEMA)
+
+    def migrate(self):
+        '''
+        Drops the daily table of older databases, where the streams
+        overwrote each other, so its files are loaded again.
+        '''
+        columns = self.conn.execute('PRAGMA table_info(daily)').fetchall()
+        if not columns or any(c[1] == 'stream' and c[5] for c in columns):
+            return
+        with self.conn:
+            self.conn.execute('DROP TABLE daily')
+            self.conn.execute("DELETE FROM sources WHERE stream IN ('activities', 'daily')")
+
+    def close(self):
+        self.conn.close()
+
+    def sources(self, export, name):
+        '''
+        Yields (key, filename) of the stored files of stream `name`,
+        `filename` is None for years of the columnar store.
+        '''
+        if name in INTRADAY_STREAMS and export.in_columnar(name):
+            root = export.filename(name)
+            for year in sorted(os.listdir(root) if os.path.isdir(root) else []):
+                if year.isdigit():
+                    yield year, None
+        elif name in INTRADAY_STREAMS or name == 'activities':
+            for d, filename in export.stored_days(name):
+                yield d.isoformat(), filename
+        elif name == 'daily':
+            root = export.filename('daily')
+            if os.path.isdir(root):
+                for year in sorted(y for y in os.listdir(root) if y.isdigit()):
+                    yield year, export.daily_filename(int(year))
+        else:
+            for filename in export.stored_months(name):
+                yield parse_filename(os.path.basename(filename))[1], filename
+
+    def signature(self, export, name, key, filename):
+        if filename is not None:
+            return export.file_signature(name, key, filename)
+        sig = []
+        for filename in export.columnar.filenames(name, int(key)):
+            st = os.stat(filename)
+            sig.append('{} {}'.format(st.st_mtime_ns, st.st_size))
+        return ' '.join(sig)
+
+    def delete(self, user, name, key):
+        '''
+        Removes the rows loaded from source `key` of stream `name`.
+        '''
+        c = self.conn
+        # a year (columnar and daily files) or a day
+        if len(key) == 4:
+            first, last = key + '-01-01', key + '-12-31'
+        else:
+            first = last = key
+        if name in INTRADAY_STREAMS:
+            c.execute('DELETE FROM {} WHERE user = ? AND date BETWEEN ? AND ?'.format(name),
+                (user, first, last))
+        elif name in ('activities', 'daily'):
+            c.execute('DELETE FROM daily WHERE user = ? AND stream = ? AND date BETWEEN ? AND ?',
+                (user, name, first, last))
+        elif name == 'sleep':
+            c.execute('DELETE FROM sleep_stages WHERE user = ? AND log_id IN '
+                '(SELECT log_id FROM sleep WHERE user = ? AND month = ?)', (user, user, key))
+            c.execute('DELETE FROM sleep WHERE user = ? AND month = ?', (user, key))
+        elif name == 'weight':
+            c.execute('DELETE FROM weight WHERE user = ? AND month = ?', (user, key))
+
+    def insert(self, export, user, name, key, filename):
+        '''
+        Loads the rows of source `key` of stream `name`.
+        '''
+        c = self.conn
+        if name in INTRADAY_STREAMS and filename is None:
+            from .columnar import to_minutes
+            start = date(int(key), 1, 1)
+            end = date(int(key), 12, 31)
+            rows = []
+            for d, minutes in export.columnar.iter_days(name, start, end):
+                d = d.isoformat()
+                rows.extend((user, d, i, v) for i, v in
+                    enumerate(to_minutes(name, minutes)) if v is not None)
+            c.executemany('INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?)'.format(name), rows)
+            return
+        if name in INTRADAY_STREAMS:
+            c.executemany('INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?)'.format(name),
+                minute_rows(user, key, read_intraday(filename) or []))
+            return
+        data = export.read(filename)
+        if name == 'activities':
+            c.executemany('INSERT OR REPLACE INTO daily VALUES (?, ?, ?, ?, ?)',
+                daily_rows(user, key, data.get('summary', {}), name))
+        elif name == 'daily':
+            for d, values in sorted(data.items()):
+                c.executemany('INSERT OR REPLACE INTO daily VALUES (?, ?, ?, ?, ?)',
+                    daily_rows(user, d, values, name))
+        elif name == 'sleep':
+            c.executemany('INSERT OR REPLACE INTO sleep VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+                (user, s['logId'], key, s['dateOfSleep'], s['startTime'], s['endTime'],
+                 s.get('type'), s.get('isMainSleep'), s.get('minutesAsleep'),
+                 s.get('minutesAwake'), s.get('timeInBed'), s.get('efficiency'))
+                for s in data or []])
+            c.executemany('INSERT OR REPLACE INTO sleep_stages VALUES (?, ?, ?, ?, ?)', [
+                (user, s['logId'], o['dateTime'], o['level'], o['seconds'])
+                for s in data or [] for o in s.get('levels', {}).get('data', [])])
+        elif name == 'weight':
+            c.executemany('INSERT OR REPLACE INTO weight VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [
+                (user, w['logId'], key, w['date'], w.get('time'),
+                 w.get('weight'), w.get('bmi'), w.get('fat'))
+                for w in data or []])
+
+    def update(self, export, names=None):
+        '''
+        Loads the files of `export` that changed since the last
+        update into the database. Returns the number of files loaded.
+        '''
+        user = export.client and export.client.user_id or export.user_id
+        count = 0
+        for name in names or STREAMS:
+            loaded = dict(self.conn.execute(
+                'SELECT key, signature FROM sources WHERE user = ? AND stream = ?',
+                (user, name)))
+            changed = []
+            for key, filename in self.sources(export, name):
+                signature = self.signature(export, name, key, filename)
+                if loaded.pop(key, None) != signature:
+                    changed.append((key, filename, signature))
+
+            # sources that are gone
+            with self.conn:
+                for key in loaded:
+                    self.delete(user, name, key)
+                    self.conn.execute('DELETE FROM sources WHERE user = ? AND stream = ? AND key = ?',
+                        (user, name, key))
+            for i in range(0, len(changed), BATCH_FILES):
+                with self.conn:
+                    for key, filename, signature in changed[i:i + BATCH_FILES]:
+                        self.delete(user, name, key)
+                        self.insert(export, user, name, key, filename)
+                        self.conn.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)',
+                            (user, name, key, signature))
+            if changed:
+                log.info('Loaded %d files of %s', len(changed), name)
+            count += len(changed)
+        return count
+
+    # queries
+    def intraday(self, user, name, start, end):
+        '''
+        [(date, minute, value), ...] of stream `name` from `start`
+        to `end` (inclusive dates).
+        '''
+        return self.conn.execute(
+            'SELECT date, minute, value FROM {} WHERE user = ? AND date BETWEEN ? AND ? '
+            'ORDER BY date, minute'.format(name),
+            (user, str(start), str(end))).fetchall()
+
+    def daily(self, user, name, start, end, stream=None):
+        '''
+        [(date, value), ...] of daily summary `name` (steps,
+        restingHeartRate, ...) from `start` to `end`. Without a
+        `stream`, days in both take the 'activities' value.
+        '''
+        if stream:
+            return self.conn.execute(
+                'SELECT date, value FROM daily WHERE user = ? AND name = ? AND stream = ? '
+                'AND date BETWEEN ? AND ? ORDER BY date',
+                (user, name, stream, str(start), str(end))).fetchall()
+        rows = self.conn.execute(
+            'SELECT date, value FROM daily WHERE user = ? AND name = ? '
+            'AND date BETWEEN ? AND ? ORDER BY date, stream',
+            (user, name, str(start), str(end)))
+        result = []
+        for d, value in rows:
+            if not result or result[-1][0] != d:
+                result.append((d, value))
+        return result
+
+
+# streams loaded by Database.update, in order
+STREAMS = INTRADAY_STREAMS + ('activities', 'daily', 'sleep', 'weight')
+
+
+def update(export, filename):
+    '''
+    Updates the database `filename` from `export`.
+    '''
+    db = Database(filename)
+    try:
+        return db.update(export)
+    finally:
+        db.close()
+
+
+def main():
+    import argparse
+    from .export import FitbitExport
+    parser = argparse.ArgumentParser(description='Load the local store into a SQLite database')
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--db', default='myfitbit.sqlite',
+        help='database file, updated if it exists')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    export = FitbitExport('.', user_id=args.user, manifest=True)
+    count = update(export, args.db)
+    log.info('Loaded %d changed files into %s', count, args.db)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,223 @@
 
 import os
-import json
+import functools
+import glob
+import itertools
 import logging
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, time, timedelta
 
+from . import codec
+
 log = logging.getLogger(__name__)
 
 # number of days to leave out to give you time to fully sync
 # usually a Fitbit device can hold 4-7 days in memory
 BUFFER_DAYS = 5
 
+# streams with intraday (minute) data
+INTRADAY_STREAMS = (
+    'heartrate_intraday',
+    'steps_intraday',
+    'distance_intraday',
+)
+
+# daily summary time series synced by sync_daily
+DAILY_RESOURCES = (
+    'steps',
+    'distance',
+    'floors',
+    'elevation',
+    'calories',
+    'caloriesBMR',
+    'activityCalories',
+    'minutesSedentary',
+    'minutesLightlyActive',
+    'minutesFairlyActive',
+    'minutesVeryActive',
+)
+
+# longest date range of a single time series request
+MAX_RANGE_DAYS = 365
+
+# number of days read and bucketed together by iter_intraday
+CHUNK_DAYS = 31
+
+# streams stored as one file per day, in the order they are synced
+DAY_STREAMS = (
+    'activities',
+    'heartrate_intraday',
+    'steps_intraday',
+    'distance_intraday',
+)
+
+# a single file to download: `client_fn(*args)` is written to `filename`.
+# `name` and `key` identify it in the job queue; key is None for
+# jobs that are not queued
+Job = namedtuple('Job', 'name key filename client_fn args')
+
+def parse_date(s):
+    '''Parses an ISO 'YYYY-MM-DD' date.'''
+    return date(*map(int, s.split('-')))
+
+def date_range(start, end):
+    '''The dates from `start` to `end`, inclusive.'''
+    d = start
+    while d <= end:
+        yield d
+        d += timedelta(days=1)
+
+def read_intraday(filename, resolution='1min'):
+    '''
+    Reads an intraday day file. Days stored at 1 second resolution
+    are downsampled to `resolution`, see intraday.downsample.
+    '''
+    with open(filename, 'rb') as f:
+        b = f.read()
+    if codec.detect(b) != 'series':
+        return codec.decode(b)
+    from . import intraday
+    if intraday.np is not None:
+        seconds, values = codec.decode_series_arrays(b)
+    else:
+        seconds, values = codec.decode_series_lists(b)
+    return intraday.downsample(seconds, values, resolution)
+
+def record_date(r):
+    '''
+    Date of a sleep or weight record.
+    '''
+    return r.get('dateOfSleep') or r.get('date')
+
+def merge_records(old, new, start, end):
+    '''
+    Merges sleep or weight records `new`, downloaded for the days
+    `start` to `end`, into `old`. Old records of those days are
+    replaced, records are matched by logId and sorted by date.
+    '''
+    first = start.isoformat()
+    last = end.isoformat()
+    records = {}
+    for r in old:
+        if not (first <= record_date(r) <= last):
+            records[r['logId']] = r
+    for r in new:
+        records[r['logId']] = r
+    return sorted(records.values(), key=lambda r: (record_date(r), r['logId']))
+
 class FitbitExport(object):
     '''
     Local data store of Fitbit json objects.
+
+    `workers` sets the number of threads used to download
+    day files concurrently. All threads share `client.session`.
+
+    With `queue=True` the jobs still to download are kept in
+    a JobQueue in the user directory, so an interrupted sync
+    resumes where it stopped.
+
+    With `columnar=True` the intraday streams are kept in a
+    columnar.ColumnarStore instead of one json file per day.
+
+    With `manifest=True` the files in the store are tracked in a
+    manifest.Manifest, and syncs and readers look files up there
+    instead of on disk. A missing manifest is built from the store.
+
+    `codec` is the encoding new files are written with, one of
+    codec.CODECS. Files of any codec can be read.
+
+    `resolutions` maps intraday streams to the detail level they
+    are downloaded at, '1min' by default. Days of streams at '1sec'
+    (heart rate only) are stored as delta-encoded series (see
+    codec.encode_series), never in the columnar store, and the
+    readers downsample them to minutes; iter_seconds reads them at
+    full resolution.
     '''
-    def __init__(self, root, client=None, user_id=None):
+    def __init__(self, root, client=None, user_id=None, workers=1, queue=False,
+                 columnar=False, manifest=False, codec='json', resolutions=None):
         self.root = os.path.abspath(root)
+        self.codec = codec
+        self.resolutions = resolutions or {}
         self.client = client
         self.user_id = user_id
+        self.workers = workers
+        self.queue = None
+        if queue:
+            from .scheduler import JobQueue
+            self.queue = JobQueue(self.filename('queue.json'))
+        self.columnar = None
+        if columnar:
+            from .columnar import ColumnarStore
+            self.columnar = ColumnarStore(self.filename())
+        self.manifest = None
+        if manifest:
+            from .manifest import Manifest
+            self.manifest = Manifest(self.filename('manifest.json'))
+            if not self.manifest.exists:
+                self.manifest.rebuild(self.filename())
 
     def filename(self, *args):
         u = self.client and self.client.user_id or self.user_id
         return os.path.join(self.root, u, *args)
 
+    def write(self, filename, data):
+        '''
+        Writes `data` to `filename` with the export's codec,
+        returns the written bytes.
+
+        The file is replaced atomically, so a crash never leaves
+        a truncated file behind that would count as cached.
+        '''
+        b = codec.encode(data, self.codec)
+        codec.write_atomic(filename, b)
+        return b
+
     @staticmethod
-    def write(filename, data):
-        dirname = os.path.dirname(filename)
-        os.makedirs(dirname, exist_ok=True)
-        with open(filename, 'w') as f:
-            f.write(json.dumps(data, indent=2, sort_keys=True))
+    def read(filename):
+        '''
+        Reads a file of the store, whatever its codec.
+        '''
+        return codec.read(filename)
+
+    def flush(self):
+        '''
+        Saves the state kept in memory during a sync.
+        '''
+        if self.columnar is not None:
+            self.columnar.close()
+        if self.manifest is not None:
+            self.manifest.save()
+
+    def month_filename(self, name, d, partial=False):
+        '''
+        Filename of the month file of stream `name` containing date `d`:
+        "name"/"year"/"name.year.month[.partial].json"
+        '''
+        return self.filename(name,
+                             '{:04d}'.format(d.year),
+                             '{}.{:04d}.{:02d}{}.json'.format(
+                                name,
+                                d.year,
+                                d.month,
+                                '.partial' if partial else '',
+                            ))
+
+    def day_filename(self, name, d, partial=False):
+        '''
+        Filename of the day file of stream `name` for date `d`:
+        "name"/"year"/"name.year.month.day[.partial].json"
+        '''
+        return self.filename(
+            name,
+            '{:04d}'.format(d.year),
+            '{}.{:04d}.{:02d}.{:02d}{}.json'.format(
+                name,
+                d.year,
+                d.month,
+                d.day,
+                '.partial' if partial else '',
+        ))
 
     def sync_ranged_data(self, name, client_fn):
         '''
@@ -40,9 +229,27 @@ class FitbitExport(object):
         
         That is, ranged data are synced for full months. Filenames
         generated directly in function.
-        
+
+        With a job queue, months planned by an earlier sync are
+        not looked at again, only the ones still queued.
+
+        Months that are not complete yet are kept as partial files
+        and refreshed with refresh_month, which only downloads the
+        days since the previous sync.
         '''
         month = 2015 * 12
+        queued = []
+        if self.queue is not None:
+            planned = self.queue.planned.get(name)
+            if planned:
+                y, m = map(int, planned.split('-'))
+                # m is 1-based, so this is the month after `planned`
+                month = y * 12 + m
+            queued = self.queue.pending(name)
+
+        new = []
+        refresh = []
+        planned = None
         while 1:
             date_start = date(month // 12, month % 12 + 1, 1)
             month += 1
@@ -54,66 +261,135 @@ class FitbitExport(object):
             # BUFFER_DAYS ago, it is partial. Partial files will be 
             # synced again 
             partial = date_end > (date.today() - timedelta(days=BUFFER_DAYS))
-            #sync to "name"/"year"/"name.year.month"
             #always create partial_filename, check if file exists later
-            partial_filename = self.filename(name,
-                                            '{:04d}'.format(date_start.year), 
-                                            '{}.{:04d}.{:02d}.partial.json'.format(
-                                            name,
-                                            date_start.year,
-                                            date_start.month,
-                                        ))
-            
-            filename = self.filename(name,
-                                    '{:04d}'.format(date_start.year), 
-                                    '{}.{:04d}.{:02}.json'.format(
-                                    name,
-                                    date_start.year,
-                                    date_start.month,
-                                ))
-            
-            if os.path.isfile(partial_filename):
-                os.remove(partial_filename)
-            
+            partial_filename = self.month_filename(name, date_start, partial=True)
+            filename = self.month_filename(name, date_start)
+            key = '{:04d}-{:02d}'.format(date_start.year, date_start.month)
+
             if partial:
-                filename = partial_filename
-            elif os.path.isfile(filename):
+                # partial months are never queued, they are
+                # refreshed on every sync
+                refresh.append((date_start, date_end, True))
+                continue
+
+            planned = key
+            if self.is_cached(name, key, filename):
                 log.info('Cached: %s', filename)
+                # not is_cached: the manifest only knows the final file
+                if os.path.isfile(partial_filename):
+                    # stale leftover of the partial month
+                    os.remove(partial_filename)
+                continue
+            if self.is_cached(name, key, partial_filename):
+                # the month is complete now, top up the partial file
+                refresh.append((date_start, date_end, False))
                 continue
+            new.append(key)
 
-            log.info('Downloading: %s', filename)
-            data = client_fn(
+        if self.queue is not None:
+            self.queue.plan(name, new, planned)
+            self.queue.save()
+
+        jobs = []
+        for key in queued + new:
+            y, m = map(int, key.split('-'))
+            date_start = date(y, m, 1)
+            date_end = date(y + m // 12, m % 12 + 1, 1)
+            jobs.append(Job(name, key, self.month_filename(name, date_start), client_fn, (
                 date_start,
                 date_end - timedelta(days=1)
-            )
-            self.write(filename, data)
+            )))
+        try:
+            self.download(jobs)
+            for date_start, date_end, partial in refresh:
+                self.refresh_month(name, client_fn, date_start, date_end, partial)
+        finally:
+            self.flush()
+
+    def refresh_month(self, name, client_fn, date_start, date_end, partial):
+        '''
+        Updates the partial file of the month from `date_start` up to
+        (not including) `date_end` with the days since the last sync.
+
+        The last sync is the mtime of the partial file. Records of the
+        BUFFER_DAYS days before it, and of all later days, are fetched
+        again and merged into the stored ones by logId. If nothing
+        changed the file is not written, only its mtime is updated.
+
+        If the month is no longer `partial`, the result is stored as
+        the final month file and the partial file is removed.
+        '''
+        key = '{:04d}-{:02d}'.format(date_start.year, date_start.month)
+        partial_filename = self.month_filename(name, date_start, partial=True)
+        last = date_end - timedelta(days=1)
+
+        data = []
+        start = date_start
+        exists = self.is_cached(name, key, partial_filename)
+        if exists:
+            data = self.read(partial_filename) or []
+            pulled = date.fromtimestamp(os.path.getmtime(partial_filename))
+            start = max(start, pulled - timedelta(days=BUFFER_DAYS))
 
-    def day_filenames(self, name):
+        merged = data
+        if start <= last:
+            log.info('Downloading: %s from %s', partial_filename, start)
+            merged = merge_records(data, client_fn(start, last), start, last)
+
+        if partial:
+            if exists and merged == data:
+                log.info('Unchanged: %s', partial_filename)
+                os.utime(partial_filename)
+                return
+            self.save(Job(name, key, partial_filename, client_fn, (start, last)), merged)
+            return
+
+        self.save(Job(name, key, self.month_filename(name, date_start), client_fn,
+            (start, last)), merged)
+        os.remove(partial_filename)
+
+    def day_filenames(self, name, start=None, end=None):
         """
         Iterator object for day filenames
         which goes into intraday syncs (i.e. one whole day per file).
+        Runs from `start` (or 2015-01-01) to `end` inclusive.
         """
-        start = date(2015, 1, 1)
+        start = start or date(2015, 1, 1)
         days = 0
         while 1:
             d = start + timedelta(days=days)
             days += 1
-            # if date is BUFFER_DAYS days ago. stop
-            #TODO: implement partial download to get whatever is there
-            if d == (date.today() - timedelta(days=BUFFER_DAYS)):
+            # if date is BUFFER_DAYS days ago. stop, the recent days
+            # are partial downloads, see sync_recent
+            if d >= (date.today() - timedelta(days=BUFFER_DAYS)):
+                return
+            if end and d > end:
                 return
 
-            filename = self.filename(
-                name,
-                '{:04d}'.format(d.year),
-                '{}.{:04d}.{:02d}.{:02d}.json'.format(
-                    name,
-                    d.year,
-                    d.month,
-                    d.day
-            ))
-            yield d, filename
-              
+            yield d, self.day_filename(name, d)
+
+    def sync_all(self, recent=False, daily_summaries=False):
+        '''
+        Runs all syncs, as `python -m myfitbit` does.
+
+        With `recent`, the partial intraday days are synced too.
+        With `daily_summaries`, daily summaries come from sync_daily
+        instead of the activities of every day.
+        '''
+        # Montly summaries per file
+        self.sync_weight()
+        self.sync_sleep()
+        # Partial intraday days, before sync_days so the ones that
+        # have become final are not downloaded whole again
+        if recent:
+            self.sync_recent()
+        # Daily summaries and daily (intraday) data per file
+        if daily_summaries:
+            self.sync_daily()
+            self.sync_days([n for n in DAY_STREAMS if n != 'activities'])
+        else:
+            self.sync_days()
+
     # Ranged syncs
     def sync_sleep(self):
         '''
@@ -153,14 +429,7 @@ class FitbitExport(object):
         floors climbed, daily steps, Very/Fairly active minutes or
         sedentary minutes.
         '''
-        for d, filename in self.day_filenames('activities'):
-            if os.path.isfile(filename):
-                log.info('Cached: %s', filename)
-                continue
-
-            log.info('Downloading: %s', filename)
-            hr = self.client.get_activities(d)
-            self.write(filename, hr)
+        self.sync_days(['activities'])
     
     # Intraday syncs
     def sync_heartrate_intraday(self):
@@ -168,84 +437,585 @@ class FitbitExport(object):
         Downloads heartrate intraday data from the FitBit API
         to the local data store. 
         '''
-        for d, filename in self.day_filenames('heartrate_intraday'):
-            if os.path.isfile(filename):
-                log.info('Cached: %s', filename)
-                continue
-
-            log.info('Downloading: %s', filename)
-            hr = self.client.get_heartrate_intraday(d)
-            self.write(filename, hr)
+        self.sync_days(['heartrate_intraday'])
 
     def sync_steps_intraday(self):
         """Downloads steps intraday data from the FitBit API
         to the local data store. """
-        for d, filename in self.day_filenames('steps_intraday'):
-            if os.path.isfile(filename):
-                log.info('Cached: %s', filename)
-                continue
-
-            log.info('Downloading: %s', filename)
-            hr = self.client.get_steps_intraday(d)
-            self.write(filename, hr)
+        self.sync_days(['steps_intraday'])
 
     def sync_distance_intraday(self):
         """Downloads distance intraday data from the FitBit API
         to the local data store. """
-        for d, filename in self.day_filenames('distance_intraday'):
-            if os.path.isfile(filename):
-                log.info('Cached: %s', filename)
+        self.sync_days(['distance_intraday'])
+
+    def daily_filename(self, year):
+        '''
+        Filename of the daily summaries of `year`:
+        "daily"/"year"/"daily.year.json"
+        '''
+        return self.filename('daily', '{:04d}'.format(year),
+                             'daily.{:04d}.json'.format(year))
+
+    def load_daily(self, year):
+        filename = self.daily_filename(year)
+        if not os.path.isfile(filename):
+            return {}
+        return self.read(filename)
+
+    def sync_daily(self):
+        '''
+        Downloads daily summaries (steps, calories, floors, active
+        minutes, resting heart rate, ...) for every missing day, using
+        the time series endpoints that return up to MAX_RANGE_DAYS
+        days per request. A year costs one request per resource
+        instead of one request per day with sync_activities.
+
+        The summaries are kept in one file per year, see iter_daily.
+        '''
+        years = {}
+        missing = []
+        for d, filename in self.day_filenames('daily'):
+            if d.year not in years:
+                years[d.year] = self.load_daily(d.year)
+            if d.isoformat() not in years[d.year]:
+                missing.append(d)
+
+        # windows of up to MAX_RANGE_DAYS days from each first missing
+        # day, gaps included: a request costs the same for any length
+        ranges = []
+        for d in missing:
+            if ranges and (d - ranges[-1][0]).days < MAX_RANGE_DAYS:
+                ranges[-1][1] = d
+            else:
+                ranges.append([d, d])
+
+        for start, end in ranges:
+            log.info('Downloading: daily summaries %s to %s', start, end)
+            days = {}
+            for resource in DAILY_RESOURCES:
+                for o in self.client.get_activities_range(resource, start, end):
+                    value = o['value']
+                    days.setdefault(o['dateTime'], {})[resource] = \
+                        float(value) if '.' in value else int(value)
+            for o in self.client.get_heartrate_range(start, end):
+                days.setdefault(o['dateTime'], {})['restingHeartRate'] = \
+                    o['value'].get('restingHeartRate')
+
+            for year in sorted(set(parse_date(k).year for k in days)):
+                years[year].update((k, v) for k, v in days.items() if k.startswith('{:04d}'.format(year)))
+                self.write(self.daily_filename(year), years[year])
+
+    def sync_recent(self, names=INTRADAY_STREAMS):
+        '''
+        Downloads the intraday data of the last BUFFER_DAYS days,
+        which sync_days leaves out because the device may not have
+        synced them yet.
+
+        These days are stored as partial day files. Every sync only
+        downloads the minutes after the last stored sample and appends
+        them. Once a day is older than BUFFER_DAYS it is topped up one
+        last time and stored as a final day file, however long ago
+        the partial file was written.
+        '''
+        today = date.today()
+        # the first day not covered by day_filenames
+        cutoff = today - timedelta(days=BUFFER_DAYS)
+        try:
+            for name in names:
+                client_fn = self.client_fn(name)
+                seconds = self.resolution(name) == '1sec'
+                recent = set(date_range(cutoff, today))
+                for d in sorted(recent.union(self.partial_days(name))):
+                    final = d < cutoff
+                    partial_filename = self.day_filename(name, d, partial=True)
+                    exists = os.path.isfile(partial_filename)
+                    if final and not exists:
+                        # left to sync_days
+                        continue
+
+                    data = exists and self.read(partial_filename) or []
+                    if data:
+                        last = data[-1]['time']
+                        h, m, sec = map(int, last.split(':'))
+                        # the rest of the last minute, at 1 second resolution
+                        start = h * 60 + m + (0 if seconds else 1)
+                        new = []
+                        if start < 24 * 60:
+                            log.info('Downloading: %s from %s', partial_filename, last)
+                            new = client_fn(d,
+                                start_time='{:02d}:{:02d}'.format(*divmod(start, 60)),
+                                end_time='23:59')
+                        new = [o for o in new if o['time'] > last]
+                    else:
+                        log.info('Downloading: %s', partial_filename)
+                        new = client_fn(d)
+
+                    key = d.isoformat()
+                    if final:
+                        self.save(Job(name, key, self.day_filename(name, d), client_fn, (d,)),
+                            data + new)
+                        os.remove(partial_filename)
+                    elif new or not exists:
+                        self.save(Job(name, key, partial_filename, client_fn, (d,)),
+                            data + new)
+        finally:
+            self.flush()
+
+    def partial_days(self, name):
+        '''
+        Iterator of the dates of the partial day files of stream `name`.
+        '''
+        from .manifest import parse_filename
+        pattern = self.filename(name, '*', '{}.*.*.*.partial.json'.format(name))
+        for filename in glob.glob(pattern):
+            parsed = parse_filename(os.path.basename(filename))
+            if parsed is not None:
+                yield parse_date(parsed[1])
+
+    def sync_days(self, names=DAY_STREAMS):
+        '''
+        Downloads all missing day files of the given streams.
+
+        Days of all streams are downloaded together, so with
+        `workers` > 1 the requests for different streams run
+        in parallel.
+        '''
+        jobs = []
+        for name in names:
+            client_fn = self.client_fn(name)
+            start = None
+            queued = []
+            if self.queue is not None:
+                planned = self.queue.planned.get(name)
+                if planned:
+                    start = parse_date(planned) + timedelta(days=1)
+                queued = [parse_date(k) for k in self.queue.pending(name)]
+
+            new = []
+            planned = None
+            for d, filename in self.day_filenames(name, start):
+                planned = d.isoformat()
+                if self.is_cached(name, d.isoformat(), filename):
+                    log.info('Cached: %s', filename)
+                    continue
+                new.append(d)
+
+            if self.queue is not None:
+                self.queue.plan(name, [d.isoformat() for d in new], planned)
+
+            for d in queued + new:
+                jobs.append(Job(name, d.isoformat(), self.day_filename(name, d), client_fn, (d,)))
+
+        if self.queue is not None:
+            self.queue.save()
+        try:
+            self.download(jobs)
+        finally:
+            self.flush()
+
+    def resolution(self, name):
+        '''
+        Detail level stream `name` is downloaded at.
+        '''
+        return self.resolutions.get(name, '1min')
+
+    def client_fn(self, name):
+        '''
+        The client method downloading a day of stream `name`.
+        '''
+        client_fn = getattr(self.client, 'get_' + name)
+        if self.resolution(name) != '1min':
+            client_fn = functools.partial(client_fn, resolution=self.resolution(name))
+        return client_fn
+
+    def in_columnar(self, name):
+        if self.columnar is None or self.resolution(name) == '1sec':
+            return False
+        from .columnar import STREAMS
+        return name in STREAMS
+
+    def is_cached(self, name, key, filename):
+        '''
+        True if `filename`, the day or month `key` of stream `name`,
+        is in the local store.
+        '''
+        if self.in_columnar(name):
+            return self.columnar.has_day(name, parse_date(key))
+        if self.manifest is not None:
+            from .manifest import PRESENT, EMPTY, PARTIAL
+            status = self.manifest.status(name, key)
+            if filename.endswith('.partial.json'):
+                return status == PARTIAL
+            return status in (PRESENT, EMPTY)
+        return os.path.isfile(filename)
+
+    def save(self, job, data):
+        '''
+        Stores the downloaded `data` of `job`.
+        '''
+        partial = job.filename.endswith('.partial.json')
+        if self.in_columnar(job.name) and not partial:
+            self.columnar.write_day(job.name, parse_date(job.key), data)
+            return
+        if self.resolution(job.name) == '1sec':
+            b = codec.encode(data, 'series')
+            codec.write_atomic(job.filename, b)
+        else:
+            b = self.write(job.filename, data)
+        if self.manifest is not None:
+            from .manifest import entry, PARTIAL
+            self.manifest.record(job.name, job.key,
+                entry(b, PARTIAL if partial else None))
+
+    def stored_days(self, name, start=None, end=None):
+        '''
+        Iterator of (date, filename) of the stored day files
+        of stream `name` that contain data, from `start` to `end`.
+        Includes the partial days of the last BUFFER_DAYS.
+        '''
+        if self.manifest is None:
+            for d, filename in self.day_filenames(name, start, end):
+                if os.path.isfile(filename):
+                    yield d, filename
+            today = date.today()
+            for i in range(BUFFER_DAYS, -1, -1):
+                d = today - timedelta(days=i)
+                if (start and d < start) or (end and d > end):
+                    continue
+                filename = self.day_filename(name, d, partial=True)
+                if os.path.isfile(filename):
+                    yield d, filename
+            return
+        from .manifest import PRESENT, PARTIAL
+        for key in self.manifest.keys(name, (PRESENT, PARTIAL)):
+            d = parse_date(key)
+            if start and d < start:
                 continue
+            if end and d > end:
+                break
+            partial = self.manifest.status(name, key) == PARTIAL
+            yield d, self.day_filename(name, d, partial)
 
-            log.info('Downloading: %s', filename)
-            hr = self.client.get_distance_intraday(d)
-            self.write(filename, hr)
+    def stored_months(self, name, start=None, end=None):
+        '''
+        Iterator of the filenames of the stored month files
+        of stream `name` overlapping `start` to `end`, in order.
+        Includes partial months, unless the month is complete.
+        '''
+        first = start and '{:04d}-{:02d}'.format(start.year, start.month)
+        last = end and '{:04d}-{:02d}'.format(end.year, end.month)
+        if self.manifest is None:
+            from .manifest import parse_filename
+            files = {}
+            for dir, dirs, basenames in os.walk(self.filename(name)):
+                for basename in basenames:
+                    parsed = parse_filename(basename)
+                    if parsed is None:
+                        continue
+                    key, partial = parsed[1:]
+                    # a complete month wins over a stale partial file
+                    if partial and key in files:
+                        continue
+                    files[key] = os.path.join(dir, basename)
+            for key, filename in sorted(files.items()):
+                if (first and key < first) or (last and key > last):
+                    continue
+                yield filename
+            return
+        from .manifest import PRESENT, PARTIAL
+        for key in self.manifest.keys(name, (PRESENT, PARTIAL)):
+            if (first and key < first) or (last and key > last):
+                continue
+            y, m = map(int, key.split('-'))
+            partial = self.manifest.status(name, key) == PARTIAL
+            yield self.month_filename(name, date(y, m, 1), partial)
+
+    def file_signature(self, name, key, filename):
+        '''
+        String that changes whenever the stored file `filename`
+        (`key` of stream `name`) changes: its hash from the
+        manifest, or its mtime and size.
+        '''
+        e = self.manifest and self.manifest.streams.get(name, {}).get(key)
+        if e:
+            return '{} {}'.format(e['status'], e['sha1'])
+        st = os.stat(filename)
+        return '{} {}'.format(st.st_mtime_ns, st.st_size)
+
+    def download(self, jobs):
+        '''
+        Runs `job.client_fn(*job.args)` for every Job in `jobs`
+        and saves the result to `job.filename`.
+
+        At most `workers` requests are in flight at once. Files are
+        written in the order of `jobs`, regardless of the order the
+        responses arrive in. The first error cancels all requests
+        that have not started yet, waits for the running ones and
+        is re-raised; nothing is written after it.
+        '''
+        if self.workers <= 1:
+            for job in jobs:
+                log.info('Downloading: %s', job.filename)
+                try:
+                    data = job.client_fn(*job.args)
+                except BaseException:
+                    self.job_failed(job)
+                    raise
+                self.save(job, data)
+                self.job_done(job)
+            return
+
+        jobs = iter(jobs)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            def submit():
+                job = next(jobs, None)
+                if job is None:
+                    return False
+                log.info('Downloading: %s', job.filename)
+                pending.append((job, pool.submit(job.client_fn, *job.args)))
+                return True
+
+            # keep a bounded window of requests queued ahead
+            # so a large backfill is not submitted all at once
+            for i in range(2 * self.workers):
+                if not submit():
+                    break
+            try:
+                while pending:
+                    job, future = pending.popleft()
+                    try:
+                        data = future.result()
+                    except BaseException:
+                        self.job_failed(job)
+                        raise
+                    self.save(job, data)
+                    self.job_done(job)
+                    submit()
+            except BaseException:
+                for job, future in pending:
+                    future.cancel()
+                raise
+
+    def job_done(self, job):
+        if self.queue is not None:
+            self.queue.done(job.name, job.key)
+
+    def job_failed(self, job):
+        if self.manifest is not None and job.key is not None:
+            from .manifest import FAILED
+            if self.manifest.status(job.name, job.key) is None:
+                self.manifest.record(job.name, job.key, {'status': FAILED})
 
     # Functions for the report
     # i.e. simple read of the data
-    def get_steps_intraday(self):
-        def compress(data):
-            minutes = [None] * 24 * 60
-            for o in data:
-                h, m, s = map(int, o['time'].split(':'))
-                i = h * 60 + m
-                minutes[i] = o['value']
-            return minutes
-
-        steps = []
-        for d, filename in self.day_filenames('steps_intraday'):
-            if not os.path.isfile(filename):
+    def get_intraday_arrays(self, name, start=None, end=None):
+        '''
+        Return intraday data of stream `name` from the columnar store
+        as memory-mapped arrays, see ColumnarStore.read.
+        '''
+        return self.columnar.read(name, start, end)
+
+    def iter_intraday(self, name, start=None, end=None):
+        '''
+        Yields the intraday data of stream `name` from the local store
+        one day at a time, from `start` to `end` (inclusive dates),
+        in the format of get_heartrate_intraday.
+
+        Only files in the range are read, and at most CHUNK_DAYS
+        days are held in memory at once.
+        '''
+        if self.in_columnar(name):
+            from .columnar import to_minutes
+            for d, minutes in self.columnar.iter_days(name, start, end):
+                yield {
+                    'date': d.isoformat(),
+                    'minutes': to_minutes(name, minutes),
+                }
+            return
+
+        # imports numpy if available
+        from . import intraday
+        for chunk in self.day_chunks(name, start, end):
+            dates = []
+            datasets = []
+            for d, filename in chunk:
+                data = read_intraday(filename)
+                if not data:
+                    continue
+                dates.append(d.isoformat())
+                datasets.append(data)
+            if not dates:
                 continue
-            data = json.load(open(filename))
-            if not data:
+            # bucket a chunk of days at once, it is much faster
+            for d, minutes in zip(dates, intraday.bucket(datasets)):
+                yield {
+                    'date': d,
+                    'minutes': minutes,
+                }
+
+    def day_chunks(self, name, start=None, end=None):
+        '''
+        Yields the stored days of stream `name` from `start` to `end`
+        as lists of up to CHUNK_DAYS (date, filename), the chunks
+        the intraday readers bucket together.
+        '''
+        days = self.stored_days(name, start, end)
+        while 1:
+            chunk = list(itertools.islice(days, CHUNK_DAYS))
+            if not chunk:
+                break
+            yield chunk
+
+    def iter_intraday_arrays(self, name, start=None, end=None):
+        '''
+        Yields the intraday data of stream `name` from `start` to
+        `end` as arrays, up to CHUNK_DAYS days at a time:
+        (dates, values, present), where `values` and `present` are
+        (days x 1440) arrays as returned by intraday.bucket_days.
+        Days without data are left out, like in iter_intraday.
+
+        Requires numpy.
+        '''
+        import numpy as np
+        if self.in_columnar(name):
+            from .columnar import STREAMS
+            dtype, missing = STREAMS[name]
+            for first, present, values in self.columnar.read(name, start, end):
+                rows = np.flatnonzero(present)
+                for i in range(0, len(rows), CHUNK_DAYS):
+                    chunk = rows[i:i + CHUNK_DAYS]
+                    v = np.array(values[chunk])
+                    p = ~np.isnan(v) if np.isnan(missing) else v != missing
+                    keep = p.any(axis=1)
+                    if keep.any():
+                        yield ([first + timedelta(days=int(j)) for j in chunk[keep]],
+                            v[keep], p[keep])
+            return
+
+        from . import intraday
+        for chunk in self.day_chunks(name, start, end):
+            dates = []
+            datasets = []
+            for d, filename in chunk:
+                data = read_intraday(filename)
+                if data:
+                    dates.append(d)
+                    datasets.append(data)
+            if dates:
+                values, present = intraday.bucket_days(datasets)
+                yield dates, values, present
+
+    def iter_seconds(self, name, start=None, end=None):
+        '''
+        Yields (date, seconds, values) of the days of stream `name`
+        stored at 1 second resolution, from `start` to `end`, where
+        `seconds` (since midnight) and `values` are numpy arrays.
+        Days stored at 1 minute resolution are left out.
+        '''
+        for d, filename in self.stored_days(name, start, end):
+            with open(filename, 'rb') as f:
+                b = f.read()
+            if codec.detect(b) == 'series':
+                seconds, values = codec.decode_series_arrays(b)
+                yield d, seconds, values
+
+    def iter_heartrate_intraday(self, start=None, end=None):
+        return self.iter_intraday('heartrate_intraday', start, end)
+
+    def iter_steps_intraday(self, start=None, end=None):
+        return self.iter_intraday('steps_intraday', start, end)
+
+    def iter_distance_intraday(self, start=None, end=None):
+        return self.iter_intraday('distance_intraday', start, end)
+
+    def iter_activities(self, start=None, end=None):
+        '''
+        Yields the daily activities summaries from the local store
+        from `start` to `end`, one day at a time. Each is the json
+        object from the API with an added "date".
+        '''
+        for d, filename in self.stored_days('activities', start, end):
+            data = self.read(filename)
+            data['date'] = d.isoformat()
+            yield data
+
+    def iter_daily(self, start=None, end=None):
+        '''
+        Yields the daily summaries synced by sync_daily from `start`
+        to `end`, one day at a time:
+        {"date": "2018-01-01", "steps": 1234, "restingHeartRate": 60, ...}
+        '''
+        dirname = self.filename('daily')
+        if not os.path.isdir(dirname):
+            return
+        first = start and start.isoformat()
+        last = end and end.isoformat()
+        for year in sorted(int(y) for y in os.listdir(dirname) if y.isdigit()):
+            if (start and year < start.year) or (end and year > end.year):
                 continue
-            steps.append({
-                'date': d.isoformat(),
-                'minutes': compress(data),
-            })
-        return steps
+            days = self.load_daily(year)
+            for key in sorted(days):
+                if (first and key < first) or (last and key > last):
+                    continue
+                day = dict(days[key])
+                day['date'] = key
+                yield day
+
+    def iter_sleep(self, start=None, end=None):
+        '''
+        Yields the sleep records with a dateOfSleep from `start` to
+        `end`, in order, reading one month file at a time.
+        '''
+        first = start and start.isoformat()
+        last = end and end.isoformat()
+        for filename in self.stored_months('sleep', start, end):
+            data = self.read(filename)
+            for s in sorted(data or [], key=lambda s: s['startTime']):
+                if (first and s['dateOfSleep'] < first) or (last and s['dateOfSleep'] > last):
+                    continue
+                yield s
+
+    def sleep_index(self):
+        '''
+        Returns a sleep.SleepIndex of the stored sleep records.
+        '''
+        from .sleep import SleepIndex
+        return SleepIndex(self)
+
+    def get_intraday(self, name, processes=None):
+        '''
+        Return intraday data of stream `name` from the local store,
+        in the format of get_heartrate_intraday.
+
+        With `processes` the files are read by that many worker
+        processes, see parallel.py.
+        '''
+        if processes and processes > 1:
+            from .parallel import iter_intraday
+            return list(iter_intraday(self, name, processes=processes))
+        return list(self.iter_intraday(name))
+
+    def get_steps_intraday(self, processes=None):
+        return self.get_intraday('steps_intraday', processes)
     
-    def get_distance_intraday(self):
-        def compress(data):
-            minutes = [None] * 24 * 60
-            for o in data:
-                h, m, s = map(int, o['time'].split(':'))
-                i = h * 60 + m
-                minutes[i] = o['value']
-            return minutes
-
-        distance = []
-        for d, filename in self.day_filenames('distance_intraday'):
-            if not os.path.isfile(filename):
-                continue
-            data = json.load(open(filename))
-            if not data:
-                continue
-            distance.append({
-                'date': d.isoformat(),
-                'minutes': compress(data),
-            })
-        return distance
+    def get_distance_intraday(self, processes=None):
+        return self.get_intraday('distance_intraday', processes)
+
+    def get_daily(self):
+        '''
+        Return the daily summaries from the local store,
+        see iter_daily.
+        '''
+        return list(self.iter_daily())
+
+    def get_activities(self):
+        '''
+        Return daily activities summaries from the local store,
+        see iter_activities.
+        '''
+        return list(self.iter_activities())
     
     def get_sleep(self):
         '''
@@ -255,17 +1025,9 @@ class FitbitExport(object):
         https://dev.fitbit.com/build/reference/web-api/sleep/
         
         '''
-        sleep = []
-        for dir, dirs, files in os.walk(self.filename('sleep')):
-            for file in files:
-                filename = os.path.join(dir, file)
-                data = json.load(open(filename))
-                if not data:
-                    continue
-                sleep.extend(data)
-        return sleep
+        return list(self.iter_sleep())
 
-    def get_heartrate_intraday(self):
+    def get_heartrate_intraday(self, processes=None):
         '''
         Return heartrate intraday data from the local store.
         Returns: [{hr_data}, ...]
@@ -276,29 +1038,10 @@ class FitbitExport(object):
         }
         minutes is an array of 1440 minutes in the day and the HR during that minute
         
-        It is possible to get 1 sec resolution, but this sync gives 1 min.
-        
-        
-        '''
-
-        def compress(data):
-            minutes = [None] * 24 * 60
-            for o in data:
-                h, m, s = map(int, o['time'].split(':'))
-                i = h * 60 + m
-                minutes[i] = o['value']
-            return minutes
-
-        heartrate = []
-        for d, filename in self.day_filenames('heartrate_intraday'):
-            if not os.path.isfile(filename):
-                continue
-            data = json.load(open(filename))
-            if not data:
-                continue
-            heartrate.append({
-                'date': d.isoformat(),
-                'minutes': compress(data),
-            })
-        return heartrate
+        With resolutions={'heartrate_intraday': '1sec'} the days are
+        downloaded at 1 second resolution and downsampled to minutes
+        here; iter_seconds reads them at full resolution.
 
+        `processes` reads the files in parallel, see get_intraday.
+        '''
+        return self.get_intraday('heartrate_intraday', processes)
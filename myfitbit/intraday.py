@@ -0,0 +1,130 @@
+'''
+Bucketing of intraday datasets into fixed time slots.
+
+The Fitbit API returns a day of intraday data as
+    [{"time": "HH:MM:SS", "value": v}, ...]
+with only the samples that exist. These helpers place the samples
+into one slot per `resolution` step of the day, for many days at
+once. With numpy the times are parsed and scattered in bulk,
+without it a plain Python loop is used.
+'''
+import itertools
+import operator
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# seconds per slot of the detail levels the Fitbit API supports
+RESOLUTIONS = {
+    '1sec': 1,
+    '1min': 60,
+    '5min': 5 * 60,
+    '15min': 15 * 60,
+}
+
+
+def slots(resolution='1min'):
+    '''
+    Number of slots in a day at `resolution`.
+    '''
+    return 24 * 60 * 60 // RESOLUTIONS[resolution]
+
+
+def parse_seconds(times):
+    '''
+    Seconds since midnight of an array of b'HH:MM:SS' strings.
+    '''
+    digits = np.asarray(times, dtype='S8').view(np.uint8).reshape(-1, 8).astype(np.int32)
+    digits -= ord('0')
+    return ((digits[:, 0] * 10 + digits[:, 1]) * 3600 +
+            (digits[:, 3] * 10 + digits[:, 4]) * 60 +
+            (digits[:, 6] * 10 + digits[:, 7]))
+
+
+def bucket_days(datasets, resolution='1min'):
+    '''
+    Buckets a list of day datasets at the detail level `resolution`
+    they were downloaded at.
+
+    Returns (values, present), two (days x slots) arrays: the value
+    of every slot, and whether the slot had a sample. If several
+    samples fall into one slot the last one is kept.
+
+    Requires numpy.
+    '''
+    n = slots(resolution)
+    samples = list(itertools.chain.from_iterable(datasets))
+    rows = np.repeat(np.arange(len(datasets)), [len(d) for d in datasets])
+    index = parse_seconds(list(map(operator.itemgetter('time'), samples)))
+    index //= RESOLUTIONS[resolution]
+    value = np.array(list(map(operator.itemgetter('value'), samples)))
+    if not len(value):
+        value = value.astype(np.int64)
+
+    values = np.zeros((len(datasets), n), dtype=value.dtype)
+    present = np.zeros((len(datasets), n), dtype=bool)
+    values[rows, index] = value
+    present[rows, index] = True
+    return values, present
+
+
+def to_lists(values, present):
+    '''
+    Converts the arrays of `bucket_days` into one list per day,
+    with None for empty slots.
+    '''
+    lists = values.astype(object)
+    lists[~present] = None
+    return lists.tolist()
+
+
+def bucket(datasets, resolution='1min'):
+    '''
+    Buckets a list of day datasets into one list per day,
+    with None for empty slots.
+    '''
+    if np is not None:
+        return to_lists(*bucket_days(datasets, resolution))
+
+    step = RESOLUTIONS[resolution]
+    n = slots(resolution)
+    days = []
+    for dataset in datasets:
+        minutes = [None] * n
+        for o in dataset:
+            h, m, s = map(int, o['time'].split(':'))
+            minutes[(h * 3600 + m * 60 + s) // step] = o['value']
+        days.append(minutes)
+    return days
+
+
+def downsample(seconds, values, resolution='1min'):
+    '''
+    Downsamples a day of samples at a finer resolution, given as
+    sorted `seconds` since midnight and their `values`, to the
+    dataset format at `resolution`: the mean of the samples in every
+    slot, rounded to an integer, for the slots with samples.
+    '''
+    step = RESOLUTIONS[resolution]
+    if np is not None:
+        index = np.asarray(seconds, dtype=np.int64) // step
+        counts = np.bincount(index, minlength=slots(resolution))
+        sums = np.bincount(index, weights=values, minlength=slots(resolution))
+        index = np.flatnonzero(counts)
+        means = np.rint(sums[index] / counts[index]).astype(np.int64)
+        slot_values = zip(index.tolist(), means.tolist())
+    else:
+        slot_values = []
+        for i, samples in itertools.groupby(zip(seconds, values), lambda x: x[0] // step):
+            samples = [v for t, v in samples]
+            slot_values.append((i, int(round(sum(samples) / len(samples)))))
+    dataset = []
+    for i, value in slot_values:
+        t = i * step
+        dataset.append({
+            'time': '{:02d}:{:02d}:{:02d}'.format(t // 3600, t // 60 % 60, t % 60),
+            'value': value,
+        })
+    return dataset
@@ -0,0 +1,199 @@
+'''
+Index of the files in a user's local store.
+
+For every stream the manifest records which days ('YYYY-MM-DD')
+or months ('YYYY-MM') are stored and in what state, so syncs and
+readers do not have to stat every possible file since 2015.
+'''
+import hashlib
+import json
+import logging
+import os
+import re
+
+from . import codec
+
+log = logging.getLogger(__name__)
+
+PRESENT = 'present'
+EMPTY = 'empty'
+PARTIAL = 'partial'
+FAILED = 'failed'
+
+# "name"."year"."month"[."day"][.partial].json
+FILENAME_RE = re.compile(
+    r'^(?P<name>[a-z_]+)\.(?P<year>\d{4})\.(?P<month>\d{2})'
+    r'(?:\.(?P<day>\d{2}))?(?P<partial>\.partial)?\.json$')
+
+
+def parse_filename(basename):
+    '''
+    Returns (name, key, partial) for a store filename,
+    or None if it is not one.
+    '''
+    m = FILENAME_RE.match(basename)
+    if not m:
+        return None
+    key = '{}-{}'.format(m.group('year'), m.group('month'))
+    if m.group('day'):
+        key += '-' + m.group('day')
+    return m.group('name'), key, bool(m.group('partial'))
+
+
+def entry(data, status=None):
+    '''
+    Manifest entry for file contents `data` (bytes, in any codec).
+    '''
+    return {
+        'status': status or (PRESENT if codec.decode(data) else EMPTY),
+        'size': len(data),
+        'sha1': hashlib.sha1(data).hexdigest(),
+    }
+
+
+class Manifest(object):
+    '''
+    The manifest of one user, kept in `filename` as
+    {stream: {key: {"status": str, "size": int, "sha1": str}}}
+
+    `status` is one of
+        PRESENT     the file holds data
+        EMPTY       the file was downloaded but holds no data
+        PARTIAL     a partial month that will be downloaded again
+        FAILED      the last download failed (no size or hash)
+
+    Updates are appended to `filename + '.log'` and folded
+    into `filename` by `save`.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.log_filename = filename + '.log'
+        self.streams = {}
+        self.exists = os.path.isfile(filename)
+        self.load()
+
+    def load(self):
+        if self.exists:
+            self.streams = json.load(open(self.filename))
+        if os.path.isfile(self.log_filename):
+            with open(self.log_filename) as f:
+                for line in f:
+                    name, key, e = json.loads(line)
+                    self.set(name, key, e)
+
+    def save(self):
+        # the log is only dropped once the manifest is on disk
+        codec.write_atomic(self.filename, json.dumps(
+            self.streams, indent=2, sort_keys=True).encode('utf-8'))
+        if os.path.isfile(self.log_filename):
+            os.remove(self.log_filename)
+        self.exists = True
+
+    def set(self, name, key, e):
+        if e is None:
+            self.streams.get(name, {}).pop(key, None)
+        else:
+            self.streams.setdefault(name, {})[key] = e
+
+    def record(self, name, key, e):
+        '''
+        Sets the entry of `key` in stream `name`, None removes it.
+        '''
+        self.set(name, key, e)
+        dirname = os.path.dirname(self.log_filename)
+        os.makedirs(dirname, exist_ok=True)
+        with open(self.log_filename, 'a') as f:
+            f.write(json.dumps([name, key, e]) + '\n')
+
+    def status(self, name, key):
+        e = self.streams.get(name, {}).get(key)
+        return e and e['status']
+
+    def keys(self, name, statuses=(PRESENT, EMPTY, PARTIAL)):
+        '''
+        Sorted keys of stream `name` with one of `statuses`.
+        '''
+        return sorted(k for k, e in self.streams.get(name, {}).items()
+            if e['status'] in statuses)
+
+    def rebuild(self, root):
+        '''
+        Replaces the manifest with a scan of the store in `root`
+        (the user directory).
+        '''
+        streams = {}
+        for dirname, dirs, files in os.walk(root):
+            for basename in files:
+                parsed = parse_filename(basename)
+                if parsed is None:
+                    continue
+                name, key, partial = parsed
+                with open(os.path.join(dirname, basename), 'rb') as f:
+                    data = f.read()
+                status = PARTIAL if partial else None
+                current = streams.setdefault(name, {}).get(key)
+                # a complete month wins over a stale partial file
+                if current and current['status'] != PARTIAL:
+                    continue
+                streams[name][key] = entry(data, status)
+        self.streams = streams
+        self.save()
+        log.info('Rebuilt manifest: %s', ', '.join(
+            '{} {}'.format(len(v), k) for k, v in sorted(streams.items())))
+
+    def verify(self, root):
+        '''
+        Compares the manifest with the store in `root` and returns a
+        list of (name, key, problem) for every file that is missing,
+        changed or not in the manifest.
+        '''
+        problems = []
+        found = set()
+        for dirname, dirs, files in os.walk(root):
+            for basename in files:
+                parsed = parse_filename(basename)
+                if parsed is None:
+                    continue
+                name, key, partial = parsed
+                found.add((name, key, partial))
+                e = self.streams.get(name, {}).get(key)
+                if e is None or e['status'] == FAILED or (e['status'] == PARTIAL) != partial:
+                    problems.append((name, key, 'not in manifest'))
+                    continue
+                with open(os.path.join(dirname, basename), 'rb') as f:
+                    data = f.read()
+                if len(data) != e['size'] or hashlib.sha1(data).hexdigest() != e['sha1']:
+                    problems.append((name, key, 'changed'))
+        for name, entries in sorted(self.streams.items()):
+            for key, e in sorted(entries.items()):
+                if e['status'] == FAILED:
+                    continue
+                if (name, key, e['status'] == PARTIAL) not in found:
+                    problems.append((name, key, 'missing'))
+        return problems
+
+
+def main():
+    import argparse
+    from .export import FitbitExport
+    parser = argparse.ArgumentParser(description='Rebuild or verify the manifest')
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--rebuild', action='store_true',
+        help='rebuild the manifest from the files in the store')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    export = FitbitExport('.', user_id=args.user)
+    manifest = Manifest(export.filename('manifest.json'))
+    if args.rebuild:
+        manifest.rebuild(export.filename())
+        return
+    problems = manifest.verify(export.filename())
+    for name, key, problem in problems:
+        print('{} {}: {}'.format(name, key, problem))
+    if problems:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+'''
+Local stand-in for the Fitbit web API, for testing and load-testing
+the sync path offline.
+
+MockFitbit serves the endpoints the Fitbit client uses from
+synthetic.SyntheticUser data, and can inject the failures of the real
+API: latency, 429s when the hourly budget is used up (with the
+Fitbit-Rate-Limit-* headers), 5xx errors and truncated responses.
+
+The access token is taken as the user id, so every token is a
+separate user with its own data and its own rate limit:
+
+    with MockFitbit(latency=0.05, limit=150) as api:
+        f = Fitbit('USER1', base_url=api.url)
+
+or from the command line
+
+    python -m myfitbit.mockapi --port 8190 --limit 150 --error-rate 0.05
+'''
+import json
+import logging
+import random
+import re
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .export import DAILY_RESOURCES, date_range, parse_date
+from .synthetic import SyntheticUser
+
+log = logging.getLogger(__name__)
+
+# intraday resources and the SyntheticUser methods behind them
+INTRADAY = {
+    'heart': 'get_heartrate_intraday',
+    'steps': 'get_steps_intraday',
+    'distance': 'get_distance_intraday',
+}
+
+# keys of the activities summary behind the daily time series
+SUMMARY_KEYS = {
+    'calories': 'caloriesOut',
+    'minutesSedentary': 'sedentaryMinutes',
+    'minutesLightlyActive': 'lightlyActiveMinutes',
+    'minutesFairlyActive': 'fairlyActiveMinutes',
+    'minutesVeryActive': 'veryActiveMinutes',
+}
+
+DATE = r'(\d{4}-\d{2}-\d{2})'
+ROUTES = [
+    ('profile', r'/1/user/-/profile\.json'),
+    ('sleep_range', r'/1\.2/user/(\w+)/sleep/date/' + DATE + '/' + DATE + r'\.json'),
+    ('sleep', r'/1\.2/user/(\w+)/sleep/date/' + DATE + r'\.json'),
+    ('intraday', r'/1/user/-/activities/(heart|steps|distance)/date/' + DATE + '/' + DATE +
+        r'/(1sec|1min)\.json'),
+    ('intraday_time', r'/1/user/-/activities/(heart|steps|distance)/date/' + DATE +
+        r'/1d/(1sec|1min)/time/(\d{2}:\d{2})/(\d{2}:\d{2})\.json'),
+    ('activities', r'/1/user/-/activities/date/' + DATE + r'\.json'),
+    ('weight', r'/1/user/(\w+)/body/log/weight/date/' + DATE + '/' + DATE + r'\.json'),
+    ('heart_range', r'/1/user/-/activities/heart/date/' + DATE + '/' + DATE + r'\.json'),
+    ('range', r'/1/user/-/activities/(\w+)/date/' + DATE + '/' + DATE + r'\.json'),
+]
+ROUTES = [(name, re.compile(pattern + '$')) for name, pattern in ROUTES]
+
+
+class MockFitbit(object):
+    '''
+    Mock API server on `host`:`port` (0 picks a free port), see the
+    module docstring.
+
+    `latency` is the delay of every response in seconds, or a
+    (min, max) range. Every user may send `limit` requests per
+    `window` seconds, None for no limit. `error_rate` and
+    `truncate_rate` are the shares of responses replaced by a 5xx
+    error, or cut off halfway through the body. `seed` selects the
+    synthetic data and the injected failures.
+
+    `stats` counts the responses by status ('truncated' for cut off
+    ones).
+    '''
+    def __init__(self, host='127.0.0.1', port=0, latency=0, limit=None,
+                 window=3600, error_rate=0, truncate_rate=0, seed=0):
+        self.latency = latency
+        self.limit = limit
+        self.window = window
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.users = {}
+        # user id -> (window start, requests in window)
+        self.budgets = {}
+        self.stats = Counter()
+        self.httpd = ThreadingHTTPServer((host, port), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def user(self, user_id):
+        with self.lock:
+            if user_id not in self.users:
+                self.users[user_id] = SyntheticUser(user_id, self.seed)
+            return self.users[user_id]
+
+    def rate_limit(self, user_id):
+        '''
+        Counts a request of `user_id`, returns (headers, exceeded).
+        '''
+        if self.limit is None:
+            return {}, False
+        now = time.time()
+        with self.lock:
+            start, count = self.budgets.get(user_id, (now, 0))
+            if now >= start + self.window:
+                start, count = now, 0
+            exceeded = count >= self.limit
+            if not exceeded:
+                count += 1
+            self.budgets[user_id] = (start, count)
+        reset = max(0, int(start + self.window - now + 0.999))
+        return {
+            'Fitbit-Rate-Limit-Limit': str(self.limit),
+            'Fitbit-Rate-Limit-Remaining': str(self.limit - count),
+            'Fitbit-Rate-Limit-Reset': str(reset),
+        }, exceeded
+
+    def fault(self):
+        '''
+        None, or the failure to inject into the next response.
+        '''
+        with self.lock:
+            x = self.random.random()
+            status = self.random.choice((500, 502, 503))
+        if x < self.error_rate:
+            return status
+        if x < self.error_rate + self.truncate_rate:
+            return 'truncated'
+        return None
+
+    def delay(self):
+        if isinstance(self.latency, (tuple, list)):
+            with self.lock:
+                return self.random.uniform(*self.latency)
+        return self.latency
+
+    def route(self, user_id, path):
+        '''
+        Returns the json body for the API `path`, or None if there
+        is no such endpoint.
+        '''
+        for name, pattern in ROUTES:
+            m = pattern.match(path)
+            if m:
+                break
+        else:
+            return None
+        user = self.user(user_id)
+        args = m.groups()
+        if name == 'profile':
+            return {'user': user.profile()}
+        if name == 'sleep_range':
+            return {'sleep': available(user.get_sleep_range, args[1], args[2])}
+        if name == 'sleep':
+            return {'sleep': available(user.get_sleep_range, args[1], args[1])}
+        if name == 'weight':
+            return {'weight': available(user.get_weight_range, args[1], args[2])}
+        if name in ('intraday', 'intraday_time'):
+            resource, d = args[0], parse_date(args[1])
+            resolution = args[3] if name == 'intraday' else args[2]
+            if resolution == '1sec' and resource != 'heart':
+                return None
+            client_fn = INTRADAY[resource] if resolution == '1min' else 'get_heartrate_seconds'
+            dataset = getattr(user, client_fn)(d) if d <= date.today() else []
+            last = '23:59:59'
+            if d == date.today():
+                last = datetime.now().strftime('%H:%M:%S')
+            if name == 'intraday_time':
+                first, last = args[3] + ':00', min(last, args[4] + ':59')
+            else:
+                first = '00:00:00'
+            dataset = [o for o in dataset if first <= o['time'] <= last]
+            return {
+                'activities-' + resource: [{'dateTime': d.isoformat(), 'value': '0'}],
+                'activities-{}-intraday'.format(resource): {
+                    'dataset': dataset,
+                    'datasetInterval': 1,
+                    'datasetType': 'minute' if resolution == '1min' else 'second',
+                },
+            }
+        if name == 'activities':
+            return user.get_activities(parse_date(args[0]))
+        if name == 'heart_range':
+            return {'activities-heart': [{
+                'dateTime': d.isoformat(),
+                'value': {'restingHeartRate': user.get_activities(d)['summary']['restingHeartRate']},
+            } for d in date_range(*clamp(args[0], args[1]))]}
+        if name == 'range' and args[0] in DAILY_RESOURCES:
+            values = []
+            for d in date_range(*clamp(args[1], args[2])):
+                summary = user.get_activities(d)['summary']
+                summary['distance'] = summary['distances'][0]['distance']
+                value = summary.get(SUMMARY_KEYS.get(args[0], args[0]), 0)
+                values.append({'dateTime': d.isoformat(), 'value': str(value)})
+            return {'activities-' + args[0]: values}
+        return None
+
+    def handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                log.debug(format, *args)
+
+            def send(self, status, body, headers, truncated=False):
+                body = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                if truncated:
+                    self.send_header('Connection', 'close')
+                    self.close_connection = True
+                self.end_headers()
+                self.wfile.write(body[:len(body) // 2] if truncated else body)
+                with api.lock:
+                    api.stats['truncated' if truncated else status] += 1
+
+            def do_GET(self):
+                time.sleep(api.delay())
+                auth = self.headers.get('Authorization', '')
+                if not auth.startswith('Bearer ') or len(auth) == 7:
+                    return self.send(401, {'errors': [{'errorType': 'invalid_token'}]}, {})
+                user_id = auth[7:]
+                headers, exceeded = api.rate_limit(user_id)
+                if exceeded:
+                    headers['Retry-After'] = headers['Fitbit-Rate-Limit-Reset']
+                    return self.send(429, {'errors': [{'errorType': 'system',
+                        'message': 'Too Many Requests'}]}, headers)
+                fault = api.fault()
+                if isinstance(fault, int):
+                    return self.send(fault, {'errors': [{'errorType': 'system'}]}, headers)
+                body = api.route(user_id, urllib.parse.urlparse(self.path).path)
+                if body is None:
+                    return self.send(404, {'errors': [{'errorType': 'not_found'}]}, headers)
+                self.send(200, body, headers, truncated=fault == 'truncated')
+
+        return Handler
+
+
+def clamp(start, end):
+    '''
+    The dates `start` to `end` ('YYYY-MM-DD'), up to today.
+    '''
+    return parse_date(start), min(parse_date(end), date.today())
+
+
+def available(client_fn, start, end):
+    return client_fn(*clamp(start, end))
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve a mock Fitbit API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8190)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--limit', type=int, default=None,
+        help='requests per user per window')
+    parser.add_argument('--window', type=int, default=3600)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--truncate-rate', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    api = MockFitbit(args.host, args.port, args.latency, args.limit, args.window,
+        args.error_rate, args.truncate_rate, args.seed)
+    print('Serving a mock Fitbit API on {}'.format(api.url))
+    try:
+        api.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    api.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
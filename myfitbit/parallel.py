@@ -0,0 +1,126 @@
+'''
+Parallel loading of the intraday json files on several cores.
+
+The stored days are split into the chunks of the serial readers
+(FitbitExport.day_chunks), and groups of chunks are read and
+bucketed in a process pool. Workers send back compact arrays, not
+lists of dicts: the values in the smallest integer type that holds
+them, and the presence of every minute as a bitmap. The results
+come back in order, and are the same as those of the serial
+readers.
+
+    export.get_heartrate_intraday(processes=8)
+
+    for dates, values, present in iter_intraday_arrays(export, name, processes=8):
+        ...
+
+Requires numpy. Intraday data in the columnar store is memory-mapped
+and is read serially.
+'''
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from . import intraday
+from .export import read_intraday
+
+# chunks of CHUNK_DAYS days read by a worker at a time
+TASK_CHUNKS = 4
+
+INT_TYPES = (np.int8, np.int16, np.int32, np.int64)
+
+
+def compact(values):
+    '''
+    `values` in the smallest integer type that holds them.
+    '''
+    if values.dtype.kind != 'i' or not values.size:
+        return values
+    low, high = values.min(), values.max()
+    for t in INT_TYPES:
+        info = np.iinfo(t)
+        if info.min <= low and high <= info.max:
+            return values.astype(t)
+    return values
+
+
+def read_chunks(chunks):
+    '''
+    Reads and buckets the day files of `chunks`, lists of
+    filenames. Returns one (days, dtype, values, bits) per chunk:
+    the positions of the days with data in the chunk, the dtype of
+    the bucketed values, the compacted values and the packed
+    presence bitmap.
+    '''
+    result = []
+    for filenames in chunks:
+        days = []
+        datasets = []
+        for i, filename in enumerate(filenames):
+            data = read_intraday(filename)
+            if data:
+                days.append(i)
+                datasets.append(data)
+        if not datasets:
+            result.append((days, None, None, None))
+            continue
+        values, present = intraday.bucket_days(datasets)
+        result.append((days, values.dtype, compact(values), np.packbits(present, axis=1)))
+    return result
+
+
+def iter_intraday_arrays(export, name, start=None, end=None, processes=None):
+    '''
+    Like FitbitExport.iter_intraday_arrays, with the files read by
+    `processes` worker processes (by default one per core).
+    '''
+    if export.in_columnar(name):
+        yield from export.iter_intraday_arrays(name, start, end)
+        return
+    processes = processes or os.cpu_count()
+    chunks = export.day_chunks(name, start, end)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        def submit():
+            task = list(itertools.islice(chunks, TASK_CHUNKS))
+            if not task:
+                return False
+            filenames = [[filename for d, filename in chunk] for chunk in task]
+            pending.append((task, pool.submit(read_chunks, filenames)))
+            return True
+
+        # a bounded window of tasks ahead of the one consumed
+        for i in range(2 * processes):
+            if not submit():
+                break
+        try:
+            while pending:
+                task, future = pending.popleft()
+                for chunk, (days, dtype, values, bits) in zip(task, future.result()):
+                    if not days:
+                        continue
+                    present = np.unpackbits(bits, axis=1, count=values.shape[1]).astype(bool)
+                    yield [chunk[i][0] for i in days], values.astype(dtype), present
+                submit()
+        finally:
+            for task, future in pending:
+                future.cancel()
+
+
+def iter_intraday(export, name, start=None, end=None, processes=None):
+    '''
+    Like FitbitExport.iter_intraday, with the files read by
+    `processes` worker processes.
+    '''
+    if export.in_columnar(name):
+        yield from export.iter_intraday(name, start, end)
+        return
+    for dates, values, present in iter_intraday_arrays(export, name, start, end, processes):
+        for d, minutes in zip(dates, intraday.to_lists(values, present)):
+            yield {
+                'date': d.isoformat(),
+                'minutes': minutes,
+            }
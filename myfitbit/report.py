@@ -1,15 +1,213 @@
+import hashlib
+import itertools
 import json
-import pkg_resources
+import logging
+import os
+import pkgutil
 import sys
 
-import dominate
-from dominate.tags import *
-from dominate.util import *
+from . import codec
+
+log = logging.getLogger(__name__)
 
 def read_resource(name):
-    return pkg_resources.resource_string('myfitbit', name).decode('utf-8')
+    return pkgutil.get_data('myfitbit', name).decode('utf-8')
+
+# directory of the detail files, relative to the report
+DETAIL_DIR = 'report'
+
+# bump when the fragments change format, to invalidate cached ones
+FRAGMENT_VERSION = 1
+
+def aggregate(minutes, step):
+    '''
+    Returns the min, mean and max of every `step` minutes of a day:
+    {"min": [...], "mean": [...], "max": [...]}
+    with None for periods without data.
+    '''
+    mins, means, maxs = [], [], []
+    for i in range(0, len(minutes), step):
+        values = [v for v in minutes[i:i + step] if v is not None]
+        if values:
+            mins.append(min(values))
+            means.append(round(sum(values) / len(values), 1))
+            maxs.append(max(values))
+        else:
+            mins.append(None)
+            means.append(None)
+            maxs.append(None)
+    return {'min': mins, 'mean': means, 'max': maxs}
+
+
+def heartrate_lod(days):
+    '''
+    Splits heartrate days into levels of detail:
+
+    overview: [{"date", "min", "mean", "max", "hourly": [mean, ...]}, ...]
+        the daily and hourly summaries, embedded in the report
+
+    detail: {"YYYY-MM": [{"date", "min": [...], "mean": [...], "max": [...]}, ...]}
+        5 minute summaries per month, loaded by the report on demand
+    '''
+    overview = []
+    detail = {}
+    for day in days:
+        daily = aggregate(day['minutes'], 24 * 60)
+        overview.append({
+            'date': day['date'],
+            'min': daily['min'][0],
+            'mean': daily['mean'][0],
+            'max': daily['max'][0],
+            'hourly': aggregate(day['minutes'], 60)['mean'],
+        })
+        five = aggregate(day['minutes'], 5)
+        five['date'] = day['date']
+        detail.setdefault(day['date'][:7], []).append(five)
+    return overview, detail
+
+
+def sleep_lod(sleep):
+    '''
+    Keeps only the parts of the sleep records the report draws.
+    '''
+    return [{
+        'dateOfSleep': s['dateOfSleep'],
+        'levels': {'data': s['levels']['data']},
+    } for s in sleep]
+
+
+def write_detail(dirname, stream, detail):
+    '''
+    Writes one script per month to `dirname`, which hands
+    its data to `report_detail` in chart.js when loaded.
+    '''
+    os.makedirs(dirname, exist_ok=True)
+    for month, days in detail.items():
+        filename = os.path.join(dirname, '{}.{}.js'.format(stream, month))
+        with open(filename, 'w') as f:
+            f.write('report_detail({}, {}, {});\n'.format(
+                json.dumps(stream), json.dumps(month), json.dumps(days)))
+
+
+class FragmentCache(object):
+    '''
+    Report data computed for one month of one stream, stored in
+    `dirname` together with the signature of the files it was
+    computed from.
+    '''
+    def __init__(self, dirname):
+        self.dirname = dirname
+
+    def filename(self, stream, month):
+        return os.path.join(self.dirname, '{}.{}.json'.format(stream, month))
+
+    def get(self, stream, month, signature):
+        filename = self.filename(stream, month)
+        if not os.path.isfile(filename):
+            return None
+        try:
+            cached = codec.read(filename)
+        except (OSError, ValueError) as e:
+            log.warning('Ignoring report cache %s: %s', filename, e)
+            return None
+        if cached['signature'] != signature:
+            return None
+        return cached['fragment']
+
+    def put(self, stream, month, signature, fragment):
+        # not codec.encode: sorted keys would change the page
+        codec.write_atomic(self.filename(stream, month), json.dumps({
+            'signature': signature,
+            'fragment': fragment,
+        }).encode('utf-8'))
+
+
+def signature(ex, name, files):
+    '''
+    Signature of the source files [(key, filename), ...] of stream
+    `name`: their hashes from the manifest, or their mtime and size.
+    '''
+    h = hashlib.sha1(str(FRAGMENT_VERSION).encode('ascii'))
+    for key, filename in files:
+        h.update('{} {}\n'.format(key, ex.file_signature(name, key, filename)).encode('ascii'))
+    return h.hexdigest()
+
+
+def month_range(month):
+    '''
+    First and last date of month 'YYYY-MM'.
+    '''
+    from datetime import date, timedelta
+    y, m = map(int, month.split('-'))
+    return date(y, m, 1), date(y + m // 12, m % 12 + 1, 1) - timedelta(days=1)
+
+
+def iter_heartrate(ex, cache, detail_dir=DETAIL_DIR):
+    '''
+    Yields the heartrate overview of the report one month at a
+    time, and writes the detail files to `detail_dir`. Months whose
+    source files have not changed are taken from `cache`.
+    '''
+    days = ex.stored_days('heartrate_intraday')
+    for month, files in itertools.groupby(days, lambda x: x[0].isoformat()[:7]):
+        files = [(d.isoformat(), filename) for d, filename in files]
+        sig = signature(ex, 'heartrate_intraday', files)
+        detail_filename = os.path.join(detail_dir, 'heartrate.{}.js'.format(month))
+        fragment = cache.get('heartrate', month, sig)
+        if fragment is None or not os.path.isfile(detail_filename):
+            start, end = month_range(month)
+            fragment, detail = heartrate_lod(ex.iter_heartrate_intraday(start, end))
+            write_detail(detail_dir, 'heartrate', detail)
+            cache.put('heartrate', month, sig, fragment)
+        yield fragment
+
+
+def iter_sleep(ex, cache):
+    '''
+    Yields the sleep data of the report one month at a time.
+    '''
+    from .manifest import parse_filename
+    for filename in ex.stored_months('sleep'):
+        name, month, partial = parse_filename(os.path.basename(filename))
+        sig = signature(ex, 'sleep', [(month, filename)])
+        fragment = cache.get('sleep', month, sig)
+        if fragment is None:
+            start, end = month_range(month)
+            fragment = sleep_lod(ex.iter_sleep(start, end))
+            cache.put('sleep', month, sig, fragment)
+        yield fragment
+
+
+def build_data(ex, cache_dir, detail_dir=DETAIL_DIR):
+    '''
+    Returns the data embedded in the report, and writes the detail
+    files to `detail_dir`.
+
+    Every month is computed separately and cached in `cache_dir`;
+    months whose source files have not changed since the last
+    report are taken from the cache.
+    '''
+    cache = FragmentCache(cache_dir)
+    return {
+        'sleep': list(itertools.chain.from_iterable(iter_sleep(ex, cache))),
+        'heartrate': list(itertools.chain.from_iterable(
+            iter_heartrate(ex, cache, detail_dir))),
+    }
+
+
+# stands for the data in the page template
+DATA_PLACEHOLDER = '/*data*/'
+
+
+def page_template(detail_dir=DETAIL_DIR):
+    '''
+    The report page split around the data: (head, tail).
+    '''
+    # dominate imports asyncio, only load it to write the page
+    import dominate
+    from dominate.tags import div, script, style
+    from dominate.util import raw
 
-def make_report(data):
     doc = dominate.document(title='Fitbit Report')
 
     with doc.head:
@@ -18,7 +216,9 @@ def make_report(data):
         script(src="https://cdnjs.cloudflare.com/ajax/libs/d3/4.12.0/d3.js", integrity="sha256-0Lzb1mm7+96oAeDnxAPpfdRdi6jLYTV9XTVt4p6kPg0=", crossorigin="anonymous")
         script(
             raw('\nvar data = '),
-            raw(json.dumps(data)),
+            raw(DATA_PLACEHOLDER),
+            raw(';\nvar detail_dir = '),
+            raw(json.dumps(detail_dir)),
             raw(';\n')
         )
 
@@ -31,19 +231,60 @@ def make_report(data):
 
         script(raw(read_resource('static/chart.js')))
 
-    return doc.render()
+    head, tail = doc.render().split(DATA_PLACEHOLDER)
+    return head, tail
+
+
+def make_report(data, detail_dir=DETAIL_DIR):
+    head, tail = page_template(detail_dir)
+    return head + json.dumps(data) + tail
+
+
+def write_json(f, streams):
+    '''
+    Writes the json object {name: [item, ...], ...} of `streams`,
+    [(name, iterable of lists of items), ...], to file `f` one
+    item at a time, the same text as json.dumps.
+    '''
+    f.write('{')
+    for i, (name, fragments) in enumerate(streams):
+        if i:
+            f.write(', ')
+        f.write(json.dumps(name) + ': [')
+        first = True
+        for fragment in fragments:
+            for item in fragment:
+                if not first:
+                    f.write(', ')
+                f.write(json.dumps(item))
+                first = False
+        f.write(']')
+    f.write('}')
+
+
+def write_report(f, ex, cache_dir, detail_dir=DETAIL_DIR):
+    '''
+    Writes the report of `ex` to file `f` as it is computed, one
+    month at a time: the same page as make_report(build_data(...)),
+    without holding the data or the page in memory.
+    '''
+    cache = FragmentCache(cache_dir)
+    head, tail = page_template(detail_dir)
+    f.write(head)
+    write_json(f, [
+        ('sleep', iter_sleep(ex, cache)),
+        ('heartrate', iter_heartrate(ex, cache, detail_dir)),
+    ])
+    f.write(tail)
 
 
 def main(user_id):
     from . import export
+    # read only: list the files on disk rather than trust or
+    # rewrite the manifest of the sync
     ex = export.FitbitExport('.', user_id=user_id)
-    data = {
-        'sleep': ex.get_sleep(),
-        'heartrate': ex.get_heartrate_intraday(),
-    }
-    html = make_report(data)
     with open('report.html', 'w') as f:
-        f.write(html)
+        write_report(f, ex, ex.filename('report_cache'))
     print('Wrote report.html', file=sys.stderr)
 
 if __name__ == '__main__':
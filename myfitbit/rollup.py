@@ -0,0 +1,296 @@
+'''
+Materialized daily, weekly and monthly rollups of the intraday
+streams.
+
+For every stream and period the rollup table holds the statistics
+of the minutes in it:
+
+    count       minutes with a sample
+    min, max, mean, sum
+    p10, p50, p90
+    days        days with data (weekly and monthly)
+    zones       minutes in every heart rate zone (heartrate_intraday)
+
+Weeks are ISO weeks ('2018-W01', starting on Monday), months are
+'2018-01' and days '2018-01-01'.
+
+The tables of a stream are kept in "rollups/<stream>.json" in the
+user directory, together with the signature of every source day
+they were built from. `update` only recomputes the periods
+containing days that were added, changed or removed since.
+
+    python -m myfitbit.rollup --user 123ABC
+    python -m myfitbit.rollup --user 123ABC --show weekly --stream steps_intraday
+
+Requires numpy.
+'''
+import logging
+import os
+from datetime import date, timedelta
+
+import numpy as np
+
+from . import codec
+from .export import INTRADAY_STREAMS, parse_date
+
+log = logging.getLogger(__name__)
+
+# bump when the tables change format
+ROLLUP_VERSION = 1
+
+PERIODS = ('daily', 'weekly', 'monthly')
+
+PERCENTILES = (10, 50, 90)
+
+# lower bounds (bpm) of the heart rate zones; the default zones of
+# Fitbit for a maximum heart rate of 190 (50%, 70% and 85%)
+HR_ZONES = (
+    ('out_of_range', 0),
+    ('fat_burn', 95),
+    ('cardio', 133),
+    ('peak', 162),
+)
+
+
+def period_key(period, d):
+    '''
+    Key of the `period` containing date `d`.
+    '''
+    if period == 'daily':
+        return d.isoformat()
+    if period == 'weekly':
+        year, week, weekday = d.isocalendar()
+        return '{:04d}-W{:02d}'.format(year, week)
+    return '{:04d}-{:02d}'.format(d.year, d.month)
+
+
+def period_range(period, key):
+    '''
+    (first, last) date of the `period` with `key`.
+    '''
+    if period == 'daily':
+        d = parse_date(key)
+        return d, d
+    if period == 'weekly':
+        year, week = int(key[:4]), int(key[6:])
+        # January 4th is always in week 1
+        jan4 = date(year, 1, 4)
+        first = jan4 + timedelta(days=7 * (week - 1) - jan4.weekday())
+        return first, first + timedelta(days=6)
+    year, month = map(int, key.split('-'))
+    first = date(year, month, 1)
+    return first, date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+
+
+def merge_ranges(ranges):
+    '''
+    Merges overlapping and adjacent (first, last) date ranges.
+    '''
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + timedelta(days=1):
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+
+def statistics(name, values, present):
+    '''
+    Statistics of every row of the (rows x minutes) arrays `values`
+    and `present`, as a list of dicts. Every row needs a sample.
+    '''
+    v = values.astype(np.float64)
+    v[~present] = np.nan
+    count = present.sum(axis=1)
+    total = np.nansum(v, axis=1)
+    columns = {
+        'count': count,
+        'min': np.nanmin(v, axis=1),
+        'max': np.nanmax(v, axis=1),
+        'mean': total / count,
+        'sum': total,
+    }
+    for p, column in zip(PERCENTILES, np.nanpercentile(v, PERCENTILES, axis=1)):
+        columns['p{}'.format(p)] = column
+    columns = {k: c.tolist() for k, c in columns.items()}
+    rows = [dict(zip(columns, row)) for row in zip(*columns.values())]
+    if name == 'heartrate_intraday':
+        bounds = [lower for zone, lower in HR_ZONES[1:]] + [np.inf]
+        zones = [((v >= lower) & (v < upper)).sum(axis=1).tolist()
+            for (zone, lower), upper in zip(HR_ZONES, bounds)]
+        for row, minutes in zip(rows, zip(*zones)):
+            row['zones'] = dict(zip((zone for zone, lower in HR_ZONES), minutes))
+    return rows
+
+
+def source_signatures(export, name):
+    '''
+    {date: signature} of the stored days of stream `name`. Days of
+    the columnar store share the signature of their year.
+    '''
+    if not export.in_columnar(name):
+        return {d.isoformat(): export.file_signature(name, d.isoformat(), filename)
+            for d, filename in export.stored_days(name)}
+    signatures = {}
+    for first, present, values in export.columnar.read(name):
+        sig = []
+        for filename in export.columnar.filenames(name, first.year):
+            st = os.stat(filename)
+            sig.append('{} {}'.format(st.st_mtime_ns, st.st_size))
+        sig = ' '.join(sig)
+        for i in np.flatnonzero(present):
+            signatures[(first + timedelta(days=int(i))).isoformat()] = sig
+    return signatures
+
+
+class Rollups(object):
+    '''
+    Rollup tables of `export`, see the module docstring.
+    '''
+    def __init__(self, export):
+        self.export = export
+        # loaded tables by stream name
+        self.tables = {}
+
+    def filename(self, name):
+        return self.export.filename('rollups', name + '.json')
+
+    def table(self, name):
+        '''
+        The rollup table of stream `name`:
+        {"sources": {date: signature}, "daily": {key: row}, ...}
+        '''
+        if name not in self.tables:
+            table = None
+            filename = self.filename(name)
+            if os.path.isfile(filename):
+                table = codec.read(filename)
+                if table.get('version') != ROLLUP_VERSION:
+                    table = None
+            if table is None:
+                table = {'version': ROLLUP_VERSION, 'sources': {}}
+                for period in PERIODS:
+                    table[period] = {}
+            self.tables[name] = table
+        return self.tables[name]
+
+    def update(self, names=INTRADAY_STREAMS):
+        '''
+        Recomputes the periods of `names` whose source days changed
+        since the last update. Returns the number of periods
+        recomputed.
+        '''
+        count = 0
+        for name in names:
+            table = self.table(name)
+            sources = source_signatures(self.export, name)
+            old = table['sources']
+            changed = [k for k, sig in sources.items() if old.get(k) != sig]
+            changed += [k for k in old if k not in sources]
+            if not changed:
+                continue
+
+            affected = {period: set() for period in PERIODS}
+            for key in changed:
+                d = parse_date(key)
+                for period in PERIODS:
+                    affected[period].add(period_key(period, d))
+            for period in PERIODS:
+                for key in affected[period]:
+                    table[period].pop(key, None)
+            ranges = merge_ranges(period_range(period, key)
+                for period in PERIODS for key in affected[period])
+            for first, last in ranges:
+                for period, key, row in self.compute(name, first, last):
+                    if key in affected[period]:
+                        table[period][key] = row
+
+            table['sources'] = sources
+            codec.write_atomic(self.filename(name), codec.encode(table, 'compact'))
+            n = sum(len(keys) for keys in affected.values())
+            log.info('Rolled up %d periods of %s', n, name)
+            count += n
+        return count
+
+    def compute(self, name, first, last):
+        '''
+        Yields (period, key, row) of every period with data from
+        `first` to `last`. Periods that are cut off by the range
+        are computed from the part inside it.
+        '''
+        # (key, [values], [present]) of the open week and month
+        open_periods = {}
+
+        def close(period):
+            key, values, present = open_periods.pop(period)
+            row = statistics(name, np.concatenate(values).reshape(1, -1),
+                np.concatenate(present).reshape(1, -1))[0]
+            row['days'] = sum(len(v) for v in values)
+            return period, key, row
+
+        for dates, values, present in self.export.iter_intraday_arrays(name, first, last):
+            for d, row in zip(dates, statistics(name, values, present)):
+                yield 'daily', d.isoformat(), row
+            for period in PERIODS[1:]:
+                keys = [period_key(period, d) for d in dates]
+                # split the chunk where the period changes
+                start = 0
+                for i in range(1, len(keys) + 1):
+                    if i < len(keys) and keys[i] == keys[start]:
+                        continue
+                    if period in open_periods and open_periods[period][0] != keys[start]:
+                        yield close(period)
+                    key, v, p = open_periods.setdefault(period, (keys[start], [], []))
+                    v.append(values[start:i])
+                    p.append(present[start:i])
+                    start = i
+        for period in PERIODS[1:]:
+            if period in open_periods:
+                yield close(period)
+
+    def query(self, name, period='daily', start=None, end=None):
+        '''
+        [(key, row), ...] of stream `name` and `period`, for the
+        periods containing the dates `start` to `end`, in order.
+        '''
+        first = start and period_key(period, start)
+        last = end and period_key(period, end)
+        rows = self.table(name)[period]
+        return [(key, rows[key]) for key in sorted(rows)
+            if not (first and key < first or last and key > last)]
+
+
+def update(export, names=INTRADAY_STREAMS):
+    '''
+    Updates the rollup tables of `export`.
+    '''
+    return Rollups(export).update(names)
+
+
+def main():
+    import argparse
+    from .export import FitbitExport
+    parser = argparse.ArgumentParser(description='Update the rollups of the intraday streams')
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--columnar', action='store_true',
+        help='read intraday data from the columnar store')
+    parser.add_argument('--show', choices=PERIODS,
+        help='print the table of this period after updating')
+    parser.add_argument('--stream', default='heartrate_intraday', choices=INTRADAY_STREAMS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    export = FitbitExport('.', user_id=args.user, columnar=args.columnar, manifest=True)
+    rollups = Rollups(export)
+    rollups.update()
+    if args.show:
+        print('{:<10} {:>5} {:>8} {:>8} {:>8} {:>8}'.format(
+            args.show, 'days', 'count', 'min', 'mean', 'max'))
+        for key, row in rollups.query(args.stream, args.show):
+            print('{:<10} {:>5} {:>8} {:>8.1f} {:>8.1f} {:>8.1f}'.format(
+                key, row.get('days', 1), row['count'], row['min'], row['mean'], row['max']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+'''
+Exports of many Fitbit accounts at once.
+
+A roster is an ini file with one section per account, naming the
+file its access token is cached in:
+
+    [alice]
+    token_file = tokens/alice.json
+
+    [bob]
+    token_file = tokens/bob.json
+
+The client ID and secret are read from myfitbit.ini as usual.
+Every account gets its own client and Scheduler, since the rate
+limit applies per user. Accounts are synced in parallel on a
+thread or process pool; an account that runs out of budget gives
+up its slot and, with `wait`, is retried once its budget resets.
+'''
+import configparser
+import logging
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import (
+    ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait)
+
+log = logging.getLogger(__name__)
+
+DONE = 'done'
+DEFERRED = 'deferred'
+FAILED = 'failed'
+
+User = namedtuple('User', 'name token_file')
+
+# outcome of one sync of a user: `status` is DONE, DEFERRED (the
+# rate limit ran out, `reset` is when it resets) or FAILED (`error`)
+Result = namedtuple('Result', 'name user_id status requests seconds reset error')
+
+
+def load_roster(filename):
+    '''
+    Reads the users of the roster `filename`. Relative token
+    files are relative to the directory of the roster.
+    '''
+    config = configparser.ConfigParser()
+    if not config.read(filename):
+        raise IOError('Cannot read roster: {}'.format(filename))
+    dirname = os.path.dirname(os.path.abspath(filename))
+    users = []
+    for name in config.sections():
+        token_file = config[name].get('token_file', '.myfitbit_access_token.' + name)
+        users.append(User(name, os.path.join(dirname, token_file)))
+    return users
+
+
+def sync_user(user, auth, root, options):
+    '''
+    Syncs the account of `user` into `root`; runs in the pool.
+
+    `auth` is (client_id, client_secret), `options` the keyword
+    arguments of FitbitExport.sync_all plus `workers`, `codec` and
+    `sqlite` (a database to update after the sync).
+    Never opens a browser: users without a valid token fail.
+    '''
+    from requests.exceptions import HTTPError
+    from . import Fitbit, FitbitAuth
+    from .export import FitbitExport
+    from .scheduler import Scheduler, RateLimitExceeded
+
+    options = dict(options)
+    workers = options.pop('workers', 1)
+    codec = options.pop('codec', 'json')
+    sqlite = options.pop('sqlite', None)
+    t = time.time()
+    user_id = None
+    scheduler = None
+    try:
+        fa = FitbitAuth(*auth, token_file=user.token_file)
+        if not fa.load_access_token():
+            raise RuntimeError('No valid access token in {}, run '
+                'python -m myfitbit.roster --authorize {}'.format(user.token_file, user.name))
+        client = Fitbit(fa.access_token['access_token'], pool_size=max(10, workers),
+            auth=fa, profile_file=user.token_file + '.profile')
+        user_id = client.user_id
+        scheduler = Scheduler(client)
+        export = FitbitExport(root, scheduler, workers=workers, queue=True,
+            manifest=True, codec=codec)
+        try:
+            export.sync_all(**options)
+        finally:
+            if sqlite:
+                from .database import update
+                update(export, sqlite)
+    except RateLimitExceeded as e:
+        return Result(user.name, user_id, DEFERRED, scheduler.requests,
+            time.time() - t, e.reset, None)
+    except Exception as e:
+        if isinstance(e, HTTPError) and e.response is not None \
+                and e.response.status_code == 429:
+            # the profile request, sent before there is a scheduler
+            reset = time.time() + int(e.response.headers.get('Retry-After', 3600))
+            return Result(user.name, user_id, DEFERRED, 1, time.time() - t, reset, None)
+        log.exception('Sync of %s failed', user.name)
+        return Result(user.name, user_id, FAILED, scheduler and scheduler.requests or 0,
+            time.time() - t, None, '{}: {}'.format(type(e).__name__, e))
+    return Result(user.name, user_id, DONE, scheduler.requests,
+        time.time() - t, None, None)
+
+
+class Orchestrator(object):
+    '''
+    Syncs the accounts of `users` with at most `pool` at a time,
+    on threads, or on processes with `processes=True`.
+
+    A user whose rate limit runs out is reported as DEFERRED; with
+    `wait` it is queued again for when its budget resets, while the
+    other users keep the pool busy. `sync_fn(user, *args)` is the
+    function run for every user, see sync_user.
+    '''
+    def __init__(self, users, args=(), pool=4, processes=False, wait=False,
+                 sync_fn=sync_user):
+        self.users = list(users)
+        self.args = args
+        self.pool = pool
+        self.processes = processes
+        self.wait = wait
+        self.sync_fn = sync_fn
+        # latest Result of every user, by name
+        self.results = {}
+
+    def report(self, result):
+        self.results[result.name] = result
+        if result.status == DONE:
+            log.info('%s: done, %d requests in %.0fs',
+                result.name, result.requests, result.seconds)
+        elif result.status == DEFERRED:
+            log.info('%s: rate limit reached after %d requests, resets in %.0fs',
+                result.name, result.requests, result.reset - time.time())
+        else:
+            log.warning('%s: failed: %s', result.name, result.error)
+
+    def run(self):
+        '''
+        Syncs all users, returns the final Result of each, in
+        roster order.
+        '''
+        executor_class = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+        running = {}
+        # (time, user) of deferred users to run again
+        deferred = []
+        with executor_class(max_workers=self.pool) as executor:
+            def submit(user):
+                running[executor.submit(self.sync_fn, user, *self.args)] = user
+
+            for user in self.users:
+                submit(user)
+            while running or deferred:
+                now = time.time()
+                for item in sorted(deferred):
+                    if item[0] <= now:
+                        deferred.remove(item)
+                        log.info('%s: resuming', item[1].name)
+                        submit(item[1])
+                timeout = None
+                if deferred:
+                    timeout = max(0, min(t for t, u in deferred) - now)
+                if not running:
+                    time.sleep(timeout)
+                    continue
+                finished, _ = wait(list(running), timeout=timeout,
+                    return_when=FIRST_COMPLETED)
+                for future in finished:
+                    user = running.pop(future)
+                    result = future.result()
+                    self.report(result)
+                    if result.status == DEFERRED and self.wait:
+                        deferred.append((result.reset, user))
+        return [self.results[u.name] for u in self.users]
+
+
+def format_results(results):
+    lines = ['{:<16} {:<10} {:<8} {:>8} {:>8}  {}'.format(
+        'user', 'user id', 'status', 'requests', 'seconds', '')]
+    for r in results:
+        note = r.error or ''
+        if r.status == DEFERRED:
+            note = 'resets in {:.0f}s'.format(r.reset - time.time())
+        lines.append('{:<16} {:<10} {:<8} {:>8} {:>8.0f}  {}'.format(
+            r.name, r.user_id or '-', r.status, r.requests, r.seconds, note))
+    return '\n'.join(lines)
+
+
+def main():
+    import argparse
+    from . import FitbitAuth
+    from .codec import CODECS
+    parser = argparse.ArgumentParser(description='Export the accounts of a roster')
+    parser.add_argument('roster', help='ini file with one section per account')
+    parser.add_argument('--authorize', metavar='NAME',
+        help='authorize the account NAME in the browser and exit')
+    parser.add_argument('--pool', type=int, default=4,
+        help='number of accounts synced at once')
+    parser.add_argument('--processes', action='store_true',
+        help='sync accounts in processes instead of threads')
+    parser.add_argument('--workers', type=int, default=1,
+        help='number of concurrent downloads per account')
+    parser.add_argument('--wait', action='store_true',
+        help='retry accounts once their rate limit resets instead of exiting')
+    parser.add_argument('--daily-summaries', action='store_true')
+    parser.add_argument('--recent', action='store_true')
+    parser.add_argument('--codec', default='json', choices=CODECS)
+    parser.add_argument('--sqlite', metavar='FILE',
+        help='load all accounts into the SQLite database FILE')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,
+        format='%(asctime)s %(processName)s %(threadName)s %(name)s: %(message)s')
+
+    config = configparser.ConfigParser()
+    config.read('myfitbit.ini')
+    auth = (config['fitbit_auth']['client_id'], config['fitbit_auth']['client_secret'])
+    users = load_roster(args.roster)
+
+    if args.authorize:
+        user, = [u for u in users if u.name == args.authorize]
+        FitbitAuth(*auth, token_file=user.token_file).ensure_access_token()
+        return
+
+    options = {
+        'workers': args.workers,
+        'codec': args.codec,
+        'recent': args.recent,
+        'daily_summaries': args.daily_summaries,
+        'sqlite': args.sqlite and os.path.abspath(args.sqlite),
+    }
+    orchestrator = Orchestrator(users, (auth, '.', options), pool=args.pool,
+        processes=args.processes, wait=args.wait)
+    results = orchestrator.run()
+    print(format_results(results))
+    if any(r.status == FAILED for r in results):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+from . import codec, parse_rate_limit
+
+log = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    '''
+    Raised when the hourly request budget is used up
+    and the scheduler is not allowed to wait for it.
+    `reset` is the time (as in time.time()) the budget resets.
+    '''
+    def __init__(self, reset):
+        super(RateLimitExceeded, self).__init__(
+            'Rate limit exceeded, resets in {:.0f}s'.format(reset - time.time()))
+        self.reset = reset
+
+
+class Scheduler(object):
+    '''
+    Sits in front of a Fitbit client and paces its `get_*` calls
+    using the Fitbit-Rate-Limit-* headers of the previous responses.
+
+    The requests left in the current window are spread evenly over
+    the time until it resets, so the whole budget is used without
+    running dry early. When the budget is gone (or the API answers
+    429) the scheduler either sleeps until the reset (`wait=True`)
+    or raises RateLimitExceeded.
+
+    Safe to share between the download threads of FitbitExport.
+    '''
+    def __init__(self, client, wait=False):
+        self.client = client
+        self.wait = wait
+        self.lock = threading.Lock()
+        self.remaining = None
+        self.reset = None
+        self.next_time = 0
+        # number of requests sent through the scheduler
+        self.requests = 0
+        self.update(getattr(client, 'rate_limit', None))
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name.startswith('get_') and callable(attr):
+            return functools.partial(self.call, attr)
+        return attr
+
+    def update(self, rate_limit):
+        if not rate_limit:
+            return
+        with self.lock:
+            self.remaining = rate_limit['remaining']
+            self.reset = rate_limit['time'] + rate_limit['reset']
+
+    def throttle(self):
+        '''
+        Blocks until the next request may be sent.
+        '''
+        while 1:
+            with self.lock:
+                now = time.time()
+                if self.reset is None or now >= self.reset:
+                    # nothing known about the current window
+                    return
+                if self.remaining > 0:
+                    interval = (self.reset - now) / self.remaining
+                    start = max(now, self.next_time)
+                    self.next_time = start + interval
+                    # reserve the request for this thread
+                    self.remaining -= 1
+                    break
+                if not self.wait:
+                    raise RateLimitExceeded(self.reset)
+                delay = self.reset - now
+            log.info('Rate limit reached, waiting %.0fs', delay)
+            time.sleep(delay)
+        if start > now:
+            time.sleep(start - now)
+
+    def call(self, fn, *args, **kwargs):
+        from requests.exceptions import HTTPError
+        while 1:
+            self.throttle()
+            with self.lock:
+                self.requests += 1
+            try:
+                result = fn(*args, **kwargs)
+            except HTTPError as e:
+                if e.response is None or e.response.status_code != 429:
+                    raise
+                rate_limit = parse_rate_limit(e.response.headers)
+                if rate_limit is None:
+                    retry_after = int(e.response.headers.get('Retry-After', 3600))
+                    rate_limit = {'remaining': 0, 'reset': retry_after, 'time': time.time()}
+                rate_limit['remaining'] = 0
+                self.update(rate_limit)
+                if not self.wait:
+                    raise RateLimitExceeded(self.reset)
+                continue
+            self.update(self.client.rate_limit)
+            return result
+
+
+class JobQueue(object):
+    '''
+    On-disk list of the jobs a sync still has to download,
+    so an interrupted sync resumes without rescanning the store.
+
+    Jobs are (stream name, key) pairs, where the key is the ISO
+    date of a day file or the 'YYYY-MM' of a month file. For every
+    stream the queue also remembers up to which key it has been
+    planned; later syncs only need to look at newer keys.
+
+    The queue is kept in `filename`; finished jobs are appended
+    to `filename + '.done'` and folded in on the next `save`.
+    The keys of a stream are kept in an insertion ordered dict.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.done_filename = filename + '.done'
+        self.planned = {}
+        self.jobs = {}
+        self.load()
+
+    def load(self):
+        if os.path.isfile(self.filename):
+            data = json.load(open(self.filename))
+            self.planned = data['planned']
+            self.jobs = {name: dict.fromkeys(keys) for name, keys in data['jobs'].items()}
+        if os.path.isfile(self.done_filename):
+            done = set()
+            with open(self.done_filename) as f:
+                for line in f:
+                    name, key = line.split()
+                    done.add((name, key))
+            for name, key in done:
+                self.jobs.get(name, {}).pop(key, None)
+
+    def save(self):
+        # the done log is only dropped once the queue is on disk
+        codec.write_atomic(self.filename, json.dumps({
+            'planned': self.planned,
+            'jobs': {name: list(keys) for name, keys in self.jobs.items()},
+        }, indent=2, sort_keys=True).encode('utf-8'))
+        if os.path.isfile(self.done_filename):
+            os.remove(self.done_filename)
+
+    def pending(self, name):
+        return list(self.jobs.get(name, []))
+
+    def plan(self, name, keys, through):
+        '''
+        Adds `keys` to the jobs of `name`, and records that
+        everything up to `through` has been planned.
+        '''
+        jobs = self.jobs.setdefault(name, {})
+        for k in keys:
+            jobs.setdefault(k)
+        if through is not None:
+            self.planned[name] = through
+
+    def done(self, name, key):
+        keys = self.jobs.get(name)
+        if not keys or key not in keys:
+            return
+        del keys[key]
+        with open(self.done_filename, 'a') as f:
+            f.write('{} {}\n'.format(name, key))
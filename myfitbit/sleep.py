@@ -0,0 +1,165 @@
+'''
+Interval index of the sleep sessions in a local store.
+
+The index holds every session once (by logId) without its stage
+series, sorted by startTime, and answers
+
+    overlapping(t0, t1)     sessions overlapping the times t0 to t1
+    on_date(d)              sessions with dateOfSleep d
+
+with a binary search. The stage series (`levels.data`) of a session
+is only read from its month file when asked for, see `levels`.
+
+The index is cached in "sleep_index.json" in the user directory,
+together with the signature of every month file it was built from;
+only changed months are read again.
+'''
+import bisect
+import logging
+import os
+from datetime import date, datetime
+
+from . import codec
+from .manifest import parse_filename
+
+log = logging.getLogger(__name__)
+
+# bump when the cached index changes format
+INDEX_VERSION = 1
+
+# parts of `levels` left out of the index
+LAZY_LEVELS = ('data', 'shortData')
+
+
+def session(record):
+    '''
+    Copy of sleep `record` without its stage series.
+    '''
+    s = dict(record)
+    if 'levels' in s:
+        s['levels'] = {k: v for k, v in s['levels'].items() if k not in LAZY_LEVELS}
+    return s
+
+
+def timestamp(t):
+    '''
+    Formats a datetime or date like the startTime of sleep records,
+    so it can be compared with them as a string.
+    '''
+    if isinstance(t, datetime):
+        return t.isoformat(timespec='milliseconds')
+    if isinstance(t, date):
+        return t.isoformat() + 'T00:00:00.000'
+    return t
+
+
+class SleepIndex(object):
+    '''
+    Sleep sessions of `export`, see the module docstring.
+
+    `sessions` is the list of sessions sorted by startTime.
+    '''
+    def __init__(self, export):
+        self.export = export
+        self.filename = export.filename('sleep_index.json')
+        self.sessions = []
+        self.load()
+
+    def load(self):
+        cached = {}
+        if os.path.isfile(self.filename):
+            index = codec.read(self.filename)
+            if index['version'] == INDEX_VERSION:
+                cached = index['months']
+
+        months = {}
+        changed = False
+        for filename in self.export.stored_months('sleep'):
+            name, key, partial = parse_filename(os.path.basename(filename))
+            signature = self.export.file_signature('sleep', key, filename)
+            month = cached.get(key)
+            if month is None or month['signature'] != signature \
+                    or month['partial'] != partial:
+                month = {
+                    'signature': signature,
+                    'partial': partial,
+                    'sessions': [session(r) for r in self.export.read(filename) or []],
+                }
+                changed = True
+            months[key] = month
+        if changed or len(months) != len(cached):
+            codec.write_atomic(self.filename, codec.encode(
+                {'version': INDEX_VERSION, 'months': months}, 'compact'))
+
+        # logId -> month; a session downloaded again in a later month wins
+        self.months = {}
+        sessions = {}
+        for key in sorted(months):
+            for s in months[key]['sessions']:
+                sessions[s['logId']] = s
+                self.months[s['logId']] = (key, months[key]['partial'])
+        self.sessions = sorted(sessions.values(), key=lambda s: (s['startTime'], s['logId']))
+
+        self.starts = [s['startTime'] for s in self.sessions]
+        self.ends = [s['endTime'] for s in self.sessions]
+        # latest end of the sessions up to every position; sorted,
+        # so the first session that may reach a time can be searched
+        self.max_ends = []
+        latest = ''
+        for end in self.ends:
+            latest = max(latest, end)
+            self.max_ends.append(latest)
+        by_date = sorted(range(len(self.sessions)),
+            key=lambda i: self.sessions[i]['dateOfSleep'])
+        self.dates = [self.sessions[i]['dateOfSleep'] for i in by_date]
+        self.by_date = by_date
+        self._month = None
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __iter__(self):
+        return iter(self.sessions)
+
+    def overlapping(self, t0, t1):
+        '''
+        Sessions overlapping the times `t0` to `t1` (datetimes or
+        strings like startTime), sorted by startTime.
+        '''
+        t0 = timestamp(t0)
+        t1 = timestamp(t1)
+        i = bisect.bisect_left(self.max_ends, t0)
+        j = bisect.bisect_right(self.starts, t1)
+        return [self.sessions[k] for k in range(i, j) if self.ends[k] >= t0]
+
+    def on_date(self, d):
+        '''
+        Sessions with dateOfSleep `d` (a date or 'YYYY-MM-DD').
+        '''
+        if isinstance(d, date):
+            d = d.isoformat()
+        i = bisect.bisect_left(self.dates, d)
+        j = bisect.bisect_right(self.dates, d)
+        return [self.sessions[k] for k in sorted(self.by_date[i:j])]
+
+    def record(self, log_id):
+        '''
+        The full sleep record of session `log_id`, read from its
+        month file. The last month read is kept in memory.
+        '''
+        key, partial = self.months[log_id]
+        if self._month is None or self._month[0] != (key, partial):
+            y, m = map(int, key.split('-'))
+            filename = self.export.month_filename('sleep', date(y, m, 1), partial)
+            records = {r['logId']: r for r in self.export.read(filename) or []}
+            self._month = (key, partial), records
+        return self._month[1][log_id]
+
+    def levels(self, session, short=False):
+        '''
+        The stage series `levels.data` of `session` (a session or
+        its logId), or `levels.shortData` with `short`.
+        '''
+        log_id = session if isinstance(session, int) else session['logId']
+        levels = self.record(log_id).get('levels', {})
+        return levels.get('shortData' if short else 'data', [])
@@ -127,11 +127,6 @@ function sleep_chart(sleep, range) {
             r.date = s.dateOfSleep;
             rects.push(r);
         }
-        for (var j=0; j<s.levels.data.length; j++) {
-            var r = s.levels.data[j];
-            r.date = s.dateOfSleep;
-            rects.push(r);
-        }
     }
 
     var bars = chart.g.selectAll('.bar').data(rects).enter();
@@ -159,10 +154,12 @@ function heartrate_chart(heartrate, range) {
     var color = d3.scaleSequential(d3.interpolateViridis)
         .domain([0, 1]);
 
+    // the overview only has hourly means, so the color
+    // scale is based on their distribution
     var percentile = {};
     all_data = [];
     for (var i=0; i<heartrate.length; i++) {
-        all_data = all_data.concat(heartrate[i].minutes);
+        all_data = all_data.concat(heartrate[i].hourly);
     }
     all_data.sort(function(a, b) { return a - b; });
     for (var i=0; i<all_data.length; i++) {
@@ -185,7 +182,7 @@ function heartrate_chart(heartrate, range) {
         .attr('transform', 'translate(20, -15)');
     legend_width = 401;
     for (var i=0; i<legend_width; i++) {
-        var k = all_data[Math.floor(all_data.length * i / legend_width)];
+        var k = Math.round(all_data[Math.floor(all_data.length * i / legend_width)]);
         legend.append('rect')
             .attr('x', i)
             .attr('y', 0)
@@ -200,26 +197,59 @@ function heartrate_chart(heartrate, range) {
         }
 
     }
-    all_data.splice(0, 0);
 
-    for (var i=0; i<heartrate.length; i++) {
-        var hr = heartrate[i];
-        var d = new Date(hr.date);
-        var x = chart.sx(d);
-        var h = chart.sy(1 / 60 - chart.day_start_hour) + 1;
-        for (var j=0; j<hr.minutes.length; j++) {
-            var v = hr.minutes[j];
+    HEARTRATE = {
+        chart: chart,
+        fill: function(v) { return color(percentile[Math.round(v)]); }
+    };
+    draw_heartrate(heartrate, 'hourly', 60);
+
+    // clicking a day loads the 5 minute detail of its month
+    chart.svg.on('click', function() {
+        var x = d3.mouse(chart.g.node())[0];
+        var d = chart.sx.invert(x);
+        load_detail('heartrate', d.toISOString().substr(0, 7));
+    });
+}
+
+function draw_heartrate(days, key, minutes) {
+    var chart = HEARTRATE.chart;
+    var g = chart.g.append('g');
+    var h = chart.sy(minutes / 60) - chart.sy(0) + 1;
+    for (var i=0; i<days.length; i++) {
+        var x = chart.sx(new Date(days[i].date));
+        var values = days[i][key];
+        for (var j=0; j<values.length; j++) {
+            var v = values[j];
             if (v === null) { continue; }
-            chart.g.append('rect')
+            g.append('rect')
                 .attr('x', x)
-                .attr('y', chart.sy(j / 60))
+                .attr('y', chart.sy(j * minutes / 60))
                 .attr('width', chart.day_width)
                 .attr('height', h)
-                .attr('fill', color(percentile[hr.minutes[j]]));
+                .attr('fill', HEARTRATE.fill(v));
         }
     }
 }
 
+var DETAIL_LOADED = {};
+
+function load_detail(stream, month) {
+    var name = stream + '.' + month;
+    if (DETAIL_LOADED[name]) { return; }
+    DETAIL_LOADED[name] = true;
+    var s = document.createElement('script');
+    s.src = detail_dir + '/' + name + '.js';
+    document.body.appendChild(s);
+}
+
+// called by the detail scripts written by report.py
+function report_detail(stream, month, days) {
+    if (stream == 'heartrate') {
+        draw_heartrate(days, 'mean', 5);
+    }
+}
+
 function get_extents(data) {
 
     var sleep_start = new Date(data.sleep[0].dateOfSleep);
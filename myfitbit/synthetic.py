@@ -0,0 +1,311 @@
+'''
+Synthetic Fitbit data, for benchmarks and tests.
+
+SyntheticUser returns plausible data in the format of the Fitbit
+client methods for any day: a daily rhythm of sleep, rest and
+activity drives heart rate, steps and distance, and each night has
+a sleep session with stages. Every day is generated from its own
+seed, so a day is the same whatever else was generated before.
+
+`generate` writes the histories of several users in the layout of
+FitbitExport:
+
+    python -m myfitbit.synthetic --root /tmp/fitbit --users 3 --years 5
+'''
+import logging
+import random
+from datetime import date, datetime, timedelta
+
+from .export import FitbitExport, BUFFER_DAYS, DAY_STREAMS, date_range
+
+log = logging.getLogger(__name__)
+
+# streams written by `generate`
+STREAMS = DAY_STREAMS + ('sleep', 'weight')
+
+MINUTES = 24 * 60
+
+# share of days the tracker was not worn
+NOT_WORN = 0.03
+
+SLEEP_LEVELS = ('light', 'deep', 'rem', 'wake')
+SLEEP_WEIGHTS = (55, 15, 20, 10)
+
+
+def hhmmss(minute):
+    return '{:02d}:{:02d}:00'.format(minute // 60, minute % 60)
+
+
+class SyntheticUser(object):
+    '''
+    Synthetic data of user `user_id`; `seed` selects another
+    history for the same user id.
+    '''
+    def __init__(self, user_id, seed=0):
+        self.user_id = user_id
+        self.seed = seed
+        base = self.rng('base')
+        self.resting = base.randint(52, 72)
+        self.stride = base.uniform(0.65, 0.85) / 1000
+        self.weight = base.uniform(55, 100)
+        self.height = base.uniform(1.55, 1.95)
+        # (date, minutes) of the last day generated
+        self._day = None
+
+    def rng(self, *key):
+        return random.Random('{} {} {}'.format(self.seed, self.user_id,
+            ' '.join(map(str, key))))
+
+    def profile(self):
+        return {
+            'encodedId': self.user_id,
+            'displayName': 'Synthetic {}'.format(self.user_id),
+            'fullName': 'Synthetic {}'.format(self.user_id),
+            'height': round(self.height * 100, 1),
+            'weight': round(self.weight, 1),
+            'timezone': 'UTC',
+        }
+
+    def worn(self, d):
+        return self.rng('worn', d).random() >= NOT_WORN
+
+    def sleep_times(self, d):
+        '''
+        (start, end) of the main sleep that ends on day `d`,
+        as datetimes.
+        '''
+        rng = self.rng('sleep', d)
+        start = datetime(d.year, d.month, d.day) - timedelta(minutes=rng.randint(0, 150))
+        end = start + timedelta(minutes=rng.randint(6 * 60, 9 * 60))
+        return start, end
+
+    def minutes(self, d):
+        '''
+        Per minute (heartrate, steps) of day `d`, None for
+        minutes without a heart rate.
+        '''
+        day = self._day
+        if day and day[0] == d:
+            return day[1]
+        rng = self.rng('minutes', d)
+        asleep = set()
+        for night in (d, d + timedelta(days=1)):
+            start, end = self.sleep_times(night)
+            first = int((start - datetime(d.year, d.month, d.day)).total_seconds() // 60)
+            last = int((end - datetime(d.year, d.month, d.day)).total_seconds() // 60)
+            asleep.update(range(max(0, first), min(MINUTES, last)))
+        # a walk or two, and a workout on some days
+        bouts = [(rng.randint(7 * 60, 20 * 60), rng.randint(10, 40), 100)
+            for i in range(rng.randint(1, 3))]
+        if rng.random() < 0.4:
+            bouts.append((rng.randint(6 * 60, 20 * 60), rng.randint(20, 70), 160))
+        active = {}
+        for start, length, cadence in bouts:
+            for m in range(start, min(MINUTES, start + length)):
+                active[m] = cadence
+
+        minutes = []
+        hr = self.resting
+        for m in range(MINUTES):
+            if m in asleep:
+                target, steps = self.resting - 5, 0
+            elif m in active:
+                steps = int(active[m] * rng.uniform(0.8, 1.1))
+                target = self.resting + 30 + steps // 3
+            else:
+                steps = rng.choice((0, 0, 0, rng.randint(1, 40)))
+                target = self.resting + 12 + steps // 4
+            hr += (target - hr) * 0.3 + rng.gauss(0, 2)
+            heartrate = int(round(hr)) if rng.random() > 0.02 else None
+            minutes.append((heartrate, steps))
+        self._day = (d, minutes)
+        return minutes
+
+    def get_heartrate_intraday(self, d):
+        if not self.worn(d):
+            return []
+        return [{'time': hhmmss(m), 'value': hr}
+            for m, (hr, steps) in enumerate(self.minutes(d)) if hr is not None]
+
+    def get_heartrate_seconds(self, d):
+        '''
+        Heart rate of day `d` at 1 second resolution: a sample
+        every few seconds around the value of the minute.
+        '''
+        if not self.worn(d):
+            return []
+        rng = self.rng('seconds', d)
+        data = []
+        for m, (hr, steps) in enumerate(self.minutes(d)):
+            if hr is None:
+                continue
+            t = m * 60 + rng.randint(0, 4)
+            while t < m * 60 + 60:
+                data.append({
+                    'time': '{:02d}:{:02d}:{:02d}'.format(t // 3600, t // 60 % 60, t % 60),
+                    'value': hr + rng.randint(-2, 2),
+                })
+                t += rng.randint(1, 15)
+        return data
+
+    def get_steps_intraday(self, d):
+        if not self.worn(d):
+            return []
+        return [{'time': hhmmss(m), 'value': steps}
+            for m, (hr, steps) in enumerate(self.minutes(d))]
+
+    def get_distance_intraday(self, d):
+        if not self.worn(d):
+            return []
+        return [{'time': hhmmss(m), 'value': round(steps * self.stride, 5)}
+            for m, (hr, steps) in enumerate(self.minutes(d))]
+
+    def get_activities(self, d):
+        if not self.worn(d):
+            steps = distance = sedentary = 0
+            minutes = []
+        else:
+            minutes = self.minutes(d)
+            steps = sum(s for hr, s in minutes)
+            distance = round(steps * self.stride, 2)
+            sedentary = sum(1 for hr, s in minutes if s == 0)
+        active = len(minutes) - sedentary
+        return {
+            'activities': [],
+            'goals': {'activeMinutes': 30, 'caloriesOut': 2800, 'distance': 8,
+                      'floors': 10, 'steps': 10000},
+            'summary': {
+                'activityCalories': steps // 20,
+                'caloriesBMR': int(self.weight * 22),
+                'caloriesOut': int(self.weight * 22) + steps // 20,
+                'distances': [{'activity': 'total', 'distance': distance}],
+                'fairlyActiveMinutes': active // 10,
+                'floors': steps // 1000,
+                'lightlyActiveMinutes': active - active // 10,
+                'restingHeartRate': self.resting,
+                'sedentaryMinutes': sedentary,
+                'steps': steps,
+                'veryActiveMinutes': 0,
+            },
+        }
+
+    def sleep(self, d):
+        '''
+        The sleep records with dateOfSleep `d`.
+        '''
+        if not self.worn(d):
+            return []
+        rng = self.rng('stages', d)
+        start, end = self.sleep_times(d)
+        data = []
+        t = start
+        while t < end:
+            level = rng.choices(SLEEP_LEVELS, SLEEP_WEIGHTS)[0]
+            seconds = min(rng.randint(1, 60) * 30, int((end - t).total_seconds()))
+            data.append({'dateTime': t.isoformat(timespec='milliseconds'),
+                'level': level, 'seconds': seconds})
+            t += timedelta(seconds=seconds)
+        summary = {}
+        for level in SLEEP_LEVELS:
+            stages = [o for o in data if o['level'] == level]
+            summary[level] = {'count': len(stages),
+                'minutes': sum(o['seconds'] for o in stages) // 60}
+        time_in_bed = int((end - start).total_seconds() // 60)
+        awake = summary['wake']['minutes']
+        return [{
+            'dateOfSleep': d.isoformat(),
+            'duration': time_in_bed * 60000,
+            'efficiency': 100 * (time_in_bed - awake) // time_in_bed,
+            'endTime': end.isoformat(timespec='milliseconds'),
+            'infoCode': 0,
+            'isMainSleep': True,
+            'levels': {'data': data, 'shortData': [], 'summary': summary},
+            'logId': int(start.timestamp()) * 1000 + sum(map(ord, self.user_id)) % 1000,
+            'minutesAfterWakeup': 0,
+            'minutesAsleep': time_in_bed - awake,
+            'minutesAwake': awake,
+            'minutesToFallAsleep': 0,
+            'startTime': start.isoformat(timespec='milliseconds'),
+            'timeInBed': time_in_bed,
+            'type': 'stages',
+        }]
+
+    def weight_log(self, d):
+        '''
+        The weight logs of day `d`: one every few days.
+        '''
+        rng = self.rng('weight', d)
+        if rng.random() > 0.3:
+            return []
+        days = (d - date(2000, 1, 1)).days
+        weight = round(self.weight + 2 * ((days % 365) / 365 - 0.5) + rng.gauss(0, 0.3), 1)
+        t = datetime(d.year, d.month, d.day, 7, rng.randint(0, 59))
+        return [{
+            'bmi': round(weight / self.height ** 2, 2),
+            'date': d.isoformat(),
+            'logId': int(t.timestamp()) * 1000,
+            'source': 'Aria',
+            'time': t.strftime('%H:%M:%S'),
+            'weight': weight,
+        }]
+
+    def get_sleep_range(self, date_start, date_end):
+        return [r for d in date_range(date_start, date_end) for r in self.sleep(d)]
+
+    def get_weight_range(self, date_start, date_end):
+        return [r for d in date_range(date_start, date_end) for r in self.weight_log(d)]
+
+
+def generate(root, user_ids, start, end=None, seed=0, codec='json', streams=STREAMS):
+    '''
+    Writes the synthetic histories of `user_ids` from `start` to
+    `end` (by default the last day a sync would download) to the
+    FitbitExport in `root`. Returns the number of files written.
+    '''
+    if end is None:
+        end = date.today() - timedelta(days=BUFFER_DAYS + 1)
+    count = 0
+    for user_id in user_ids:
+        user = SyntheticUser(user_id, seed)
+        export = FitbitExport(root, user_id=user_id, codec=codec)
+        for name in streams:
+            if name in DAY_STREAMS:
+                client_fn = getattr(user, 'get_' + name)
+                for d in date_range(start, end):
+                    export.write(export.day_filename(name, d), client_fn(d))
+                    count += 1
+                continue
+            client_fn = getattr(user, 'get_{}_range'.format(name))
+            month = date(start.year, start.month, 1)
+            while month <= end:
+                month_end = date(month.year + month.month // 12, month.month % 12 + 1, 1) - timedelta(days=1)
+                partial = month_end >= date.today()
+                export.write(export.month_filename(name, month, partial),
+                    client_fn(max(month, start), min(month_end, end)))
+                count += 1
+                month = month_end + timedelta(days=1)
+        log.info('Generated %s', user_id)
+    return count
+
+
+def main():
+    import argparse
+    from .codec import CODECS
+    parser = argparse.ArgumentParser(description='Write synthetic Fitbit exports')
+    parser.add_argument('--root', required=True, help='directory of the export')
+    parser.add_argument('--users', type=int, default=1)
+    parser.add_argument('--years', type=float, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--codec', default='json', choices=CODECS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    end = date.today() - timedelta(days=BUFFER_DAYS + 1)
+    start = end - timedelta(days=int(args.years * 365) - 1)
+    user_ids = ['SYN{:03d}'.format(i) for i in range(args.users)]
+    count = generate(args.root, user_ids, start, end, args.seed, args.codec)
+    log.info('Wrote %d files', count)
+
+
+if __name__ == '__main__':
+    main()
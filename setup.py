@@ -26,9 +26,11 @@ setup(
     'License :: OSI Approved :: GNU General Public License v3 (GPLv3)',
     'Operating System :: OS Independent',
     'Programming Language :: Python :: 3',
-    'Programming Language :: Python :: 3.3',
-    'Programming Language :: Python :: 3.4',
-    'Programming Language :: Python :: 3.5',
+    'Programming Language :: Python :: 3.7',
+    'Programming Language :: Python :: 3.8',
+    'Programming Language :: Python :: 3.9',
+    'Programming Language :: Python :: 3.10',
+    'Programming Language :: Python :: 3.11',
     'Programming Language :: Python :: Implementation :: PyPy',
     'Programming Language :: Python',
     'Topic :: Scientific/Engineering :: Medical Science Apps.',
@@ -38,6 +40,7 @@ setup(
     'Topic :: Utilities',
   ],
 
+  python_requires = '>=3.7',
   packages = ['myfitbit'],
   include_package_data = True,
 
@@ -45,4 +48,8 @@ setup(
     'requests',
     'dominate',
   ],
+
+  extras_require = {
+    'columnar': ['numpy'],
+  },
 )
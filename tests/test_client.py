@@ -0,0 +1,238 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+import pytest
+import requests
+
+from myfitbit import Fitbit, FitbitAuth
+from myfitbit.aio import AsyncFitbit
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, text='{}'):
+        self.status_code = status_code
+        self.text = text
+        self.headers = {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(response=self)
+
+
+class FakeSession(object):
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.timeouts = []
+        self.headers = {}
+
+    def get(self, url, timeout=None):
+        self.timeouts.append(timeout)
+        r = self.responses.pop(0)
+        if isinstance(r, Exception):
+            raise r
+        return r
+
+
+def make_client(responses):
+    f = Fitbit.__new__(Fitbit)
+    f.timeout = 5
+    f.retries = 3
+    f.rate_limit = None
+    f.auth = None
+    f.access_token = 'token'
+    f.lock = threading.Lock()
+    f.session = FakeSession(responses)
+    f.RETRY_BACKOFF = 0.001
+    return f
+
+
+def test_retry():
+    f = make_client([
+        requests.ConnectionError(),
+        FakeResponse(503),
+        FakeResponse(200, '{"a": 1}'),
+    ])
+    assert f.get('url') == {'a': 1}
+    assert f.session.timeouts == [5, 5, 5]
+
+
+def test_no_retry():
+    f = make_client([FakeResponse(404), FakeResponse(200)])
+    with pytest.raises(requests.HTTPError):
+        f.get('url')
+    f = make_client([FakeResponse(500)] * 4)
+    with pytest.raises(requests.HTTPError):
+        f.get('url')
+    assert f.session.responses == []
+
+
+def write_token(filename, expires_in, refresh_token='r1'):
+    token = {'access_token': 'a1', 'refresh_token': refresh_token,
+        'expires_in': 28800, 'time': int(time.time()) - 28800 + expires_in,
+        'user_id': 'U1'}
+    with open(filename, 'w') as f:
+        json.dump(token, f)
+
+
+def test_refresh_before_expiry(tmpdir, monkeypatch):
+    posts = []
+    def post(url, headers, data, timeout):
+        posts.append(data)
+        return FakeResponse(200, json.dumps({'access_token': 'a2',
+            'refresh_token': 'r2', 'expires_in': 28800, 'user_id': 'U1'}))
+    monkeypatch.setattr(requests, 'post', post)
+    token_file = str(tmpdir.join('token'))
+
+    write_token(token_file, 3600)
+    fa = FitbitAuth('id', 'secret', token_file)
+    assert fa.load_access_token()
+    assert posts == []
+
+    # expires within REFRESH_MARGIN
+    write_token(token_file, 60)
+    fa = FitbitAuth('id', 'secret', token_file)
+    assert fa.load_access_token()
+    assert posts[0]['grant_type'] == 'refresh_token'
+    assert posts[0]['refresh_token'] == 'r1'
+    saved = json.load(open(token_file))
+    assert saved['access_token'] == 'a2'
+    assert saved['refresh_token'] == 'r2'
+    assert fa.user_id == 'U1'
+
+
+def test_refresh_rejected(tmpdir, monkeypatch):
+    monkeypatch.setattr(requests, 'post', lambda *args, **kwargs: FakeResponse(400,
+        '{"errors": [{"errorType": "invalid_grant"}], "success": false}'))
+    token_file = str(tmpdir.join('token'))
+    write_token(token_file, -10)
+    fa = FitbitAuth('id', 'secret', token_file)
+    assert not fa.load_access_token()
+    assert not os.path.exists(token_file)
+
+
+def test_refresh_unavailable(tmpdir, monkeypatch):
+    monkeypatch.setattr(requests, 'post',
+        lambda *args, **kwargs: FakeResponse(503))
+    token_file = str(tmpdir.join('token'))
+    # still valid for 5 minutes
+    write_token(token_file, 300)
+    fa = FitbitAuth('id', 'secret', token_file)
+    assert fa.load_access_token()
+    assert fa.access_token['access_token'] == 'a1'
+
+    write_token(token_file, -10)
+    fa = FitbitAuth('id', 'secret', token_file)
+    with pytest.raises(requests.HTTPError):
+        fa.load_access_token()
+    assert json.load(open(token_file))['refresh_token'] == 'r1'
+
+
+def test_renew_rejected_token():
+    class Auth(object):
+        access_token = {'access_token': 'token'}
+        def expires_soon(self):
+            return False
+        def refresh_access_token(self):
+            self.access_token = {'access_token': 'new'}
+
+    f = make_client([FakeResponse(401), FakeResponse(200, '{"a": 1}')])
+    f.auth = Auth()
+    assert f.get('url') == {'a': 1}
+    assert f.access_token == 'new'
+    assert f.session.headers['Authorization'] == 'Bearer new'
+
+
+def test_cached_profile(tmpdir):
+    profile_file = str(tmpdir.join('profile'))
+    with open(profile_file, 'w') as f:
+        json.dump({'encodedId': 'U1', 'fullName': 'cached'}, f)
+    f = Fitbit('token', profile_file=profile_file)
+    f.session = FakeSession([])
+    assert f.user_id == 'U1'
+    assert f.profile['fullName'] == 'cached'
+
+    # revalidated once the cache is too old
+    old = time.time() - Fitbit.PROFILE_MAX_AGE - 1
+    os.utime(profile_file, (old, old))
+    f = Fitbit('token', profile_file=profile_file)
+    f.session = FakeSession([FakeResponse(200,
+        '{"user": {"encodedId": "U1", "fullName": "new"}}')])
+    assert f.user_id == 'U1'
+    assert f.session.responses
+    assert f.profile['fullName'] == 'new'
+    assert json.load(open(profile_file))['fullName'] == 'new'
+
+    # a truncated cache is downloaded again
+    with open(profile_file, 'w') as f:
+        f.write('{"encodedId": "U')
+    f = Fitbit('token', profile_file=profile_file)
+    f.session = FakeSession([FakeResponse(200,
+        '{"user": {"encodedId": "U1", "fullName": "new"}}')])
+    assert f.profile['fullName'] == 'new'
+    assert json.load(open(profile_file))['encodedId'] == 'U1'
+
+
+def test_async_concurrency():
+    class Client(object):
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.running = 0
+            self.peak = 0
+
+        def get_activities(self, d):
+            with self.lock:
+                self.running += 1
+                self.peak = max(self.peak, self.running)
+            time.sleep(0.01)
+            with self.lock:
+                self.running -= 1
+            return d
+
+    client = Client()
+    f = AsyncFitbit(client, concurrency=3)
+
+    async def run():
+        return await asyncio.gather(*(f.get_activities(i) for i in range(10)))
+
+    assert asyncio.run(run()) == list(range(10))
+    assert client.peak == 3
+    f.executor.shutdown()
+
+
+def test_async_close():
+    class Session(object):
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    class Client(object):
+        session = Session()
+
+        def get_activities(self, d):
+            time.sleep(0.2)
+            return d
+
+    async def run():
+        ticks = []
+
+        async def tick():
+            while True:
+                ticks.append(1)
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.ensure_future(tick())
+        async with AsyncFitbit(Client()) as f:
+            call = asyncio.ensure_future(f.get_activities(1))
+            await asyncio.sleep(0)
+            before = len(ticks)
+        ticker.cancel()
+        # the loop kept running while close waited for the request
+        assert len(ticks) - before > 5
+        assert call.result() == 1
+        assert f.client.session.closed
+
+    asyncio.run(run())
@@ -0,0 +1,65 @@
+import os
+import shutil
+
+import pytest
+
+from myfitbit import codec
+from myfitbit.export import FitbitExport
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), '..', 'notebooks', 'example_data')
+
+
+@pytest.mark.parametrize('name', codec.CODECS)
+def test_roundtrip(name):
+    for data in ([], [{'a': 1}, {'b': [1.5, None]}], {'summary': {'steps': 10}}):
+        b = codec.encode(data, name)
+        assert codec.decode(b) == data
+    assert codec.detect(codec.encode([1], name)) == ('json' if name == 'compact' else name)
+
+
+def test_write_atomic(tmpdir, monkeypatch):
+    filename = str(tmpdir.join('a', 'x.json'))
+    codec.write_atomic(filename, b'[1]')
+
+    def fail(*args):
+        raise OSError('disk full')
+    monkeypatch.setattr(os, 'replace', fail)
+    with pytest.raises(OSError):
+        codec.write_atomic(filename, b'[2]')
+    assert open(filename, 'rb').read() == b'[1]'
+    assert os.listdir(str(tmpdir.join('a'))) == ['x.json']
+
+
+def test_write_atomic_mode(tmpdir):
+    filename = str(tmpdir.join('x.json'))
+    codec.write_atomic(filename, b'[1]')
+    with open(str(tmpdir.join('y.json')), 'w'):
+        pass
+    assert os.stat(filename).st_mode == os.stat(str(tmpdir.join('y.json'))).st_mode
+    os.chmod(filename, 0o640)
+    codec.write_atomic(filename, b'[2]')
+    assert os.stat(filename).st_mode & 0o777 == 0o640
+
+
+def test_reencode(tmpdir):
+    shutil.copytree(os.path.join(EXAMPLE, 'sleep'), str(tmpdir.join('u', 'sleep')))
+    export = FitbitExport(str(tmpdir), user_id='u')
+    expected = export.get_sleep()
+    size = sum(os.path.getsize(f) for f in export.stored_months('sleep'))
+    assert codec.reencode(export.filename(), 'lzma') == 7
+    assert export.get_sleep() == expected
+    assert sum(os.path.getsize(f) for f in export.stored_months('sleep')) < size / 5
+
+
+def test_series():
+    from myfitbit.synthetic import SyntheticUser
+    from datetime import date
+    day = SyntheticUser('u').get_heartrate_seconds(date(2018, 1, 1))
+    b = codec.encode(day, 'series')
+    assert codec.detect(b) == 'series' and codec.decode(b) == day
+    assert len(b) * 20 < len(codec.encode(day, 'compact'))
+    # gaps and jumps wider than a byte
+    data = [{'time': '00:00:00', 'value': 0}, {'time': '23:59:59', 'value': -40000}]
+    assert codec.decode(codec.encode(data, 'series')) == data
+    with pytest.raises(ValueError):
+        codec.encode([{'time': '00:00:00', 'value': 1.5}], 'series')
@@ -0,0 +1,66 @@
+from datetime import date, timedelta
+
+import requests
+
+from myfitbit import Fitbit
+from myfitbit.daemon import Account, CachedExport, Daemon, LRUCache
+from myfitbit.export import FitbitExport, Job, BUFFER_DAYS
+from myfitbit.mockapi import MockFitbit
+from myfitbit.scheduler import Scheduler
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == (True, 1)
+    cache.put('c', 3)
+    assert cache.get('b') == (False, None)
+    version = cache.version
+    cache.invalidate(lambda k: k == 'a')
+    assert cache.get('a') == (False, None)
+    # read before the invalidation, not cached
+    cache.put('a', 0, version)
+    assert cache.get('a') == (False, None)
+    assert cache.stats() == {'entries': 1, 'size': 2, 'hits': 1, 'misses': 3}
+
+
+def test_daemon(tmpdir):
+    last = date.today() - timedelta(days=BUFFER_DAYS + 1)
+    with MockFitbit() as api:
+        client = Fitbit('U1', base_url=api.url)
+        cache = LRUCache(1000)
+        export = CachedExport(str(tmpdir), Scheduler(client), cache, queue=True, manifest=True)
+        for name in ('heartrate_intraday', 'steps_intraday', 'distance_intraday', 'activities'):
+            export.queue.planned[name] = (last - timedelta(days=3)).isoformat()
+        previous_month = (last.replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
+        export.queue.planned['sleep'] = export.queue.planned['weight'] = previous_month
+        account = Account('test', 'U1', export, FitbitExport(str(tmpdir), user_id='U1'))
+        daemon = Daemon([account], cache, warm_days=3 + BUFFER_DAYS)
+        daemon.sync()
+        daemon.start(port=0, sync=False)
+        try:
+            url = daemon.url + '/U1/heartrate_intraday'
+            params = {'start': (last - timedelta(days=1)).isoformat(), 'end': last.isoformat()}
+            misses = cache.misses
+            days = requests.get(url, params=params).json()
+            # warmed by the sync
+            assert cache.misses == misses
+            assert days == list(account.reader.iter_heartrate_intraday(
+                last - timedelta(days=1), last))
+
+            sleep = requests.get(daemon.url + '/U1/sleep', params=params).json()
+            assert sleep == list(account.reader.iter_sleep(
+                last - timedelta(days=1), last))
+            assert requests.get(daemon.url + '/users').json() == ['U1']
+            assert requests.get(daemon.url + '/U1/nothing').status_code == 404
+            assert requests.get(url, params={'start': 'x'}).status_code == 400
+
+            # a file written by a sync replaces the cached day
+            export.save(Job('heartrate_intraday', last.isoformat(),
+                export.day_filename('heartrate_intraday', last), None, ()),
+                [{'time': '00:00:00', 'value': 99}])
+            day, = requests.get(url, params={'start': last.isoformat(), 'end': last.isoformat()}).json()
+            assert day['minutes'][:2] == [99, None]
+        finally:
+            daemon.stop()
@@ -0,0 +1,80 @@
+import os
+from datetime import date
+
+from myfitbit.database import Database
+from myfitbit.export import FitbitExport
+
+
+def test_database_update(tmpdir):
+    export = FitbitExport(str(tmpdir), user_id='u')
+    export.write(export.day_filename('heartrate_intraday', date(2018, 1, 1)), [
+        {'time': '00:00:00', 'value': 60},
+        {'time': '01:30:00', 'value': 70},
+    ])
+    export.write(export.day_filename('activities', date(2018, 1, 1)),
+        {'summary': {'steps': 1234, 'restingHeartRate': 58, 'distances': []}})
+    export.write(export.month_filename('sleep', date(2018, 1, 1)), [{
+        'logId': 1, 'dateOfSleep': '2018-01-01', 'type': 'stages',
+        'startTime': '2017-12-31T23:00:00.000', 'endTime': '2018-01-01T07:00:00.000',
+        'levels': {'data': [{'dateTime': '2017-12-31T23:00:00.000', 'level': 'light', 'seconds': 60}]},
+    }])
+    export.write(export.month_filename('weight', date(2018, 1, 1)), [
+        {'logId': 2, 'date': '2018-01-02', 'time': '08:00:00', 'weight': 77.7, 'bmi': 24.0}])
+
+    db = Database(str(tmpdir.join('db.sqlite')))
+    assert db.update(export) == 4
+    assert db.intraday('u', 'heartrate_intraday', date(2018, 1, 1), date(2018, 1, 1)) == [
+        ('2018-01-01', 0, 60), ('2018-01-01', 90, 70)]
+    assert db.daily('u', 'steps', '2018-01-01', '2018-12-31') == [('2018-01-01', 1234)]
+    assert db.conn.execute('SELECT log_id, level FROM sleep_stages').fetchall() == [(1, 'light')]
+    assert db.conn.execute('SELECT weight FROM weight WHERE user = ?', ('u',)).fetchall() == [(77.7,)]
+
+    # only changed and removed files are loaded again
+    assert db.update(export) == 0
+    export.write(export.day_filename('heartrate_intraday', date(2018, 1, 1)), [
+        {'time': '00:01:00', 'value': 61}])
+    os.remove(export.month_filename('weight', date(2018, 1, 1)))
+    assert db.update(export) == 1
+    assert db.intraday('u', 'heartrate_intraday', '2018-01-01', '2018-01-01') == [
+        ('2018-01-01', 1, 61)]
+    assert db.conn.execute('SELECT count(*) FROM weight').fetchone() == (0,)
+    assert db.conn.execute('PRAGMA journal_mode').fetchone() == ('wal',)
+    db.close()
+
+
+def test_database_daily_streams(tmpdir):
+    export = FitbitExport(str(tmpdir), user_id='u')
+    export.write(export.day_filename('activities', date(2018, 1, 1)),
+        {'summary': {'steps': 1234}})
+    export.write(export.daily_filename(2018), {'2018-01-01': {'steps': 1300}})
+
+    db = Database(str(tmpdir.join('db.sqlite')))
+    assert db.update(export) == 2
+    assert db.daily('u', 'steps', '2018-01-01', '2018-01-01', 'activities') == [('2018-01-01', 1234)]
+    assert db.daily('u', 'steps', '2018-01-01', '2018-01-01', 'daily') == [('2018-01-01', 1300)]
+    assert db.daily('u', 'steps', '2018-01-01', '2018-01-01') == [('2018-01-01', 1234)]
+
+    # removing one stream keeps the other
+    os.remove(export.day_filename('activities', date(2018, 1, 1)))
+    assert db.update(export) == 0
+    assert db.daily('u', 'steps', '2018-01-01', '2018-01-01') == [('2018-01-01', 1300)]
+    db.close()
+
+
+def test_database_migrate(tmpdir):
+    filename = str(tmpdir.join('db.sqlite'))
+    db = Database(filename)
+    db.conn.executescript('''
+        DROP TABLE daily;
+        CREATE TABLE daily (
+            user TEXT, date TEXT, name TEXT, value NUMERIC, stream TEXT,
+            PRIMARY KEY (user, date, name)
+        ) WITHOUT ROWID;
+        INSERT INTO sources VALUES ('u', 'daily', '2018', 'x');
+    ''')
+    db.close()
+    db = Database(filename)
+    assert db.conn.execute('SELECT count(*) FROM sources').fetchone() == (0,)
+    assert [c[1] for c in db.conn.execute('PRAGMA table_info(daily)') if c[5]] == [
+        'user', 'date', 'name', 'stream']
+    db.close()
@@ -0,0 +1,244 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from myfitbit.export import FitbitExport, Job, parse_date
+
+
+def test_download_ordered(tmpdir):
+    export = FitbitExport(str(tmpdir), user_id='u', workers=4)
+    written = []
+    write = export.write
+    export.write = lambda filename, data: (written.append(filename), write(filename, data))
+
+    def fetch(i):
+        # later jobs finish first
+        time.sleep((10 - i) * 0.002)
+        return {'i': i}
+
+    jobs = [Job('x', None, export.filename('x', '{}.json'.format(i)), fetch, (i,)) for i in range(10)]
+    export.download(jobs)
+    assert written == [j.filename for j in jobs]
+    assert json.load(open(jobs[3].filename)) == {'i': 3}
+
+
+def test_download_error_cancels(tmpdir):
+    export = FitbitExport(str(tmpdir), user_id='u', workers=2)
+    calls = []
+    lock = threading.Lock()
+
+    def fetch(i):
+        with lock:
+            calls.append(i)
+        if i == 1:
+            raise ValueError(i)
+        return i
+
+    jobs = [Job('x', None, export.filename('x', '{}.json'.format(i)), fetch, (i,)) for i in range(100)]
+    with pytest.raises(ValueError):
+        export.download(jobs)
+    assert len(calls) < 100
+    assert os.path.isfile(jobs[0].filename)
+    assert not os.path.isfile(jobs[2].filename)
+
+
+def test_columnar_migrate(tmpdir):
+    pytest.importorskip('numpy')
+    from myfitbit import columnar
+    example = os.path.join(os.path.dirname(__file__), '..', 'notebooks')
+    export = FitbitExport(example, user_id='example_data')
+    expected = export.get_heartrate_intraday()[:3]
+
+    root = tmpdir.mkdir('u')
+    for d in expected:
+        path = export.day_filename('heartrate_intraday', parse_date(d['date']))
+        rel = os.path.relpath(path, export.filename())
+        root.join(rel).write(open(path).read(), ensure=True)
+
+    copy = FitbitExport(str(tmpdir), user_id='u', columnar=True)
+    columnar.migrate(copy, ['heartrate_intraday'])
+    assert copy.get_heartrate_intraday() == expected
+    first, present, values = copy.get_intraday_arrays('heartrate_intraday')[0]
+    assert isinstance(values, columnar.np.memmap)
+    assert present.sum() == 3
+
+
+def test_bucket():
+    from myfitbit import intraday
+    datasets = [
+        [{'time': '00:00:00', 'value': 60}, {'time': '23:59:00', 'value': 61}],
+        [],
+        [{'time': '00:15:00', 'value': 1.5}],
+    ]
+    days = intraday.bucket(datasets)
+    assert [len(d) for d in days] == [1440] * 3
+    assert days[0][0] == 60 and days[0][-1] == 61 and days[0][1] is None
+    assert days[1] == [None] * 1440
+    assert days[2][15] == 1.5
+    days = intraday.bucket(datasets, '15min')
+    assert len(days[0]) == 96
+    assert days[2][:2] == [None, 1.5]
+
+
+def test_iter_range():
+    from datetime import date
+    example = os.path.join(os.path.dirname(__file__), '..', 'notebooks')
+    export = FitbitExport(example, user_id='example_data')
+    days = list(export.iter_steps_intraday(date(2018, 1, 30), date(2018, 2, 2)))
+    assert [d['date'] for d in days] == ['2018-01-30', '2018-01-31', '2018-02-01', '2018-02-02']
+    assert days == export.get_steps_intraday()[29:33]
+    sleep = list(export.iter_sleep(date(2018, 3, 1), date(2018, 3, 31)))
+    assert sleep and all(s['dateOfSleep'].startswith('2018-03') for s in sleep)
+    activities = list(export.iter_activities(end=date(2018, 1, 2)))
+    assert [a['date'] for a in activities] == ['2018-01-01', '2018-01-02']
+
+
+def test_sync_daily(tmpdir):
+    from datetime import timedelta
+    from myfitbit.export import DAILY_RESOURCES, MAX_RANGE_DAYS
+
+    class Client(object):
+        user_id = 'u'
+        calls = 0
+
+        def days(self, start, end):
+            self.calls += 1
+            while start <= end:
+                yield start.isoformat()
+                start += timedelta(days=1)
+
+        def get_activities_range(self, resource, start, end):
+            return [{'dateTime': d, 'value': '0.5' if resource == 'distance' else '10'}
+                    for d in self.days(start, end)]
+
+        def get_heartrate_range(self, start, end):
+            return [{'dateTime': d, 'value': {'restingHeartRate': 60}}
+                    for d in self.days(start, end)]
+
+    client = Client()
+    export = FitbitExport(str(tmpdir), client)
+    export.sync_daily()
+    days = export.get_daily()
+    ranges = -(-len(days) // MAX_RANGE_DAYS)
+    assert client.calls == ranges * (len(DAILY_RESOURCES) + 1)
+    assert days[0] == dict({r: 10 for r in DAILY_RESOURCES},
+        date='2015-01-01', distance=0.5, restingHeartRate=60)
+
+    client.calls = 0
+    export.sync_daily()
+    assert client.calls == 0
+
+    # scattered missing days share one window
+    data = export.load_daily(2016)
+    for day in ('2016-01-01', '2016-01-03', '2016-01-05'):
+        del data[day]
+    export.write(export.daily_filename(2016), data)
+    export.sync_daily()
+    assert client.calls == len(DAILY_RESOURCES) + 1
+    assert export.load_daily(2016)['2016-01-03']['restingHeartRate'] == 60
+
+
+def test_sync_recent(tmpdir):
+    from datetime import date, timedelta
+    from myfitbit.export import BUFFER_DAYS
+
+    class Client(object):
+        user_id = 'u'
+
+        def __init__(self):
+            self.calls = []
+
+        def get_steps_intraday(self, d, start_time=None, end_time=None):
+            self.calls.append((d, start_time))
+            start = start_time or '00:00'
+            return [{'time': t + ':00', 'value': 1} for t in ('00:00', '00:01', '00:02')
+                    if t >= start]
+
+    today = date.today()
+    old = today - timedelta(days=BUFFER_DAYS + 1)
+    client = Client()
+    export = FitbitExport(str(tmpdir), client, manifest=True)
+    export.write(export.day_filename('steps_intraday', today, partial=True),
+        [{'time': '00:00:00', 'value': 1}])
+    export.write(export.day_filename('steps_intraday', old, partial=True),
+        [{'time': '00:00:00', 'value': 1}, {'time': '00:01:00', 'value': 1}])
+    # left over from a sync long ago
+    stale = today - timedelta(days=10 * BUFFER_DAYS)
+    export.write(export.day_filename('steps_intraday', stale, partial=True),
+        [{'time': '00:00:00', 'value': 1}])
+    export.sync_recent(['steps_intraday'])
+
+    assert (today, '00:01') in client.calls
+    assert (old, '00:02') in client.calls
+    assert (stale, '00:01') in client.calls
+    assert len(client.calls) == BUFFER_DAYS + 3
+    for d in (old, stale):
+        assert not os.path.isfile(export.day_filename('steps_intraday', d, partial=True))
+        assert len(json.load(open(export.day_filename('steps_intraday', d)))) == 3
+    days = export.get_steps_intraday()
+    assert days[0]['date'] == stale.isoformat()
+    assert days[-1]['date'] == today.isoformat()
+    assert days[-1]['minutes'][:4] == [1, 1, 1, None]
+
+
+def test_refresh_partial_month(tmpdir):
+    from datetime import date, timedelta
+    from myfitbit.export import BUFFER_DAYS
+
+    today = date.today()
+    month = date(today.year, today.month, 1)
+
+    class Client(object):
+        user_id = 'u'
+        records = []
+
+        def __init__(self):
+            self.calls = []
+
+        def get_weight_range(self, start, end):
+            self.calls.append((start, end))
+            return [r for r in self.records if start.isoformat() <= r['date'] <= end.isoformat()]
+
+    client = Client()
+    client.records = [{'logId': 1, 'date': month.isoformat(), 'weight': 80}]
+    export = FitbitExport(str(tmpdir), client)
+    export.sync_weight()
+    filename = export.month_filename('weight', month, partial=True)
+    assert json.load(open(filename)) == client.records
+    assert client.calls[-1][0] == month
+
+    # unchanged: only the days since the last pull are fetched, no write
+    writes = []
+    export.write = lambda *args: writes.append(args)
+    client.calls = []
+    export.sync_weight()
+    assert client.calls[-1][0] == max(month, today - timedelta(days=BUFFER_DAYS))
+    assert writes == []
+
+    # a new record is merged with the stored ones
+    del export.write
+    client.records = [{'logId': 2, 'date': today.isoformat(), 'weight': 81}]
+    export.sync_weight()
+    logs = [r['logId'] for r in json.load(open(filename))]
+    assert logs == ([1, 2] if month < today - timedelta(days=BUFFER_DAYS) else [2])
+
+
+def test_parallel_load(tmpdir):
+    pytest.importorskip('numpy')
+    from datetime import date, timedelta
+    from myfitbit.synthetic import generate
+    generate(str(tmpdir), ['u'], date(2018, 1, 1), date(2018, 3, 10),
+        streams=('heartrate_intraday', 'distance_intraday'))
+    export = FitbitExport(str(tmpdir), user_id='u')
+    # a whole chunk of empty days does not end the load
+    for i in range(40):
+        export.write(export.day_filename('heartrate_intraday', date(2018, 1, 1) + timedelta(days=i)), [])
+    serial = export.get_heartrate_intraday()
+    assert serial[0]['date'] == '2018-02-10'
+    assert export.get_heartrate_intraday(processes=2) == serial
+    distance = export.get_distance_intraday(processes=2)
+    assert distance == export.get_distance_intraday()
+    assert [type(m) for m in distance[0]['minutes'][:2]] == [float, float]
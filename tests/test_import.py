@@ -0,0 +1,15 @@
+import subprocess
+import sys
+
+# modules only needed to download data or to write the report
+HEAVY = ('requests', 'http.server', 'webbrowser', 'numpy', 'pkg_resources', 'dominate')
+
+
+def loaded(module):
+    code = 'import sys, {}; print(" ".join(sys.modules))'.format(module)
+    return set(subprocess.check_output([sys.executable, '-c', code]).decode().split())
+
+
+def test_lazy_imports():
+    for module in ('myfitbit', 'myfitbit.export', 'myfitbit.scheduler', 'myfitbit.report'):
+        assert loaded(module).isdisjoint(HEAVY), module
@@ -0,0 +1,51 @@
+import os
+import shutil
+
+from myfitbit.export import FitbitExport
+from myfitbit.manifest import Manifest, parse_filename, PARTIAL
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), '..', 'notebooks', 'example_data')
+
+
+def test_parse_filename():
+    assert parse_filename('sleep.2018.07.partial.json') == ('sleep', '2018-07', True)
+    assert parse_filename('steps_intraday.2018.01.02.json') == ('steps_intraday', '2018-01-02', False)
+    assert parse_filename('manifest.json') is None
+
+
+def test_rebuild_and_verify(tmpdir):
+    shutil.copytree(EXAMPLE, str(tmpdir.join('u')))
+    plain = FitbitExport(str(tmpdir), user_id='u')
+    export = FitbitExport(str(tmpdir), user_id='u', manifest=True)
+    assert os.path.isfile(export.filename('manifest.json'))
+    assert export.manifest.status('sleep', '2018-07') == PARTIAL
+    assert export.get_heartrate_intraday() == plain.get_heartrate_intraday()
+    assert sorted(export.get_sleep(), key=lambda s: s['logId']) == \
+        sorted(plain.get_sleep(), key=lambda s: s['logId'])
+
+    manifest = Manifest(export.filename('manifest.json'))
+    assert manifest.verify(export.filename()) == []
+    tmpdir.join('u', 'weight', '2018', 'weight.2018.01.json').write('[]')
+    os.remove(export.filename('sleep', '2018', 'sleep.2018.02.json'))
+    assert manifest.verify(export.filename()) == [
+        ('weight', '2018-01', 'changed'),
+        ('sleep', '2018-02', 'missing'),
+    ]
+
+
+def test_stale_partial_removed(tmpdir):
+    from datetime import date, timedelta
+    from myfitbit.export import Job
+    export = FitbitExport(str(tmpdir), user_id='u', manifest=True, queue=True)
+    month = (date.today().replace(day=1) - timedelta(days=70)).replace(day=1)
+    export.queue.planned['weight'] = (month - timedelta(days=1)).strftime('%Y-%m')
+    key = month.strftime('%Y-%m')
+    export.save(Job('weight', key, export.month_filename('weight', month), None, ()), [])
+    export.flush()
+    partial_filename = export.month_filename('weight', month, partial=True)
+    with open(partial_filename, 'w') as f:
+        f.write('[]')
+
+    export.sync_ranged_data('weight', lambda start, end: [])
+    assert not os.path.isfile(partial_filename)
+    assert os.path.isfile(export.month_filename('weight', month))
@@ -0,0 +1,79 @@
+from datetime import date, timedelta
+
+import pytest
+import requests
+
+from myfitbit import Fitbit
+from myfitbit.export import FitbitExport, BUFFER_DAYS
+from myfitbit.mockapi import MockFitbit
+from myfitbit.scheduler import Scheduler, RateLimitExceeded
+from myfitbit.synthetic import SyntheticUser
+
+
+@pytest.fixture
+def api():
+    with MockFitbit(error_rate=0.2, truncate_rate=0.2, seed=1) as api:
+        yield api
+
+
+def client(api, user_id='U1'):
+    f = Fitbit(user_id, base_url=api.url, retries=10)
+    f.RETRY_BACKOFF = 0.001
+    return f
+
+
+def test_mock_faults_retried(api):
+    f = client(api)
+    d = date(2018, 1, 1)
+    for i in range(5):
+        assert f.get_heartrate_intraday(d) == SyntheticUser('U1', api.seed).get_heartrate_intraday(d)
+    assert f.user_id == 'U1'
+    assert api.stats[200] == 6
+    assert api.stats['truncated'] and sum(api.stats[s] for s in (500, 502, 503))
+
+
+def test_mock_rate_limit():
+    with MockFitbit(limit=3) as api:
+        f = client(api)
+        for i in range(3):
+            f.get_activities(date(2018, 1, 1))
+        assert f.rate_limit['remaining'] == 0
+        with pytest.raises(requests.HTTPError) as e:
+            f.get_activities(date(2018, 1, 1))
+        assert e.value.response.status_code == 429
+        assert int(e.value.response.headers['Retry-After']) > 3500
+        # the scheduler knows the budget is gone from the headers
+        with pytest.raises(RateLimitExceeded):
+            Scheduler(f).get_activities(date(2018, 1, 1))
+        # other users have their own budget
+        client(api, 'U2').get_activities(date(2018, 1, 1))
+
+
+def test_mock_sync(api, tmpdir):
+    last = date.today() - timedelta(days=BUFFER_DAYS + 1)
+    export = FitbitExport(str(tmpdir), client(api), workers=4, queue=True)
+    export.queue.planned['heartrate_intraday'] = (last - timedelta(days=5)).isoformat()
+    export.sync_heartrate_intraday()
+    days = export.get_heartrate_intraday()
+    assert [d['date'] for d in days] == [(last - timedelta(days=i)).isoformat() for i in range(4, -1, -1)]
+
+
+def test_mock_sync_seconds(tmpdir):
+    np = pytest.importorskip('numpy')
+    from myfitbit import codec, intraday
+    last = date.today() - timedelta(days=BUFFER_DAYS + 1)
+    with MockFitbit() as api:
+        export = FitbitExport(str(tmpdir), client(api), queue=True,
+            resolutions={'heartrate_intraday': '1sec'})
+        export.queue.planned['heartrate_intraday'] = (last - timedelta(days=2)).isoformat()
+        export.sync_heartrate_intraday()
+    filename = export.day_filename('heartrate_intraday', last)
+    assert codec.detect(open(filename, 'rb').read()) == 'series'
+
+    seconds = SyntheticUser('U1').get_heartrate_seconds(last)
+    (d, t, values), = export.iter_seconds('heartrate_intraday', last)
+    assert d == last and len(t) == len(seconds) and values[0] == seconds[0]['value']
+    # the readers see the mean of every minute
+    day, = export.iter_heartrate_intraday(last, last)
+    assert day['minutes'] == intraday.bucket([intraday.downsample(t, values)])[0]
+    assert day['minutes'][t[0] // 60] == round(np.mean(values[t // 60 == t[0] // 60]))
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from myfitbit import report
+
+
+def test_report_lod():
+    minutes = [None] * 1440
+    minutes[0] = 60
+    minutes[1] = 70
+    minutes[600] = 100
+    overview, detail = report.heartrate_lod([{'date': '2018-01-02', 'minutes': minutes}])
+    day = overview[0]
+    assert (day['min'], day['mean'], day['max']) == (60, 76.7, 100)
+    assert len(day['hourly']) == 24
+    assert day['hourly'][0] == 65 and day['hourly'][10] == 100 and day['hourly'][1] is None
+    five = detail['2018-01'][0]
+    assert five['date'] == '2018-01-02' and len(five['mean']) == 288
+    assert five['max'][120] == 100
+
+
+def test_build_data_cached(tmpdir, monkeypatch):
+    import os
+    import shutil
+    from myfitbit.export import FitbitExport, parse_date
+    example = os.path.join(os.path.dirname(__file__), '..', 'notebooks', 'example_data')
+    shutil.copytree(example, str(tmpdir.join('u')))
+    ex = FitbitExport(str(tmpdir), user_id='u')
+    cache_dir = str(tmpdir.join('cache'))
+    detail_dir = str(tmpdir.join('detail'))
+    data = report.build_data(ex, cache_dir, detail_dir)
+    assert len(data['heartrate']) == 200
+    assert os.path.isfile(os.path.join(detail_dir, 'heartrate.2018-03.js'))
+
+    months = []
+    heartrate_lod = report.heartrate_lod
+    def counting_lod(days):
+        days = list(days)
+        months.append(days[0]['date'][:7])
+        return heartrate_lod(days)
+    monkeypatch.setattr(report, 'heartrate_lod', counting_lod)
+
+    filename = ex.day_filename('heartrate_intraday', parse_date('2018-03-05'))
+    os.utime(filename, (0, 0))
+    assert report.build_data(ex, cache_dir, detail_dir) == data
+    assert months == ['2018-03']
+
+
+def test_write_report(tmpdir):
+    import io
+    import os
+    import shutil
+    pytest.importorskip('dominate')
+    from myfitbit.export import FitbitExport
+    example = os.path.join(os.path.dirname(__file__), '..', 'notebooks', 'example_data')
+    shutil.copytree(example, str(tmpdir.join('u')))
+    ex = FitbitExport(str(tmpdir), user_id='u')
+    cache_dir = str(tmpdir.join('cache'))
+    detail_dir = str(tmpdir.join('detail'))
+    f = io.StringIO()
+    report.write_report(f, ex, cache_dir, detail_dir)
+    data = report.build_data(ex, cache_dir, detail_dir)
+    assert f.getvalue() == report.make_report(data, detail_dir)
+    assert '\nvar data = {};\nvar detail_dir = '.format(json.dumps(data)) in f.getvalue()
+
+
+def test_fragment_cache(tmpdir):
+    cache = report.FragmentCache(str(tmpdir))
+    cache.put('sleep', '2018-01', 'a', [1])
+    assert cache.get('sleep', '2018-01', 'a') == [1]
+    assert cache.get('sleep', '2018-01', 'b') is None
+    # an interrupted write is a miss
+    with open(cache.filename('sleep', '2018-01'), 'w') as f:
+        f.write('{"signature": "a", "fra')
+    assert cache.get('sleep', '2018-01', 'a') is None
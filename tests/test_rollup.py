@@ -0,0 +1,56 @@
+import os
+from datetime import date
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from myfitbit.export import FitbitExport
+from myfitbit.rollup import Rollups, period_key, period_range
+from myfitbit.synthetic import generate
+
+
+def test_period_keys():
+    assert period_key('weekly', date(2018, 1, 1)) == '2018-W01'
+    assert period_key('weekly', date(2016, 1, 1)) == '2015-W53'
+    assert period_range('weekly', '2015-W53') == (date(2015, 12, 28), date(2016, 1, 3))
+    assert period_range('monthly', '2016-02') == (date(2016, 2, 1), date(2016, 2, 29))
+
+
+def minutes(export, name, first, last):
+    values = [m for day in export.iter_intraday(name, first, last)
+        for m in day['minutes'] if m is not None]
+    return np.array(values, dtype=float)
+
+
+def test_rollup_update(tmpdir):
+    generate(str(tmpdir), ['u'], date(2018, 1, 20), date(2018, 2, 10),
+        streams=('heartrate_intraday', 'steps_intraday'))
+    export = FitbitExport(str(tmpdir), user_id='u')
+    rollups = Rollups(export)
+    rollups.update(['heartrate_intraday', 'steps_intraday'])
+
+    hr = minutes(export, 'heartrate_intraday', date(2018, 1, 29), date(2018, 2, 4))
+    (key, row), = rollups.query('heartrate_intraday', 'weekly', date(2018, 2, 1), date(2018, 2, 1))
+    assert key == '2018-W05'
+    assert row['count'] == len(hr) and row['sum'] == hr.sum() and row['max'] == hr.max()
+    assert row['p50'] == np.percentile(hr, 50)
+    assert sum(row['zones'].values()) == len(hr)
+    steps = minutes(export, 'steps_intraday', date(2018, 1, 20), date(2018, 1, 31))
+    assert rollups.query('steps_intraday', 'monthly')[0][1]['sum'] == steps.sum()
+
+    # only the periods of changed days are recomputed, from disk
+    assert Rollups(export).update() == 0
+    export.write(export.day_filename('heartrate_intraday', date(2018, 2, 5)),
+        [{'time': '12:00:00', 'value': 200}])
+    os.remove(export.day_filename('heartrate_intraday', date(2018, 2, 10)))
+    rollups = Rollups(export)
+    # two days, their week (the same) and month
+    assert rollups.update() == 4
+    daily = dict(rollups.query('heartrate_intraday'))
+    assert daily['2018-02-05'] == dict(daily['2018-02-05'], count=1, min=200, max=200)
+    assert '2018-02-10' not in daily
+    hr = minutes(export, 'heartrate_intraday', date(2018, 2, 1), date(2018, 2, 28))
+    monthly = dict(rollups.query('heartrate_intraday', 'monthly'))
+    assert monthly['2018-02']['sum'] == hr.sum() and monthly['2018-02']['days'] == 9
+    assert monthly['2018-01']['days'] == 12
@@ -0,0 +1,42 @@
+import time
+
+from myfitbit import roster
+from myfitbit.roster import Orchestrator, Result, User, DONE, DEFERRED, FAILED
+
+
+def fake_sync(user, calls, reset_in):
+    calls.append((user.name, time.time()))
+    if user.name == 'limited' and len([c for c in calls if c[0] == 'limited']) == 1:
+        # blocks nobody else while waiting for its reset
+        return Result(user.name, None, DEFERRED, 150, 0, time.time() + reset_in, None)
+    if user.name == 'broken':
+        return Result(user.name, None, FAILED, 0, 0, None, 'RuntimeError: no token')
+    return Result(user.name, user.name.upper(), DONE, 10, 0, None, None)
+
+
+def test_load_roster(tmpdir):
+    tmpdir.join('roster.ini').write('[alice]\ntoken_file = tokens/alice.json\n\n[bob]\n')
+    users = roster.load_roster(str(tmpdir.join('roster.ini')))
+    assert users == [
+        User('alice', str(tmpdir.join('tokens', 'alice.json'))),
+        User('bob', str(tmpdir.join('.myfitbit_access_token.bob'))),
+    ]
+
+
+def test_orchestrator_defers_limited_user():
+    users = [User(n, None) for n in ('limited', 'a', 'broken', 'b')]
+    calls = []
+    results = Orchestrator(users, (calls, 0.3), pool=1, sync_fn=fake_sync).run()
+    assert [r.status for r in results] == [DEFERRED, DONE, FAILED, DONE]
+    assert len(calls) == 4
+
+
+def test_orchestrator_waits_for_reset():
+    users = [User(n, None) for n in ('limited', 'a', 'b')]
+    calls = []
+    t = time.time()
+    results = Orchestrator(users, (calls, 0.3), pool=1, wait=True, sync_fn=fake_sync).run()
+    assert [r.status for r in results] == [DONE, DONE, DONE]
+    # the others ran before the limited user was resumed
+    assert [name for name, _ in calls] == ['limited', 'a', 'b', 'limited']
+    assert calls[-1][1] - t >= 0.3
@@ -0,0 +1,73 @@
+import os
+import time
+from datetime import date, timedelta
+
+import pytest
+
+from myfitbit.export import FitbitExport, BUFFER_DAYS
+from myfitbit.scheduler import JobQueue, Scheduler, RateLimitExceeded
+
+
+class FakeClient(object):
+    user_id = 'u'
+
+    def __init__(self, fail_after=None):
+        self.calls = []
+        self.fail_after = fail_after
+        self.rate_limit = None
+
+    def get_activities(self, d):
+        if self.fail_after is not None and len(self.calls) >= self.fail_after:
+            raise RateLimitExceeded(time.time() + 3600)
+        self.calls.append(d)
+        return {'date': d.isoformat()}
+
+
+def test_scheduler_exhausted():
+    client = FakeClient()
+    s = Scheduler(client)
+    s.update({'remaining': 0, 'reset': 100, 'time': time.time()})
+    with pytest.raises(RateLimitExceeded):
+        s.get_activities(date(2018, 1, 1))
+    assert client.calls == []
+
+
+def test_scheduler_spreads_requests():
+    client = FakeClient()
+    s = Scheduler(client)
+    s.update({'remaining': 10, 'reset': 1, 'time': time.time()})
+    t = time.time()
+    for i in range(3):
+        s.throttle()
+    # 3 requests out of 10 over one second
+    assert 0.15 < time.time() - t < 0.5
+
+
+def test_queue_resumes(tmpdir):
+    last = date.today() - timedelta(days=BUFFER_DAYS + 1)
+    start = last - timedelta(days=9)
+    export = FitbitExport(str(tmpdir), FakeClient(fail_after=4), queue=True)
+    export.queue.planned['activities'] = (start - timedelta(days=1)).isoformat()
+    with pytest.raises(RateLimitExceeded):
+        export.sync_activities()
+
+    client = FakeClient()
+    export = FitbitExport(str(tmpdir), client, queue=True)
+    assert len(export.queue.pending('activities')) == 6
+    export.sync_activities()
+    assert client.calls == [start + timedelta(days=i) for i in range(4, 10)]
+    assert export.queue.pending('activities') == []
+    assert export.queue.planned['activities'] == last.isoformat()
+
+
+def test_queue_done_log(tmpdir):
+    filename = str(tmpdir.join('queue.json'))
+    queue = JobQueue(filename)
+    queue.plan('sleep', ['2018-01', '2018-02', '2018-01'], '2018-02')
+    queue.save()
+    queue.done('sleep', '2018-01')
+    queue = JobQueue(filename)
+    assert queue.pending('sleep') == ['2018-02']
+    queue.save()
+    assert sorted(os.listdir(str(tmpdir))) == ['queue.json']
+    assert JobQueue(filename).pending('sleep') == ['2018-02']
@@ -0,0 +1,65 @@
+from datetime import date, datetime
+
+from myfitbit.export import FitbitExport
+
+
+def record(log_id, start, end, date_of_sleep):
+    return {
+        'logId': log_id,
+        'startTime': start + '.000',
+        'endTime': end + '.000',
+        'dateOfSleep': date_of_sleep,
+        'levels': {
+            'data': [{'dateTime': start + '.000', 'level': 'light', 'seconds': 60}],
+            'summary': {},
+        },
+    }
+
+
+def make_export(tmpdir):
+    export = FitbitExport(str(tmpdir), user_id='u')
+    export.write(export.month_filename('sleep', date(2018, 1, 1)), [
+        record(1, '2018-01-30T23:00:00', '2018-01-31T07:00:00', '2018-01-31'),
+        record(2, '2018-01-31T14:00:00', '2018-01-31T14:30:00', '2018-01-31'),
+    ])
+    export.write(export.month_filename('sleep', date(2018, 2, 1)), [
+        record(3, '2018-01-31T23:30:00', '2018-02-01T06:00:00', '2018-02-01'),
+    ])
+    # stale leftover of the complete month
+    export.write(export.month_filename('sleep', date(2018, 2, 1), partial=True), [
+        record(3, '2018-01-31T23:30:00', '2018-02-01T05:00:00', '2018-02-01'),
+    ])
+    return export
+
+
+def test_sleep_index(tmpdir):
+    index = make_export(tmpdir).sleep_index()
+    assert [s['logId'] for s in index] == [1, 2, 3]
+    assert 'data' not in index.sessions[0]['levels']
+
+    ids = lambda sessions: [s['logId'] for s in sessions]
+    assert ids(index.overlapping('2018-01-31T06:00:00', '2018-01-31T14:10:00')) == [1, 2]
+    assert ids(index.overlapping(datetime(2018, 1, 31, 15), datetime(2018, 1, 31, 23))) == []
+    assert ids(index.overlapping(datetime(2018, 2, 1, 5, 30), datetime(2018, 3, 1))) == [3]
+    assert index.overlapping('2018-02-01T05:30:00', '2018-03-01')[0]['endTime'] == '2018-02-01T06:00:00.000'
+    assert ids(index.on_date(date(2018, 1, 31))) == [1, 2]
+    assert ids(index.on_date('2018-02-02')) == []
+
+    assert index.levels(index.sessions[1]) == [
+        {'dateTime': '2018-01-31T14:00:00.000', 'level': 'light', 'seconds': 60}]
+
+
+def test_sleep_index_cached(tmpdir):
+    export = make_export(tmpdir)
+    export.sleep_index()
+    read = []
+    export.read = lambda filename: read.append(filename) or FitbitExport.read(filename)
+    assert len(export.sleep_index()) == 3
+    assert read == []
+
+    export.write(export.month_filename('sleep', date(2018, 3, 1)), [
+        record(4, '2018-03-01T23:00:00', '2018-03-02T07:00:00', '2018-03-02')])
+    del read[:]
+    index = export.sleep_index()
+    assert len(index) == 4
+    assert read == [export.month_filename('sleep', date(2018, 3, 1))]
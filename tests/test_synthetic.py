@@ -0,0 +1,31 @@
+from datetime import date
+
+from myfitbit.export import FitbitExport
+from myfitbit.manifest import Manifest
+from myfitbit.synthetic import SyntheticUser, generate
+
+
+def test_generate(tmpdir):
+    count = generate(str(tmpdir), ['A', 'B'], date(2018, 1, 30), date(2018, 2, 2))
+    # 4 day streams x 4 days + 2 months of sleep and weight, per user
+    assert count == 2 * (4 * 4 + 2 * 2)
+
+    ex = FitbitExport(str(tmpdir), user_id='A')
+    days = ex.get_heartrate_intraday()
+    assert [d['date'] for d in days] == ['2018-01-30', '2018-01-31', '2018-02-01', '2018-02-02']
+    assert all(30 < v < 220 for d in days for v in d['minutes'] if v is not None)
+    assert [s['dateOfSleep'] for s in ex.get_sleep()] == [d['date'] for d in days]
+    assert ex.get_activities()[0]['summary']['steps'] > 0
+
+    # a valid store
+    m = Manifest(ex.filename('manifest.json'))
+    m.rebuild(ex.filename())
+    assert m.verify(ex.filename()) == []
+
+
+def test_deterministic():
+    a = SyntheticUser('A').get_steps_intraday(date(2018, 1, 1))
+    b = SyntheticUser('A')
+    b.get_steps_intraday(date(2018, 5, 1))
+    assert b.get_steps_intraday(date(2018, 1, 1)) == a
+    assert SyntheticUser('A', seed=1).get_steps_intraday(date(2018, 1, 1)) != a